@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""Measure how many receivers the measurement path can keep up with.
+
+Feeds synthetic I/Q hops through MultiParametersManager, first with every
+receiver in a thread of this process (how signal_logger runs by default),
+then through a DSPWorkerPool, and reports receivers per core for each.
+
+With --suite, drives synthetic signals whose statistics are known exactly
+(a CW carrier, Rayleigh fading, and noise just above NO_INPUT; as I/Q and as
+AM) through the same math, reporting time per stage, peak memory, and how
+far RMS and percentiles land from their true values. It exits non-zero if
+any are further off than sampling error explains.
+
+With --nmea, times the GPS parser over an NMEA corpus instead (a recorded
+file, or "synthetic"), against the parser Signal Logger used to have."""
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import threading
+import tracemalloc
+from time import perf_counter, sleep
+
+import nmea
+import signal_logger as sl
+
+
+def synth_hop(frames, chnls=2, level=0.01, seed=1):
+    """Gaussian noise I/Q, raw interleaved float32 bytes, like PyAudio's"""
+    rng = random.Random(seed)
+    if sl.np is not None:
+        x = sl.np.random.default_rng(seed).standard_normal(frames*chnls)
+        return (x*level).astype(sl.SAMPLE_DTYPE).tobytes()
+    return struct.pack("=%d%s" % (frames*chnls, sl.SAMPLE_FORMAT),
+                       *[rng.gauss(0, level) for i in range(frames*chnls)])
+
+def make_receivers(n, args):
+    return [sl.MultiParametersManager(ach=(i % 3) - 1, dsp=args.dsp,
+                                      pct_mode=args.mode, sr=args.sample_rate,
+                                      cs=args.chunk_size, hop=args.hop)
+            for i in range(n)]
+
+def bench_threads(data, args):
+    """Each receiver decodes and reduces every hop in its own thread, as
+AudioCapture does without worker processes. Returns receiver-hops/s."""
+    mpms = make_receivers(args.receivers, args)
+    def run(mpm):
+        for i in range(args.hops): mpm.feed(data)
+    threads = [threading.Thread(target=run, args=(m,)) for m in mpms]
+    t0 = perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return args.receivers*args.hops/(perf_counter() - t0)
+
+def bench_pool(data, args):
+    """Every hop goes through a DSPWorkerPool. Returns receiver-hops/s."""
+    mpms = make_receivers(args.receivers, args)
+    pool = sl.DSPWorkerPool(args.workers, len(data), mpms[0].dsp)
+    pool.start()
+    for m in mpms: pool.register(m)
+    subs = [m.subscribe(maxsize=args.hops + 1) for m in mpms]
+    # one hop through each worker first, so process start-up is not timed
+    pool.submit(data, mpms)
+    for q in subs: q.get()
+    t0 = perf_counter()
+    for i in range(args.hops):
+        while not pool.submit(data, mpms): sleep(0.0002)
+    for q in subs:
+        for i in range(args.hops): q.get()
+    dt = perf_counter() - t0
+    pool.stop()
+    return args.receivers*args.hops/dt
+
+SIGNALS = ("cw", "rayleigh", "floor")
+
+def signal_level(kind):
+    """CW amplitude, or the Rayleigh scale parameter: -40 dBFS, except for
+"floor", which puts the noise right on top of NO_INPUT"""
+    return 1.2*sl.NO_INPUT if kind == "floor" else 0.01
+
+def synth_signal(kind, frames, am=False, seed=1):
+    """One hop of a synthetic signal as raw interleaved float32 stereo, like
+PyAudio's: I/Q, or with am, the envelope on the left channel (what an AM
+detector puts out) and silence on the right. "cw" is a constant-amplitude
+carrier; "rayleigh" and "floor" are complex Gaussian noise, i.e. Rayleigh
+fading."""
+    level = signal_level(kind)
+    if sl.np is not None:
+        np = sl.np
+        rng = np.random.default_rng(seed)
+        if kind == "cw":
+            ph = rng.uniform(0, 2*math.pi) + 0.05*np.arange(frames)
+            i, q = level*np.cos(ph), level*np.sin(ph)
+        else:
+            i, q = level*rng.standard_normal((2, frames))
+        if am: i, q = np.hypot(i, q), np.zeros(frames)
+        return np.stack([i, q], axis=1).astype(sl.SAMPLE_DTYPE).tobytes()
+    rng = random.Random(seed)
+    out = []
+    ph = rng.uniform(0, 2*math.pi)
+    for k in range(frames):
+        if kind == "cw":
+            i, q = level*math.cos(ph + 0.05*k), level*math.sin(ph + 0.05*k)
+        else: i, q = rng.gauss(0, level), rng.gauss(0, level)
+        out.extend((math.hypot(i, q), 0.) if am else (i, q))
+    return struct.pack("=%d%s" % (len(out), sl.SAMPLE_FORMAT), *out)
+
+def true_level(kind, q):
+    """Magnitude exceeded a fraction q of the time by the samples that
+survive the NO_INPUT floor. Rayleigh magnitudes above a are distributed as
+sqrt(a^2 + 2 s^2 E), with E exponential, whatever a is."""
+    s = signal_level(kind)
+    if kind == "cw": return s
+    return math.sqrt(sl.NO_INPUT**2 - 2*s*s*math.log(q))
+
+def true_kept(kind):
+    """Fraction of samples above the NO_INPUT floor"""
+    s = signal_level(kind)
+    if kind == "cw": return 1.
+    return math.exp(-sl.NO_INPUT**2/(2*s*s))
+
+def truth(kind, pctl, cal, n, steps=20000):
+    """Exact RMS (mean power in dBm) and percentile levels, each with the
+standard error a window of n valid samples has"""
+    db = lambda q: sl.pwr_conv(true_level(kind, q), cal)
+    p = [true_level(kind, (k + 0.5)/steps)**2 for k in range(steps)]
+    m1 = sum(p)/steps
+    m2 = sum(x*x for x in p)/steps
+    rms = sl.power_db(m1, cal)
+    rms_se = 10/math.log(10)*math.sqrt(max(m2 - m1*m1, 0.)/n)/m1
+    pct = {}
+    for p in pctl:
+        if p <= 0 or p >= 100: continue # extremes have no fixed value
+        q = p/100.
+        slope = (db(q*1.001) - db(q*0.999))/(q*0.002)
+        pct[p] = (db(q), abs(slope)*math.sqrt(q*(1 - q)/n))
+    return rms, rms_se, pct
+
+def run_signal(kind, am, args):
+    """Feed args.hops hops of one signal through a receiver the way
+MultiParametersManager.feed does, timing each stage. Returns the timings
+(per hop), the receiver, and its peak traced memory, measured in a second
+pass from creating the receiver to its window filling up."""
+    def receiver():
+        return sl.MultiParametersManager(ach=0 if am else -1, dsp=args.dsp,
+                                         pct_mode=args.mode,
+                                         sr=args.sample_rate,
+                                         cs=args.chunk_size, hop=args.hop)
+    mpm = receiver()
+    hops = [synth_signal(kind, args.hop, am, seed) \
+            for seed in range(max(args.hops, mpm.pa_win.hops + 1))]
+    t = {"decode":0., "power":0., "stats":0.}
+    for data in hops:
+        t0 = perf_counter()
+        frames = mpm.decode(data, mpm.pa_chnls)
+        t1 = perf_counter()
+        x = mpm.power(frames, mpm.ach, mpm.floor)
+        t2 = perf_counter()
+        mpm.pa_win.push(x)
+        mpm.publish(mpm.cal)
+        t3 = perf_counter()
+        t["decode"] += t1 - t0
+        t["power"] += t2 - t1
+        t["stats"] += t3 - t2
+    tracemalloc.start()
+    traced = receiver()
+    for data in hops[:traced.pa_win.hops + 1]: traced.feed(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {k: v/len(hops) for k, v in t.items()}, mpm, peak
+
+def bench_suite(args):
+    """Speed and accuracy of every signal, as I/Q and as AM. Returns False
+if any result is further from the truth than it should be."""
+    hop_s = args.hop/args.sample_rate
+    print("%d Hz, window %d frames, hop %d frames (%.3f s), %s DSP, %s "
+          "mode" % (args.sample_rate, args.chunk_size, args.hop, hop_s,
+                    args.dsp, args.mode))
+    print("signal   input Msamples/s  xRT  decode  power  stats    peak  "
+          "RMS err  pct err   (limit)  valid")
+    ok = True
+    for kind in SIGNALS:
+        for am in (False, True):
+            t, mpm, peak = run_signal(kind, am, args)
+            # histogram values are bin centres; sliding windows always
+            # keep a histogram
+            tol = mpm.pct_res if mpm.pa_win.mode == "histogram" else 0.
+            m = mpm.snapshot()
+            per_hop = sum(t.values())
+            n = m.samples
+            window = len(mpm.pa_win.ring)*args.hop # whole hops, so >= cs
+            rms, rms_se, pct = truth(kind, m.pctl, m.cal, max(n, 1))
+            rms_err = abs(m.rms - rms)
+            # the percentile furthest off, relative to how far it may be
+            worst = max([(abs(m.at(p) - v) if m.values is not None else 1e9,
+                          4*se + tol + 1e-3) for p, (v, se) in pct.items()],
+                        key=lambda e: e[0]/e[1])
+            n_true = true_kept(kind)*window
+            n_lim = 5*math.sqrt(max(n_true*(1 - true_kept(kind)), 1.)) + 1
+            good = rms_err <= 4*rms_se + 1e-3 and worst[0] <= worst[1] \
+                   and abs(n - n_true) <= n_lim
+            ok = ok and good
+            print("%-8s %-5s %10.2f %5.0f %5.1f%% %5.1f%% %5.1f%% %5.1f MB "
+                  "%7.3f %8.3f %9.3f  %5.1f%% %s" % \
+                  (kind, "AM" if am else "I/Q", args.hop/per_hop/1e6,
+                   hop_s/per_hop, 100*t["decode"]/per_hop,
+                   100*t["power"]/per_hop, 100*t["stats"]/per_hop,
+                   peak/2**20, rms_err, worst[0], worst[1],
+                   100.*n/window, "" if good else "FAIL"))
+    return ok
+
+def synth_nmea(n, seed=1):
+    """n lines of plausible NMEA: GGA, RMC, VTG plus GSA/GSV noise, from a
+mix of talkers, as a multi-constellation receiver would send them"""
+    rng = random.Random(seed)
+    out = []
+    lat, lon = 4530.0, 12230.0
+    def sentence(body):
+        return ("$%s*%02X\r\n" % (body, nmea.checksum(body.encode()))).encode()
+    for i in range(n // 6):
+        lat += rng.uniform(0, 0.01)
+        lon += rng.uniform(0, 0.01)
+        t = "%02d%02d%05.2f" % ((i // 3600) % 24, (i // 60) % 60, i % 60)
+        talker = rng.choice(("GP", "GN"))
+        out.append(sentence("%sGGA,%s,%09.4f,N,%010.4f,W,1,09,0.9,50.1,M,,M,,"\
+                            % (talker, t, lat, lon)))
+        out.append(sentence("%sRMC,%s,A,%09.4f,N,%010.4f,W,%.1f,%.1f,"
+                            "160926,,,A" % (talker, t, lat, lon,
+                                            rng.uniform(0, 60),
+                                            rng.uniform(0, 360))))
+        out.append(sentence("%sVTG,%.1f,T,,M,%.1f,N,%.1f,K,A" % \
+                            (talker, rng.uniform(0, 360), 20., 37.)))
+        out.append(sentence("GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1"))
+        out.append(sentence("GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,"
+                            "010,00,13,06,292,00"))
+        out.append(sentence("GLGSV,2,1,08,65,31,042,30,66,61,315,35,74,22,"
+                            "141,21,75,48,198,33"))
+    return out
+
+def legacy_checksum(lines):
+    """The original loop's checksum alone, byte by byte; returns how many
+lines were good"""
+    good = 0
+    for l in lines:
+        cs_idx = l.find(b"*")
+        if cs_idx == -1: continue
+        cs = 0
+        for c in l[1:cs_idx]:
+            cs = cs ^ c
+        try: good += int(l[cs_idx+1:cs_idx+3], 16) == cs
+        except ValueError: pass
+    return good
+
+def nmea_checksum(lines):
+    """legacy_checksum, done as NMEAParser.feed does it"""
+    good = 0
+    for l in lines:
+        star = l.rfind(b"*")
+        if star == -1: continue
+        try: good += int(l[star+1:star+3], 16) == nmea.checksum(l[1:star])
+        except ValueError: pass
+    return good
+
+def legacy_nmea(lines):
+    """Signal Logger's original parser loop, minus the serial port: checksum
+every line byte by byte, decode it, and keep only $GPGGA positions. Returns
+the number of fixes and the last one."""
+    fixes = 0
+    last = None
+    for l in lines:
+        cs_idx = l.find(b"*")
+        if cs_idx == -1: continue
+        cs = 0
+        for c in l[1:cs_idx]:
+            cs = cs ^ c
+        l = l.decode("ascii", "ignore")
+        cs_idx = (l.find("*"), l.find("\r"))
+        if cs_idx[0] == -1 or cs_idx[1] == -1: continue
+        try:
+            if int(l[cs_idx[0]+1:cs_idx[1]], 16) != cs: continue
+        except ValueError: continue
+        if not l.startswith("$GPGGA,"): continue
+        l = l.strip('\r\n').split(',')
+        if not l[2]: continue
+        lat = (int(l[2][:2])+float(l[2][2:])/60)*(-1 if l[3] == 'S' else 1)
+        lon = (int(l[4][:3])+float(l[4][3:])/60)*(-1 if l[5] == 'W' else 1)
+        fixes += 1
+        last = (lat, lon)
+    return fixes, last
+
+def bench_nmea(corpus):
+    if corpus == "synthetic": lines = synth_nmea(600000)
+    else:
+        with open(corpus, "rb") as f: lines = f.readlines()
+    print("NMEA corpus: %d lines" % len(lines))
+    # the old parser only ever decoded $GPGGA; time both on just those too,
+    # for a like-for-like figure, since nmea also decodes RMC and VTG
+    gga = [l for l in lines if l.startswith(b"$GPGGA,")]
+    # checksums alone: what the old loop spent most of its time on
+    for name, check in (("legacy", legacy_checksum), ("nmea", nmea_checksum)):
+        t0 = perf_counter()
+        good = check(lines)
+        print("checksums   %-7s %8.0f lines/s, %d good" % \
+              (name + ":", len(lines)/(perf_counter() - t0), good))
+    for name, corpus in (("all lines", lines), ("$GPGGA only", gga)):
+        if not corpus: continue
+        t0 = perf_counter()
+        fixes, last = legacy_nmea(corpus)
+        dt = perf_counter() - t0
+        print("%-11s legacy: %8.0f lines/s, %d GPGGA fixes, last at %s" % \
+              (name, len(corpus)/dt, fixes,
+               "%.5f, %.5f" % last if last else "none"))
+        p = nmea.NMEAParser()
+        t0 = perf_counter()
+        fixes = sum(1 for l in corpus if p.feed(l) is not None)
+        dt = perf_counter() - t0
+        print("%-11s nmea:   %8.0f lines/s, %d updates from %d sentences, "
+              "%d bad checksums" % (name, len(corpus)/dt, fixes, p.sentences,
+                                    p.bad_checksum))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--receivers", type=int, default=4)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--hops", type=int, default=20, help="hops per receiver")
+    ap.add_argument("--sample-rate", type=int, default=32000)
+    ap.add_argument("--chunk-size", type=int, default=32768)
+    ap.add_argument("--hop", type=int, default=None)
+    ap.add_argument("--mode", default=sl.PCT_MODE, choices=sl.PCT_MODES)
+    ap.add_argument("--dsp", default=sl.DSP_BACKEND, choices=sl.DSP_BACKENDS)
+    ap.add_argument("--suite", action="store_true",
+                    help="speed and accuracy on synthetic signals")
+    ap.add_argument("--nmea", metavar="CORPUS",
+                    help="benchmark NMEA parsing over a file, or 'synthetic'")
+    args = ap.parse_args()
+    if args.nmea:
+        bench_nmea(args.nmea)
+        return
+    if args.hop is None: args.hop = args.chunk_size
+    if args.suite:
+        if not bench_suite(args): sys.exit(1)
+        return
+    hop_s = args.hop/args.sample_rate
+    data = synth_hop(args.hop)
+    print("%d receivers, %d Hz, hop %d frames (%.3f s), %s DSP, %s mode" % \
+          (args.receivers, args.sample_rate, args.hop, hop_s, args.dsp,
+           args.mode))
+    # receiver-hops/s * seconds per hop = receivers kept in real time
+    rt = bench_threads(data, args)*hop_s
+    print("threads: %7.1f receivers in real time, %7.1f per core (1 core)" % \
+          (rt, rt))
+    if sl.shared_memory is None:
+        print("pool:    needs Python 3.8 or later")
+        return
+    rt = bench_pool(data, args)*hop_s
+    print("pool:    %7.1f receivers in real time, %7.1f per core (%d cores)" \
+          % (rt, rt/args.workers, args.workers))
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
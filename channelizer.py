@@ -0,0 +1,94 @@
+"""Split one wideband I/Q stream into narrowband channels.
+
+Each hop of I/Q is cut into Hann-windowed FFT frames overlapping by half,
+carrying the remainder over to the next hop so that no samples are lost at
+hop boundaries. Each channel's power is the sum of the FFT bins within its
+offset +/- bandwidth/2, scaled so that a signal entirely inside the channel
+reads the same RMS amplitude as it would on the wideband input. Every
+channel's consumer is then fed one amplitude per FFT frame, as a
+single-column block of frames, exactly as if it were a mono input: the
+usual power, window statistics and logging take it from there.
+
+Needs NumPy."""
+
+from time import perf_counter
+
+import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CHANNELIZER_FFT = 1024 # bins per FFT frame; frames advance by half of this
+
+
+def channel_bins(offset, bandwidth, sr, fft_size):
+    """Mask of the FFT bins (in np.fft order) whose centres lie within
+offset +/- bandwidth/2 Hz"""
+    freqs = np.fft.fftfreq(fft_size, 1./sr)
+    return np.abs(freqs - offset) <= bandwidth/2.
+
+
+class Channelizer(object):
+    """Feeds narrowband channels of the I/Q hops given to feed_frames to
+their consumers (anything with a feed_frames(frames, end), normally a
+MultiParametersManager). sr is read from parent when a channel is added,
+so the parent may still be settling its sample rate (WAV inputs) until
+then."""
+    def __init__(self, parent, fft_size=CHANNELIZER_FFT):
+        if np is None: raise ImportError("The channelizer needs NumPy")
+        self.parent = parent
+        self.n = fft_size
+        self.step = fft_size // 2
+        self.window = np.hanning(fft_size)
+        # bin power to time-domain power: Parseval, and the window's energy
+        self.scale = 1./(fft_size*np.dot(self.window, self.window))
+        self.offsets = np.arange(fft_size)
+        self.channels = () # ((offset, bandwidth, consumer), ...)
+        self.weights = None # (fft_size, channels) bin masks, with channels
+        self.tail = np.zeros(0, np.complex128)
+        self.t_fft = metrics.Timing() # the FFT and channel sums per hop
+
+    def add(self, offset, bandwidth, consumer):
+        sr = self.parent.pa_sr
+        if abs(offset) + bandwidth/2. > sr/2.:
+            raise ValueError("Channel %+g Hz, %g Hz wide, is outside "
+                             "+/-%g Hz" % (offset, bandwidth, sr/2.))
+        if not channel_bins(offset, bandwidth, sr, self.n).any():
+            raise ValueError("Channel %+g Hz is narrower than one %g Hz "
+                             "bin" % (offset, float(sr)/self.n))
+        self.update(self.channels + ((offset, bandwidth, consumer),))
+
+    def remove(self, consumer):
+        self.update(tuple(c for c in self.channels if c[2] is not consumer))
+
+    def update(self, channels):
+        sr = self.parent.pa_sr
+        if channels:
+            weights = np.stack([channel_bins(o, bw, sr, self.n) \
+                                for o, bw, c in channels], axis=1)
+            weights = weights.astype(np.float64)
+        else: weights = None
+        # swapped together, so feed_frames never sees one without the other
+        self.weights, self.channels = weights, channels
+
+    def feed_frames(self, frames, end=None):
+        """Take one hop of decoded I/Q (either backend's layout), and feed
+each channel its amplitude in every FFT frame completed by it"""
+        weights, channels = self.weights, self.channels
+        if weights is None: return
+        t0 = perf_counter()
+        if isinstance(frames, list): # pure-Python decode: one list per channel
+            x = np.asarray(frames[0]) + 1j*np.asarray(frames[1])
+        else: x = frames[:, 0] + 1j*frames[:, 1]
+        buf = np.concatenate((self.tail, x)) if len(self.tail) else x
+        count = (len(buf) - self.n)//self.step + 1 if len(buf) >= self.n else 0
+        self.tail = buf[count*self.step:]
+        idx = np.arange(count)[:, None]*self.step + self.offsets
+        spec = np.fft.fft(buf[idx]*self.window, axis=1)
+        amp = np.sqrt(np.dot(spec.real**2 + spec.imag**2, weights)*self.scale)
+        self.t_fft.add(perf_counter() - t0)
+        for i, (offset, bandwidth, consumer) in enumerate(channels):
+            consumer.feed_frames(amp[:, i:i+1], end)
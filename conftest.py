@@ -0,0 +1,7 @@
+"""pytest setup: the tests import Signal Logger's modules from here, the
+directory they live in, as the scripts themselves do."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
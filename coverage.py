@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Bin Signal Logger logs into a coverage grid.
+
+Streams any number of text or binary logs, drops every positioned row into
+a grid cell (fixed lat/lon steps, or a geohash), and keeps per-cell
+aggregates that are updated one row at a time: count, mean, and a 0.5 dB
+histogram from which the median and other quantiles are read. Memory
+grows with the number of cells covered, never with the number of rows.
+Files are split into pieces that are binned on every core, then merged.
+The result is a CSV grid ready for a heat map, or a KML overlay."""
+
+import math
+import multiprocessing
+import os
+import sys
+
+import siglog
+from siglog import np
+
+
+HIST_RES = 0.5 # dB per histogram bin in each cell
+PIECE_BYTES = 32*2**20 # text logs are binned in pieces of about this size
+PIECE_ROWS = 2**20 # binary logs, likewise, in rows
+GEOHASH_CHARS = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lon, precision=7):
+    """Standard geohash of a point; precision 7 is about 150 m square"""
+    lat_rng = [-90., 90.]
+    lon_rng = [-180., 180.]
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(out) < precision:
+        rng, v = (lon_rng, lon) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1])/2
+        ch <<= 1
+        if v >= mid:
+            ch |= 1
+            rng[0] = mid
+        else: rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(GEOHASH_CHARS[ch])
+            bits = 0
+            ch = 0
+    return ''.join(out)
+
+def geohash_bounds(gh):
+    """(south, west, north, east) of a geohash cell"""
+    lat_rng = [-90., 90.]
+    lon_rng = [-180., 180.]
+    even = True
+    for c in gh:
+        ch = GEOHASH_CHARS.index(c)
+        for bit in (16, 8, 4, 2, 1):
+            rng = lon_rng if even else lat_rng
+            mid = (rng[0] + rng[1])/2
+            if ch & bit: rng[0] = mid
+            else: rng[1] = mid
+            even = not even
+    return lat_rng[0], lon_rng[0], lat_rng[1], lon_rng[1]
+
+
+class Grid(object):
+    """Per-cell aggregates. Cells are [count, sum of dB, {bin: count}]."""
+    def __init__(self, step=None, precision=None, res=HIST_RES):
+        self.step = step # degrees, for a plain lat/lon grid
+        self.precision = precision # geohash length, used instead of step
+        self.res = res
+        self.cells = {}
+
+    def key(self, lat, lon):
+        if self.precision: return geohash(lat, lon, self.precision)
+        return (int(math.floor(lat/self.step)),
+                int(math.floor(lon/self.step)))
+
+    def bounds(self, key):
+        """(south, west, north, east) of a cell"""
+        if self.precision: return geohash_bounds(key)
+        return (key[0]*self.step, key[1]*self.step,
+                (key[0] + 1)*self.step, (key[1] + 1)*self.step)
+
+    def add(self, key, dbm, n=1, total=None):
+        """Count n rows of level dbm (whose levels sum to total) into key"""
+        cell = self.cells.get(key)
+        if cell is None: cell = self.cells[key] = [0, 0., {}]
+        b = int(math.floor(dbm/self.res))
+        cell[0] += n
+        cell[1] += dbm*n if total is None else total
+        cell[2][b] = cell[2].get(b, 0) + n
+
+    def merge(self, cells):
+        """Fold in cells binned elsewhere (another piece or process)"""
+        for key, (n, total, hist) in cells.items():
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = [n, total, dict(hist)]
+                continue
+            cell[0] += n
+            cell[1] += total
+            for b, c in hist.items(): cell[2][b] = cell[2].get(b, 0) + c
+
+    def quantile(self, key, q):
+        """Level below which fraction q of a cell's rows fall (bin centre)"""
+        n, total, hist = self.cells[key]
+        k = q*(n - 1)
+        cum = 0
+        for b in sorted(hist):
+            cum += hist[b]
+            if cum > k: return (b + 0.5)*self.res
+
+
+def metric_of(row, metric):
+    return row.rms if metric == "rms" else row.at(metric)
+
+def text_pieces(fn):
+    size = os.path.getsize(fn)
+    return [(fn, "text", start, min(size, start + PIECE_BYTES)) \
+            for start in range(0, max(size, 1), PIECE_BYTES)]
+
+def binary_pieces(fn):
+    log = siglog.BinaryLog(fn)
+    with open(fn, "rb") as f:
+        f.seek(0, 2)
+        rows = (f.tell() - log.header_size) // log.row.size
+    return [(fn, "binary", start, min(rows, start + PIECE_ROWS)) \
+            for start in range(0, max(rows, 1), PIECE_ROWS)]
+
+def pieces(fn):
+    with open(fn, "rb") as f: binary = f.read(4) == siglog.MAGIC
+    return binary_pieces(fn) if binary else text_pieces(fn)
+
+def text_rows(fn, start, end):
+    """Rows of a text log whose lines start within [start, end)"""
+    with open(fn, "rb") as f:
+        pos = start
+        if start:
+            # the line under way belongs to the previous piece, unless it
+            # starts right at start: look from the byte before
+            f.seek(start - 1)
+            pos += len(f.readline()) - 1
+        else: f.seek(start)
+        while pos < end:
+            l = f.readline()
+            if not l: break
+            pos += len(l)
+            r = siglog.parse_text_line(l.decode("ascii", "replace"))
+            if r is not None: yield r
+
+def bin_piece(args):
+    """Bin one piece of one file; returns Grid.cells for merging"""
+    (fn, kind, start, end), step, precision, res, metric = args
+    grid = Grid(step, precision, res)
+    if kind == "binary" and np is not None and not precision:
+        bin_array(grid, siglog.BinaryLog(fn), start, end, metric)
+        return grid.cells
+    if kind == "binary":
+        rows = siglog.BinaryLog(fn).rows(start, end)
+    else: rows = text_rows(fn, start, end)
+    for r in rows:
+        if r.lat or r.lon:
+            grid.add(grid.key(r.lat, r.lon), metric_of(r, metric))
+    return grid.cells
+
+def bin_array(grid, log, start, end, metric):
+    """bin_piece for binary logs with NumPy: every row at once"""
+    a = log.array()[start:end]
+    a = a[(a["lat"] != 0) | (a["lon"] != 0)]
+    if not len(a): return
+    if metric == "rms": v = a["rms"].astype(np.float64)
+    else: v = a["values"][:, log.pctl.index(metric)].astype(np.float64)
+    keys = np.stack([np.floor(a["lat"]/grid.step),
+                     np.floor(a["lon"]/grid.step),
+                     np.floor(v/grid.res)], axis=1).astype(np.int64)
+    uniq, inv, counts = np.unique(keys, axis=0, return_inverse=True,
+                                  return_counts=True)
+    sums = np.bincount(inv.ravel(), weights=v)
+    for (ilat, ilon, b), n, total in zip(uniq.tolist(), counts.tolist(),
+                                         sums.tolist()):
+        grid.add((ilat, ilon), (b + 0.5)*grid.res, n, total)
+
+def bin_logs(fns, step=0.001, precision=None, res=HIST_RES, metric="rms",
+             workers=None):
+    """A Grid of every positioned row in fns, binned on workers processes"""
+    grid = Grid(step, precision, res)
+    work = [(p, step, precision, res, metric) for fn in fns \
+            for p in pieces(fn)]
+    if workers == 1 or len(work) == 1:
+        for w in work: grid.merge(bin_piece(w))
+        return grid
+    with multiprocessing.Pool(workers) as pool:
+        for cells in pool.imap_unordered(bin_piece, work):
+            grid.merge(cells)
+    return grid
+
+def write_csv(grid, out, stats=(0.5,)):
+    out.write("lat,lon,south,west,north,east,count,mean,%s\n" % \
+              ','.join(["q%g" % (q*100) for q in stats]))
+    for key in sorted(grid.cells):
+        s, w, n, e = grid.bounds(key)
+        cnt, total, hist = grid.cells[key]
+        out.write("%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%d,%.2f,%s\n" % \
+                  ((s + n)/2, (w + e)/2, s, w, n, e, cnt, total/cnt,
+                   ','.join(["%.2f" % grid.quantile(key, q) for q in stats])))
+
+def write_kml(grid, out, name="Coverage", q=0.5):
+    """Cells as squares, coloured like siglog's points by quantile q"""
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+              '<name>%s</name>\n' % siglog.xml_escape(name))
+    for i, (level, colour) in enumerate(siglog.KML_LEVELS):
+        out.write('<Style id="l%d"><LineStyle><width>0</width></LineStyle>'
+                  '<PolyStyle><color>%s</color></PolyStyle></Style>\n' % \
+                  (i, "99" + colour[2:])) # translucent, to see the map
+    for key in grid.cells:
+        s, w, n, e = grid.bounds(key)
+        dbm = grid.quantile(key, q)
+        out.write('<Placemark><description>%.1f dBm, %d rows</description>'
+                  '<styleUrl>#l%d</styleUrl><Polygon><outerBoundaryIs>'
+                  '<LinearRing><coordinates>%.6f,%.6f %.6f,%.6f %.6f,%.6f '
+                  '%.6f,%.6f %.6f,%.6f</coordinates></LinearRing>'
+                  '</outerBoundaryIs></Polygon></Placemark>\n' % \
+                  (dbm, grid.cells[key][0], siglog.level_style(dbm),
+                   w, s, e, s, e, n, w, n, w, s))
+    out.write('</Document></kml>\n')
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Bin Signal Logger logs into a \
+coverage grid")
+    ap.add_argument("logs", nargs="+")
+    ap.add_argument("-o", "--output", help="CSV, or KML if it ends in .kml \
+(default: CSV on stdout)")
+    ap.add_argument("--cell", type=float, default=0.001,
+                    help="grid step in degrees (default 0.001)")
+    ap.add_argument("--geohash", type=int, default=None, metavar="N",
+                    help="bin by N-character geohash instead")
+    ap.add_argument("--metric", default="rms",
+                    help="'rms', or a logged percentile such as 50")
+    ap.add_argument("--stats", default="10,50,90",
+                    help="cell quantiles to report, in %% (default 10,50,90)")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="processes (default: one per core)")
+    args = ap.parse_args()
+    metric = args.metric
+    if metric != "rms":
+        metric = float(metric)
+        if metric == int(metric): metric = int(metric)
+    stats = [float(q)/100 for q in args.stats.split(',')]
+    grid = bin_logs(args.logs, args.cell, args.geohash, metric=metric,
+                    workers=args.workers)
+    print("%d cells from %d rows" % \
+          (len(grid.cells), sum(c[0] for c in grid.cells.values())),
+          file=sys.stderr)
+    out = open(args.output, "w") if args.output else sys.stdout
+    if args.output and args.output.lower().endswith(".kml"):
+        write_kml(grid, out, name=', '.join(args.logs),
+                  q=0.5 if 0.5 in stats else stats[0])
+    else: write_csv(grid, out, stats)
+    if args.output: out.close()
+
+if __name__ == "__main__": main()
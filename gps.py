@@ -0,0 +1,323 @@
+"""GPS sources for Signal Logger, all read by one asyncio event loop.
+
+A source is a serial port (or anything else pyserial opens by URL), a TCP
+socket carrying raw NMEA, as from a phone app or a serial-to-network
+bridge, or gpsd, spoken to in its JSON protocol. Each runs as a task on one
+EventLoop thread, however many there are; only opening a serial port (and,
+without POSIX, reading one) blocks, so that is left to the loop's executor.
+Every line read is handed, with
+the monotonic time it arrived, to the source's handler, which parses it
+with the source's parser: an nmea.NMEAParser, or a GPSDParser for gpsd.
+
+A source that fails, or goes GPS_READ_TIMEOUT seconds without a sentence
+its parser recognizes, is closed and reopened after a delay that doubles
+with every failure, from GPS_BACKOFF_MIN up to GPS_BACKOFF_MAX, and starts
+over once sentences arrive again.
+
+Run on its own, it prints what the sources given to it see:
+    python gps.py gpsd://localhost tcp://192.168.1.20:10110"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+from time import monotonic, sleep
+
+import nmea
+
+
+GPSD_PORT = 2947
+GPS_BACKOFF_MIN = 1. # seconds before the first retry
+GPS_BACKOFF_MAX = 60. # seconds between retries at most
+GPS_READ_TIMEOUT = 10. # seconds without a sentence before reopening
+
+
+def parse_iso_time(v):
+    """(seconds after midnight, (year, month, day)) from gpsd's
+yyyy-mm-ddThh:mm:ss.sssZ"""
+    return (float(v[11:13])*3600 + float(v[14:16])*60 + \
+            float(v[17:].rstrip("Z")),
+            (int(v[0:4]), int(v[5:7]), int(v[8:10])))
+
+
+class GPSDParser(object):
+    """Turns gpsd's JSON reports into GPSFix updates, keeping NMEAParser's
+counters: TPV and SKY reports are sentences, other reports are ignored,
+and lines that are not JSON objects count as bad checksums"""
+    def __init__(self):
+        self.fix = nmea.NO_FIX
+        self.sentences = 0
+        self.ignored = 0
+        self.bad_checksum = 0
+        self.positions = 0
+        self.parsers = {"TPV": self.parse_TPV, "SKY": self.parse_SKY}
+
+    def feed(self, line):
+        """Take one line (bytes). Returns the updated GPSFix if the line
+changed it, None otherwise."""
+        try: r = json.loads(line.decode("utf-8", "replace"))
+        except ValueError: r = None
+        if not isinstance(r, dict):
+            self.bad_checksum += 1
+            return None
+        parse = self.parsers.get(r.get("class"))
+        if parse is None:
+            self.ignored += 1
+            return None
+        self.sentences += 1
+        try: fix = parse(r)
+        except (TypeError, ValueError): return None
+        self.fix = fix
+        return fix
+
+    def parse_TPV(self, r):
+        # mode is 0 or 1 without a fix, 2 for 2D and 3 for 3D; status 2 DGPS
+        o = self.fix
+        lat, lon = r.get("lat"), r.get("lon")
+        if r.get("mode", 0) >= 2 and lat is not None and lon is not None:
+            q = 2 if r.get("status") == 2 else 1
+            self.positions += 1
+        else: lat, lon, q = o.lat, o.lon, 0
+        utc, date = parse_iso_time(r["time"]) if r.get("time") else \
+                    (o.utc, o.date)
+        alt = r.get("altMSL", r.get("alt"))
+        return nmea.GPSFix(lat, lon, q, o.sats, o.hdop,
+                           o.alt if alt is None else alt,
+                           r.get("speed"), r.get("track"), utc, date)
+
+    def parse_SKY(self, r):
+        o = self.fix
+        sats = r.get("uSat")
+        if sats is None and "satellites" in r:
+            sats = sum(1 for s in r["satellites"] if s.get("used"))
+        return o._replace(sats=o.sats if sats is None else sats,
+                          hdop=r.get("hdop", o.hdop))
+
+
+class Source(object):
+    """One GPS connection, kept open by run(). Subclasses open() it,
+returning an asyncio.StreamReader of its lines, and close() it."""
+    def __init__(self, name, handler, parser=None):
+        self.name = name
+        self.handler = handler # handler(source, line, monotonic time)
+        self.parser = parser or nmea.NMEAParser()
+        self.connected = False
+        self.lines = 0
+        self.reconnects = 0 # times it failed or went quiet and was reopened
+
+    async def run(self):
+        delay = GPS_BACKOFF_MIN
+        while True:
+            try:
+                reader = await asyncio.wait_for(self.open(), GPS_READ_TIMEOUT)
+                self.connected = True
+                print("GPS: %s open" % self.name)
+                deadline = monotonic() + GPS_READ_TIMEOUT
+                while True:
+                    line = await asyncio.wait_for(reader.readline(),
+                                                  max(deadline - monotonic(),
+                                                      0.))
+                    if not line: raise EOFError()
+                    self.lines += 1
+                    sentences = self.parser.sentences
+                    self.handler(self, line, monotonic())
+                    if self.parser.sentences != sentences: # it works again
+                        deadline = monotonic() + GPS_READ_TIMEOUT
+                        delay = GPS_BACKOFF_MIN
+            except asyncio.CancelledError: raise
+            except asyncio.TimeoutError:
+                why = "no sentences for %g s" % GPS_READ_TIMEOUT
+            except EOFError: why = "closed at the other end"
+            except Exception as e: why = str(e) or type(e).__name__
+            finally:
+                self.connected = False
+                try: self.close()
+                except Exception: pass
+            self.reconnects += 1
+            print("GPS: %s: %s; retrying in %g s" % (self.name, why, delay))
+            await asyncio.sleep(delay)
+            delay = min(2*delay, GPS_BACKOFF_MAX)
+
+    async def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def close_late(future):
+    """Done callback: close a port that opened after we stopped waiting"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class SerialSource(Source):
+    """A serial port, opened with pyserial's Serial(**params), or
+serial_for_url(url, **params) given a URL. Opening can block for as long
+as a socket:// host takes not to answer, so it runs in the loop's
+executor, and other sources carry on meanwhile. Where the port has a file
+descriptor (POSIX), the loop then polls it; otherwise blocking reads run
+in the executor too, a thread per such port."""
+    def __init__(self, params, handler, url=None):
+        Source.__init__(self, url or params.get("port"), handler)
+        self.params = params
+        self.url = url
+        self.ser = None
+        self.unwatch = None
+
+    def open_port(self):
+        import serial # only now, so that nothing else needs pyserial
+        if self.url: return serial.serial_for_url(self.url, **self.params)
+        return serial.Serial(**self.params)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self.open_port)
+        try: self.ser = ser = await asyncio.shield(future)
+        except asyncio.CancelledError: # timed out, or stopping
+            future.add_done_callback(close_late)
+            raise
+        reader = asyncio.StreamReader()
+        try: fd = ser.fileno() if os.name == "posix" else None
+        except Exception: fd = None # not every URL handler has one
+        if fd is not None:
+            ser.timeout = 0
+            def readable():
+                try: data = ser.read(ser.in_waiting or 1)
+                except Exception as e: # unplugged, typically
+                    loop.remove_reader(fd)
+                    reader.set_exception(e)
+                    return
+                reader.feed_data(data)
+            loop.add_reader(fd, readable)
+            self.unwatch = lambda: loop.remove_reader(fd)
+        else:
+            ser.timeout = 1.
+            task = loop.create_task(self.pump(ser, reader))
+            self.unwatch = task.cancel
+        return reader
+
+    async def pump(self, ser, reader):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                reader.feed_data(await loop.run_in_executor(None,
+                                                            ser.readline))
+        except Exception as e: reader.set_exception(e)
+
+    def close(self):
+        if self.unwatch: self.unwatch()
+        self.unwatch = None
+        if self.ser: self.ser.close()
+        self.ser = None
+
+
+class TCPSource(Source):
+    """Raw NMEA from a TCP server"""
+    def __init__(self, host, port, handler, parser=None, scheme="tcp"):
+        Source.__init__(self, "%s://%s:%d" % (scheme, host, port), handler,
+                        parser)
+        self.host = host
+        self.port = port
+        self.writer = None
+
+    async def open(self):
+        reader, self.writer = await asyncio.open_connection(self.host,
+                                                            self.port)
+        return reader
+
+    def close(self):
+        if self.writer: self.writer.close()
+        self.writer = None
+
+
+class GPSDSource(TCPSource):
+    """gpsd, asked to WATCH in JSON"""
+    WATCH = b'?WATCH={"enable":true,"json":true};\n'
+
+    def __init__(self, host, port, handler):
+        TCPSource.__init__(self, host, port, handler, GPSDParser(), "gpsd")
+
+    async def open(self):
+        reader = await TCPSource.open(self)
+        self.writer.write(self.WATCH)
+        await self.writer.drain()
+        return reader
+
+
+def make_sources(urls, serial_params, handler):
+    """Sources for a comma-separated list of URLs: tcp://host:port for raw
+NMEA, gpsd://host[:port], or anything pyserial takes (socket://,
+rfc2217://...). Without any, the serial port in serial_params, or no
+sources at all if it names none."""
+    urls = [u.strip() for u in (urls or "").split(",") if u.strip()]
+    if not urls:
+        if not serial_params.get("port"): return []
+        return [SerialSource(serial_params, handler)]
+    out = []
+    for url in urls:
+        scheme, sep, rest = url.partition("://")
+        scheme = scheme.casefold()
+        if scheme not in ("tcp", "gpsd"):
+            out.append(SerialSource(serial_params, handler, url=url))
+            continue
+        host, sep, port = rest.rstrip("/").rpartition(":")
+        if not sep or "]" in port: host, port = rest.rstrip("/"), "" # [::1]
+        host = host.strip("[]")
+        if not port and scheme == "tcp":
+            raise ValueError("%s needs a port" % url)
+        port = int(port) if port else GPSD_PORT
+        if scheme == "gpsd": out.append(GPSDSource(host, port, handler))
+        else: out.append(TCPSource(host, port, handler))
+    return out
+
+
+class EventLoop(object):
+    """An asyncio event loop on a daemon thread of its own, shared by any
+number of sources. Other threads hand it coroutines with spawn()."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def spawn(self, coro):
+        """Run coro on the loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout=2.):
+        """Cancel everything running, so that sources close, and stop"""
+        async def cancel():
+            tasks = [t for t in asyncio.all_tasks() \
+                     if t is not asyncio.current_task()]
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        try: self.spawn(cancel()).result(timeout)
+        except Exception: pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        if not self.thread.is_alive(): self.loop.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    def show(src, line, t):
+        fix = src.parser.feed(line)
+        if fix is not None and fix.quality:
+            print("%s: %9.5f, %10.5f, quality %d, %s sats" % \
+                  (src.name, fix.lat, fix.lon, fix.quality, fix.sats))
+    loop = EventLoop()
+    loop.start()
+    for src in make_sources(",".join(sys.argv[1:]), {}, show):
+        loop.spawn(src.run())
+    try:
+        while True: sleep(1)
+    except KeyboardInterrupt: pass
+    loop.stop()
+
+if __name__ == "__main__": main()
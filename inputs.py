@@ -0,0 +1,190 @@
+"""Inputs other than a PyAudio device, for Signal Logger's receivers.
+
+Each opens to a stream object that reads like a PyAudio input stream:
+read(frames) returns that many frames of interleaved float32 samples, and
+close() releases it. Sources:
+
+  file     a WAV file (8/16-bit PCM or 32-bit float), or a raw I/Q file
+           as written by rtl_sdr; played back at its own sample rate
+  pipe     raw I/Q from a named pipe, or "-" for stdin, e.g.
+           rtl_sdr -f 162.55M -s 256k - | python signal_logger.py ...
+  rtl_tcp  an rtl_tcp server, "host:port"; tuned and set to fixed gain
+
+Raw I/Q is uint8 (what rtl_sdr and rtl_tcp send), int16 or float32. Each
+hop is read straight into one new buffer, which is then either handed on
+as-is (float32) or converted in a single pass."""
+
+import array
+import socket
+import struct
+import sys
+from time import monotonic, sleep
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+KINDS = ("pyaudio", "file", "pipe", "rtl_tcp")
+# bytes per sample, array typecode, zero offset, full scale
+IQ_FORMATS = {"uint8":(1, "B", 127.5, 127.5),
+              "int16":(2, "h", 0., 32768.),
+              "float32":(4, "f", 0., 1.)}
+RTL_TCP_PORT = 1234
+# rtl_tcp commands: one byte, then a big-endian uint32 argument
+RTL_SET_FREQ = 0x01
+RTL_SET_SAMPLE_RATE = 0x02
+RTL_SET_GAIN_MODE = 0x03 # 1 for manual
+RTL_SET_GAIN = 0x04 # tenths of a dB
+RTL_SET_AGC_MODE = 0x08 # 0 for off
+
+
+def to_float32(buf, fmt):
+    """Interleaved samples of IQ format fmt as float32 in -1..1, in a form
+that np.frombuffer, struct and memoryview slicing all accept"""
+    size, code, offset, scale = IQ_FORMATS[fmt]
+    if fmt == "float32" and sys.byteorder == "little": return buf
+    if np is not None:
+        x = np.frombuffer(buf, dtype="<" + code if size > 1 else code)
+        x = x.astype(np.float32)
+        if offset: x -= np.float32(offset)
+        if scale != 1.: x *= np.float32(1/scale)
+        return memoryview(x).cast("B")
+    a = array.array(code, buf)
+    if size > 1 and sys.byteorder != "little": a.byteswap()
+    return array.array("f", [(q - offset)/scale for q in a]).tobytes()
+
+
+class RawStream(object):
+    """Interleaved samples of one IQ format from a binary file object"""
+    def __init__(self, f, fmt="uint8", chnls=2, sr=None, pace=False,
+                 length=None, sock=None):
+        if fmt not in IQ_FORMATS:
+            raise ValueError("Unknown IQ format '%s'" % fmt)
+        self.f = f
+        self.fmt = fmt
+        self.size = IQ_FORMATS[fmt][0]
+        self.chnls = chnls
+        self.sr = sr
+        self.pace = pace # keep to real time (files), rather than flat out
+        self.left = length # bytes of sample data left, if known
+        self.sock = sock
+        self.frames = 0
+        self.t0 = None
+
+    def read(self, frames):
+        """The next frames frames as float32; EOFError once they run out"""
+        n = frames*self.chnls*self.size
+        if self.left is not None: n = min(n, self.left)
+        buf = bytearray(n)
+        view = memoryview(buf)
+        got = 0
+        while got < n:
+            k = self.f.readinto(view[got:])
+            if not k: break
+            got += k
+        if self.left is not None: self.left -= got
+        if got < frames*self.chnls*self.size: # a partial hop is no use
+            raise EOFError
+        if self.pace:
+            if self.t0 is None: self.t0 = monotonic()
+            self.frames += frames
+            wait = self.t0 + self.frames/self.sr - monotonic()
+            if wait > 0: sleep(wait)
+        return to_float32(buf, self.fmt)
+
+    def close(self):
+        try: self.f.close()
+        except: pass
+        if self.sock:
+            try: self.sock.close()
+            except: pass
+
+
+def wav_info(f):
+    """(IQ format, channels, sample rate, data bytes) of a WAV file, with f
+left at the start of its sample data"""
+    riff, size, wave = struct.unpack("<4sI4s", f.read(12))
+    if riff != b"RIFF" or wave != b"WAVE": raise ValueError("Not a WAV file")
+    fmt = None
+    while True:
+        head = f.read(8)
+        if len(head) < 8: raise ValueError("WAV file has no data")
+        cid, size = struct.unpack("<4sI", head)
+        if cid == b"data":
+            if fmt is None: raise ValueError("WAV data before format")
+            return fmt + (size,)
+        body = f.read(size + size % 2) # chunks are padded to even sizes
+        if cid != b"fmt ": continue
+        tag, chnls, sr = struct.unpack("<HHI", body[:8])
+        bits = struct.unpack("<H", body[14:16])[0]
+        if tag == 0xFFFE: tag = struct.unpack("<H", body[24:26])[0]
+        fmt = {(1, 8):"uint8", (1, 16):"int16", (3, 32):"float32"}.get(\
+            (tag, bits))
+        if fmt is None:
+            raise ValueError("WAV format %d, %d-bit is not supported" % \
+                             (tag, bits))
+        fmt = (fmt, chnls, sr)
+
+def probe(kind, spec):
+    """(channels, sample rate or None) an input will deliver, without
+opening it for good; only WAV files know their own"""
+    if kind == "file":
+        with open(spec, "rb") as f:
+            if f.read(4) == b"RIFF":
+                f.seek(0)
+                fmt, chnls, sr, size = wav_info(f)
+                return chnls, sr
+    return 2, None
+
+def open_file(fn, fmt="uint8", sr=None):
+    f = open(fn, "rb", buffering=0)
+    if f.read(4) == b"RIFF":
+        f.seek(0)
+        fmt, chnls, sr, size = wav_info(f)
+        return RawStream(f, fmt, chnls, sr, pace=True, length=size)
+    f.seek(0)
+    return RawStream(f, fmt, 2, sr, pace=True)
+
+def open_pipe(path, fmt="uint8", sr=None):
+    """A named pipe, or stdin for "-". Opening a pipe waits for a writer."""
+    if path == "-": return RawStream(sys.stdin.buffer, fmt, 2, sr)
+    return RawStream(open(path, "rb", buffering=0), fmt, 2, sr)
+
+def rtl_command(sock, cmd, arg):
+    sock.sendall(struct.pack(">BI", cmd, arg & 0xFFFFFFFF))
+
+def open_rtl_tcp(addr, sr, frequency=None, gain=None, timeout=10.):
+    """Connect to rtl_tcp at "host[:port]", set it to sample rate sr and
+optionally tune it, and turn off every kind of automatic gain: levels
+only mean something at a fixed gain"""
+    host, sep, port = addr.rpartition(":")
+    if not sep or not port.isdigit(): host, port = addr, RTL_TCP_PORT
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    try:
+        head = b""
+        while len(head) < 12: # "RTL0", tuner type, gain count
+            more = sock.recv(12 - len(head))
+            if not more: raise IOError("rtl_tcp closed the connection")
+            head += more
+        if head[:4] != b"RTL0": raise IOError("%s is not rtl_tcp" % addr)
+        rtl_command(sock, RTL_SET_SAMPLE_RATE, int(sr))
+        if frequency: rtl_command(sock, RTL_SET_FREQ, int(frequency))
+        rtl_command(sock, RTL_SET_AGC_MODE, 0)
+        if gain is not None:
+            rtl_command(sock, RTL_SET_GAIN_MODE, 1)
+            rtl_command(sock, RTL_SET_GAIN, int(round(gain*10)))
+        sock.settimeout(None)
+    except:
+        sock.close()
+        raise
+    return RawStream(sock.makefile("rb", buffering=0), "uint8", 2, sr,
+                     sock=sock)
+
+def open_input(kind, spec, sr, fmt="uint8", frequency=None, gain=None):
+    """Open any input but a PyAudio device (CaptureManager does those)"""
+    if kind == "file": return open_file(spec, fmt, sr)
+    if kind == "pipe": return open_pipe(spec, fmt, sr)
+    if kind == "rtl_tcp": return open_rtl_tcp(spec, sr, frequency, gain)
+    raise ValueError("Unknown input '%s'" % kind)
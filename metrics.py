@@ -0,0 +1,179 @@
+"""Runtime counters for Signal Logger, and ways to read them.
+
+The capture, DSP, GPS and logging threads only ever bump plain counters and
+Timing totals on their own objects. A Reporter thread gathers them into a
+snapshot every STATS_PERIOD seconds: a nested dict in which keys ending in
+_total only ever grow. From the snapshots of the last STATS_WINDOW seconds
+it adds a _rate (per second) beside each _total, so a _seconds_total gets
+the fraction of the time spent on that step, and takes each _max over the
+whole window. Snapshots can be served over HTTP as JSON or as Prometheus
+text."""
+
+import collections
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic, sleep, time
+
+
+STATS_PERIOD = 1. # seconds between snapshots
+STATS_WINDOW = 10. # seconds rates and maxima are taken over
+PROMETHEUS_PREFIX = "signal_logger"
+
+
+class Timing(object):
+    """How long one repeated step has taken, in total and at worst. Only the
+thread doing the step calls add(); any thread may read."""
+    __slots__ = ("count", "seconds", "peak")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.
+        self.peak = 0. # longest since the last take_peak()
+
+    def add(self, dt):
+        self.count += 1
+        self.seconds += dt
+        if dt > self.peak: self.peak = dt
+
+    def take_peak(self):
+        peak, self.peak = self.peak, 0.
+        return peak
+
+    def fields(self, name):
+        """Snapshot entries for this step, called name"""
+        return {name + "_total":self.count,
+                name + "_seconds_total":self.seconds,
+                name + "_seconds_max":self.take_peak()}
+
+
+def derive(cur, old, dt, hist):
+    """cur, with a _rate beside each _total (the change since old, dt
+seconds earlier) and each _max the largest in hist, the snapshots between"""
+    out = {}
+    for k, v in cur.items():
+        if isinstance(v, dict):
+            out[k] = derive(v, old.get(k, {}), dt,
+                            [h.get(k, {}) for h in hist])
+            continue
+        out[k] = v
+        if k.endswith("_total"):
+            out[k[:-6] + "_rate"] = max(v - old.get(k, v), 0)/dt if dt else 0.
+        elif k.endswith("_max"):
+            out[k] = max([v] + [h.get(k) or 0 for h in hist])
+    return out
+
+
+class Reporter(object):
+    """Takes a snapshot from collect() every period seconds on its own
+thread. The latest is in .snapshot; each is also handed to every function
+in .listeners."""
+    def __init__(self, collect, period=STATS_PERIOD, window=STATS_WINDOW):
+        self.collect = collect
+        self.period = period
+        self.window = window
+        self.history = collections.deque() # (monotonic time, raw snapshot)
+        self.snapshot = {}
+        self.listeners = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            try: self.update()
+            except Exception as e: # never worth taking the program down for
+                print("Stats: %r" % e)
+            sleep(self.period)
+
+    def update(self):
+        t = monotonic()
+        cur = self.collect()
+        self.history.append((t, cur))
+        while len(self.history) > 2 and \
+              t - self.history[1][0] >= self.window:
+            self.history.popleft()
+        t0, old = self.history[0]
+        snap = derive(cur, old, t - t0, [h for t, h in self.history])
+        snap["time"] = time()
+        self.snapshot = snap
+        for fn in self.listeners: fn(snap)
+
+
+def prometheus(snap, prefix=PROMETHEUS_PREFIX):
+    """snap in the Prometheus text format. A section of per-item dicts (say
+"receivers") labels its entries with the item's name ("receiver"). Rates
+are left out: Prometheus works those out for itself from the _totals."""
+    series = collections.OrderedDict() # metric name: sample lines
+    def add(name, labels, v):
+        if name.endswith("_rate") or isinstance(v, bool) or \
+           not isinstance(v, (int, float)):
+            return
+        series.setdefault(name, []).append("%s%s %r" % (name, labels,
+                                                        float(v)))
+    for k, v in sorted(snap.items()):
+        name = "%s_%s" % (prefix, k)
+        if not isinstance(v, dict):
+            add(name, "", v)
+            continue
+        for sk, sv in sorted(v.items()):
+            if not isinstance(sv, dict):
+                add("%s_%s" % (name, sk), "", sv)
+                continue
+            label = '{%s="%s"}' % (k[:-1] if k.endswith("s") else k,
+                                   str(sk).replace("\\", "\\\\")\
+                                   .replace('"', '\\"').replace("\n", "\\n"))
+            for leaf, lv in sorted(sv.items()):
+                add("%s_%s" % (name, leaf), label, lv)
+    lines = []
+    for name, samples in series.items():
+        lines.append("# TYPE %s %s" % \
+                     (name, "counter" if name.endswith("_total") else "gauge"))
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    """GET /metrics for Prometheus, / or /stats.json for JSON"""
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        snap = self.server.reporter.snapshot
+        if path == "/metrics":
+            body = prometheus(snap).encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ("/", "/stats.json"):
+            body = json.dumps(snap, indent=1, sort_keys=True).encode("utf-8")
+            ctype = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass # a scrape every few seconds is not worth a console line
+
+
+class StatsServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(addr, reporter):
+    """Serve reporter's snapshots over HTTP at "[host:]port", on localhost
+unless a host is given, from a daemon thread; returns the server"""
+    host, sep, port = str(addr).rpartition(":")
+    server = StatsServer((host or "127.0.0.1", int(port)), StatsHandler)
+    server.reporter = reporter
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
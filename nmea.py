@@ -0,0 +1,154 @@
+"""NMEA 0183 parsing for Signal Logger's GPS input.
+
+Handles GGA, RMC and VTG from any talker (GP, GN, GL, GA, ...). Sentences
+are picked by ID before anything else is done with them, and only the ones
+we use are checksummed and decoded."""
+
+import collections
+
+
+KNOTS = 0.514444 # m/s
+
+
+class GPSFix(collections.namedtuple("GPSFix",
+                                    ["lat", "lon", "quality", "sats", "hdop",
+                                     "alt", "speed", "heading", "utc",
+                                     "date"])):
+    """Everything known about the receiver's position. speed is in m/s,
+heading in degrees true, utc in seconds after midnight and date a
+(year, month, day) tuple; unknown fields are None. quality is the GGA fix
+quality: 0 is no fix, 1 GPS, 2 DGPS and so on."""
+    __slots__ = ()
+
+NO_FIX = GPSFix(0., 0., 0, None, None, None, None, None, None, None)
+
+
+MASKS = [(1 << b) - 1 for b in (512, 256, 128, 64)]
+
+def checksum(body):
+    """XOR of every byte in body. Folds the bytes as one big integer, halving
+its width each step, so the work is a few C-level operations instead of a
+Python loop per byte; masking off the folded half keeps each step small."""
+    x = int.from_bytes(body, "little")
+    if len(body) > 128: # longer than any real NMEA sentence
+        shift = 1024
+        while shift < 4*len(body): shift *= 2
+        while shift > 512:
+            x ^= x >> shift
+            shift //= 2
+    m512, m256, m128, m64 = MASKS
+    x = (x >> 512 ^ x) & m512
+    x = (x >> 256 ^ x) & m256
+    x = (x >> 128 ^ x) & m128
+    x = (x >> 64 ^ x) & m64
+    x ^= x >> 32; x ^= x >> 16; x ^= x >> 8
+    return x & 0xff
+
+def parse_latlon(v, hemi, deg_digits):
+    """Degrees from NMEA ddmm.mmmm (or dddmm.mmmm) and N/S/E/W"""
+    d = float(v[:deg_digits]) + float(v[deg_digits:])/60
+    return -d if hemi in (b"S", b"W") else d
+
+def parse_utc(v):
+    """Seconds after midnight from hhmmss.ss"""
+    return float(v[0:2])*3600 + float(v[2:4])*60 + float(v[4:])
+
+def parse_date(v):
+    """(year, month, day) from ddmmyy"""
+    return (2000 + int(v[4:6]), int(v[2:4]), int(v[0:2]))
+
+
+class NMEAParser(object):
+    """Turns NMEA lines into GPSFix updates, counting what it sees"""
+    def __init__(self):
+        self.fix = NO_FIX
+        self.sentences = 0 # GGA, RMC and VTG lines
+        self.ignored = 0 # other lines, including blank reads
+        self.bad_checksum = 0 # missing, unparseable or wrong
+        self.positions = 0 # sentences that gave us a new position
+        self.has_gga = False # once GGA is seen, RMC positions are ignored
+        self.gga_tail = None # the last GGA's sats, HDOP and altitude fields
+        self.parsers = {b"GGA": self.parse_GGA, b"RMC": self.parse_RMC,
+                        b"VTG": self.parse_VTG}
+
+    def feed(self, line):
+        """Take one line (bytes). Returns the updated GPSFix if the line
+changed it, None otherwise."""
+        # "$GPGGA," is 7 bytes: '$', two talker letters, sentence ID, comma
+        parse = self.parsers.get(line[3:6])
+        if parse is None or line[:1] != b"$":
+            self.ignored += 1
+            return None
+        self.sentences += 1
+        star = line.rfind(b"*")
+        try:
+            if star == -1 or int(line[star+1:star+3], 16) != \
+               checksum(line[1:star]):
+                self.bad_checksum += 1
+                return None
+        except ValueError:
+            self.bad_checksum += 1
+            return None
+        # fields stay bytes: float() and int() take them as they are
+        f = line[7:star].split(b",")
+        try: fix = parse(f)
+        except (ValueError, IndexError): return None
+        if fix is not None: self.fix = fix
+        return fix
+
+    # The parse_ methods build the new GPSFix in one go rather than with
+    # _replace(), which costs as much again as the parsing itself, and with
+    # tuple.__new__, skipping the argument handling of GPSFix() itself.
+    def parse_GGA(self, f):
+        # time, lat, N/S, lon, E/W, quality, sats, HDOP, alt, M, ...
+        o = self.fix
+        q = int(f[5] or 0)
+        self.has_gga = True
+        if q and f[1] and f[3]:
+            lat = parse_latlon(f[1], f[2], 2)
+            lon = parse_latlon(f[3], f[4], 3)
+            self.positions += 1
+        else: lat, lon = o.lat, o.lon
+        # these seldom change from one fix to the next: reuse them if not
+        tail = f[6:9]
+        if tail == self.gga_tail: sats, hdop, alt = o.sats, o.hdop, o.alt
+        else:
+            sats = int(f[6]) if f[6] else None
+            hdop = float(f[7]) if f[7] else None
+            alt = float(f[8]) if f[8] else None
+            self.gga_tail = tail
+        return tuple.__new__(GPSFix, (lat, lon, q, sats, hdop, alt, o.speed,
+                                      o.heading,
+                                      parse_utc(f[0]) if f[0] else o.utc,
+                                      o.date))
+
+    def parse_RMC(self, f):
+        # time, A/V, lat, N/S, lon, E/W, knots, course, ddmmyy, ...
+        o = self.fix
+        lat, lon, q, speed, heading = o.lat, o.lon, o.quality, o.speed, \
+                                      o.heading
+        if f[1] == b"A": # otherwise the receiver says: no valid fix
+            speed = float(f[6])*KNOTS if f[6] else None
+            heading = float(f[7]) if f[7] else None
+            if f[2] and f[4] and not self.has_gga:
+                # GGA (with quality) is preferred; RMC-only receivers use this
+                lat = parse_latlon(f[2], f[3], 2)
+                lon = parse_latlon(f[4], f[5], 3)
+                q = 1
+                self.positions += 1
+        return tuple.__new__(GPSFix, (lat, lon, q, o.sats, o.hdop, o.alt,
+                                      speed, heading,
+                                      parse_utc(f[0]) if f[0] else o.utc,
+                                      parse_date(f[8]) if f[8] else o.date))
+
+    def parse_VTG(self, f):
+        # course true, T, course magnetic, M, knots, N, km/h, K, mode
+        if len(f) > 8 and f[8].startswith(b"N"): return None # not valid
+        if f[4]: speed = float(f[4])*KNOTS
+        elif f[6]: speed = float(f[6])/3.6
+        else: speed = None
+        o = self.fix
+        return tuple.__new__(GPSFix, (o.lat, o.lon, o.quality, o.sats, o.hdop,
+                                      o.alt, speed,
+                                      float(f[0]) if f[0] else None, o.utc,
+                                      o.date))
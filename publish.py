@@ -0,0 +1,267 @@
+"""Live measurements for other programs, as compact binary frames.
+
+A Publisher sends every receiver's Measurements, as they are made, to any
+number of subscribers: by UDP, to a multicast group (or a single host), or
+to everyone connected to its TCP port or Unix socket. Publishing never
+waits: frames are handed to an asyncio event loop (a gps.EventLoop) and
+written without blocking, and a subscriber with more than PUBLISH_BACKLOG
+bytes still unsent is disconnected rather than waited for.
+
+Every frame starts with HEADER: b"SL", the format version and its kind. A
+catalogue frame (kind 0) carries, as JSON, the receivers' names (which
+measurement frames refer to by index) and the percentiles their values
+are at. It is the first frame on every connection, and is repeated every
+PUBLISH_CATALOGUE seconds over UDP. A measurement frame (kind 1) is
+MEASUREMENT followed by that many float32 percentile values. Unknown
+values are NaN. Each UDP datagram is one frame; on streams, each frame is
+preceded by its length, as a little-endian uint16.
+
+Run on its own, it is the reference subscriber, printing what it gets:
+    python publish.py udp://239.255.80.76:5076
+    python publish.py tcp://localhost:5076
+    python publish.py unix:///tmp/signal_logger.sock"""
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import struct
+import sys
+
+
+PUBLISH_BACKLOG = 256*1024 # bytes a subscriber may fall behind by
+PUBLISH_CATALOGUE = 5. # seconds between catalogue frames over UDP
+PUBLISH_TTL = 1 # multicast hops: the local network only
+MAGIC = b"SL"
+FRAME_VERSION = 1
+CATALOGUE = 0
+MEASUREMENT_FRAME = 1
+HEADER = struct.Struct("<2sBB")
+# receiver, seq, timestamp, lat, lon, fix age, cal, rms, rms_db, samples,
+# and the number of percentile values that follow
+MEASUREMENT = struct.Struct("<HIdddffffIB")
+LENGTH = struct.Struct("<H")
+NAN = float("nan")
+
+
+class Frame(collections.namedtuple("Frame",
+                                   ["receiver", "seq", "timestamp", "lat",
+                                    "lon", "age", "cal", "rms", "rms_db",
+                                    "samples", "values"])):
+    """One decoded measurement frame; receiver is an index into the
+catalogue's names, and values line up with its percentiles"""
+    __slots__ = ()
+
+
+def parse_url(url):
+    """(scheme, address) for udp://host:port, tcp://host:port or
+unix:///path (POSIX only: asyncio has no Unix sockets elsewhere)"""
+    scheme, sep, rest = url.partition("://")
+    scheme = scheme.casefold()
+    if scheme == "unix" and os.name != "posix":
+        raise ValueError("%s: Unix sockets need a POSIX system" % url)
+    if scheme == "unix" and rest: return scheme, rest
+    host, sep, port = rest.rstrip("/").rpartition(":")
+    if scheme not in ("udp", "tcp") or not sep or not port.isdigit():
+        raise ValueError("%s is not udp://host:port, tcp://host:port or "
+                         "unix:///path" % url)
+    return scheme, (host.strip("[]") or "0.0.0.0", int(port))
+
+
+def catalogue_frame(names, pctl):
+    return HEADER.pack(MAGIC, FRAME_VERSION, CATALOGUE) + \
+           json.dumps({"receivers":list(names),
+                       "pctl":list(pctl)}).encode("utf-8")
+
+def measurement_frame(i, m, loc, pctl):
+    values = m.at(pctl) or [NAN]*len(pctl)
+    return HEADER.pack(MAGIC, FRAME_VERSION, MEASUREMENT_FRAME) + \
+           MEASUREMENT.pack(i, m.seq, m.timestamp, loc.lat, loc.lon,
+                            NAN if loc.age is None else loc.age, m.cal,
+                            NAN if m.rms is None else m.rms,
+                            NAN if m.rms_db is None else m.rms_db,
+                            m.samples, len(values)) + \
+           struct.pack("<%df" % len(values), *values)
+
+def decode(frame):
+    """(CATALOGUE, dict) or (MEASUREMENT_FRAME, Frame) from one frame;
+raises ValueError for anything else"""
+    if len(frame) < HEADER.size:
+        raise ValueError("Frame too short")
+    magic, version, kind = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != FRAME_VERSION:
+        raise ValueError("Not a version %d frame" % FRAME_VERSION)
+    body = frame[HEADER.size:]
+    if kind == CATALOGUE: return kind, json.loads(body.decode("utf-8"))
+    if kind != MEASUREMENT_FRAME or len(body) < MEASUREMENT.size:
+        raise ValueError("Bad frame")
+    f = MEASUREMENT.unpack_from(body)
+    n = f[-1]
+    values = struct.unpack_from("<%df" % n, body, MEASUREMENT.size)
+    return kind, Frame(*(f[:-1] + (values,)))
+
+
+class Subscriber(asyncio.Protocol):
+    """One stream subscriber, as the Publisher's event loop sees it"""
+    def __init__(self, pub):
+        self.pub = pub
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.pub.subscribers.add(transport)
+        transport.write(self.pub.stream(self.pub.catalogue))
+
+    def connection_lost(self, exc):
+        self.pub.subscribers.discard(self.transport)
+
+    def data_received(self, data):
+        pass # subscribers have nothing to say
+
+
+class Publisher(object):
+    """Publishes Measurements at url (see parse_url) from loop, a running
+gps.EventLoop. publish() may be called from any thread."""
+    def __init__(self, url, names, pctl, loop):
+        self.url = url
+        self.scheme, self.addr = parse_url(url)
+        self.pctl = tuple(pctl)
+        self.catalogue = catalogue_frame(names, self.pctl)
+        self.loop = loop
+        self.running = False
+        self.server = None
+        self.udp = None
+        self.subscribers = set() # transports of stream subscribers
+        self.frames = 0 # published
+        self.dropped = 0 # UDP frames not sent for lack of buffer space
+        self.kicked = 0 # subscribers disconnected for falling behind
+
+    def start(self, timeout=5.):
+        """Bind or connect the socket, raising OSError if we can't"""
+        self.loop.spawn(self.open()).result(timeout)
+        self.running = True
+
+    def stop(self, timeout=5.):
+        self.running = False
+        try: self.loop.spawn(self.close()).result(timeout)
+        except Exception: pass
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self.scheme == "udp":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                            PUBLISH_TTL)
+            sock.setblocking(False)
+            sock.connect(self.addr)
+            self.udp, protocol = await loop.create_datagram_endpoint(\
+                asyncio.DatagramProtocol, sock=sock)
+            self.repeat = loop.create_task(self.repeat_catalogue())
+        elif self.scheme == "tcp":
+            self.server = await loop.create_server(lambda: Subscriber(self),
+                                                   *self.addr)
+        else:
+            if os.path.exists(self.addr): os.unlink(self.addr) # stale
+            self.server = await loop.create_unix_server(\
+                lambda: Subscriber(self), self.addr)
+
+    async def close(self):
+        if self.udp:
+            self.repeat.cancel()
+            self.udp.close()
+        if self.server:
+            self.server.close()
+            for t in list(self.subscribers): t.abort()
+            await self.server.wait_closed()
+            if self.scheme == "unix":
+                try: os.unlink(self.addr)
+                except OSError: pass
+
+    async def repeat_catalogue(self):
+        while True:
+            self.send(self.catalogue)
+            await asyncio.sleep(PUBLISH_CATALOGUE)
+
+    def stream(self, frame):
+        return LENGTH.pack(len(frame)) + frame
+
+    def publish(self, i, m, loc):
+        """Publish receiver i's Measurement m, made at Location loc"""
+        if not self.running: return
+        frame = measurement_frame(i, m, loc, self.pctl)
+        self.frames += 1
+        self.loop.loop.call_soon_threadsafe(self.send, frame)
+
+    def send(self, frame):
+        """In the loop: pass frame to every subscriber that keeps up"""
+        if self.udp:
+            if self.udp.get_write_buffer_size() > PUBLISH_BACKLOG:
+                self.dropped += 1
+            else: self.udp.sendto(frame)
+        if not self.subscribers: return
+        data = self.stream(frame)
+        for t in list(self.subscribers):
+            if t.get_write_buffer_size() > PUBLISH_BACKLOG:
+                print("Publish: %s: dropping a subscriber that fell "
+                      "behind" % self.url)
+                self.subscribers.discard(t)
+                self.kicked += 1
+                t.abort()
+            else: t.write(data)
+
+
+def subscribe(url, timeout=None):
+    """The reference subscriber: yields (kind, payload) for every frame
+from the Publisher at url, as decode() gives them. Over UDP, url's host is
+the multicast group to join, or any other address to just listen on
+url's port."""
+    scheme, addr = parse_url(url)
+    if scheme == "udp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", addr[1]))
+        if socket.inet_aton(addr[0])[0] & 0xf0 == 0xe0: # 224.0.0.0/4
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            socket.inet_aton(addr[0]) + \
+                            socket.inet_aton("0.0.0.0"))
+    elif scheme == "tcp":
+        sock = socket.create_connection(addr, timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(addr)
+    sock.settimeout(timeout)
+    try:
+        if scheme == "udp":
+            while True: yield decode(sock.recv(65536))
+        f = sock.makefile("rb")
+        while True:
+            head = f.read(LENGTH.size)
+            if len(head) < LENGTH.size: return # publisher gone
+            n, = LENGTH.unpack(head)
+            frame = f.read(n)
+            if len(frame) < n: return
+            yield decode(frame)
+    finally: sock.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return
+    names, pctl = None, None
+    try:
+        for kind, x in subscribe(sys.argv[1]):
+            if kind == CATALOGUE:
+                if names is None: print("Receivers: %s" % \
+                                        ", ".join(x["receivers"]))
+                names, pctl = x["receivers"], x["pctl"]
+                continue
+            if names is None: continue # wait to learn who is who
+            mid = x.values[pctl.index(50)] if 50 in pctl else NAN
+            print("%-12s #%-6d %9.4f,%10.4f  %7.2f dBm  median %7.2f" % \
+                  (names[x.receiver] if x.receiver < len(names) else \
+                   x.receiver, x.seq, x.lat, x.lon, x.rms, mid))
+    except KeyboardInterrupt: pass
+
+if __name__ == "__main__": main()
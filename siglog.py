@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Read Signal Logger logs, and convert them to text or KML.
+
+Text logs are the siglog_*.log files Signal Logger has always written.
+Binary logs (siglog_*.slog, log_format=binary) hold the same rows at a
+fixed size, so NumPy can map a whole drive's worth without parsing it."""
+
+import calendar
+import struct
+import sys
+from time import localtime, mktime, strftime
+
+try:
+    import numpy as np
+except ImportError: # readers fall back to struct, slower but complete
+    np = None
+
+
+# Binary log layout, all little-endian:
+#   header: magic, version, header size, percentile count, cal at start,
+#           receiver name length; then the UTF-8 name, the percentiles as
+#           float32, and zero padding up to header size (a multiple of 8)
+#   rows:   timestamp (epoch s), lat, lon as float64; cal, RMS, RMS of dB
+#           (NaN unless rms_db is on) as float32; valid sample count as
+#           uint32; one float32 per percentile
+# Version 1 rows had no RMS of dB, and their RMS was the RMS of dB.
+MAGIC = b"SLOG"
+FORMAT_VERSION = 2
+HEADER_FORMAT = "<4sHHHfH"
+ROW_FORMATS = {1:"<dddffI%df", 2:"<dddfffI%df"}
+ROW_FORMAT = ROW_FORMATS[FORMAT_VERSION]
+TEXT_TIME = "%Y-%m-%d.%H:%M:%S.%z"
+
+# Radio Mobile "network style" colours, strongest first: (dBm, aabbggrr)
+KML_LEVELS = ((-70., "ff00ff00"), # green
+              (-80., "ff00ffaa"), # yellow-green
+              (-90., "ff00ffff"), # yellow
+              (-100., "ff0088ff"), # orange
+              (-110., "ff0000ff"), # red
+              (float("-inf"), "ff880088")) # purple: below everything useful
+
+
+def header_bytes(name, cal, pctl):
+    """Binary log header for a receiver called name"""
+    name = name.encode("utf-8")
+    size = struct.calcsize(HEADER_FORMAT) + len(name) + 4*len(pctl)
+    size += -size % 8
+    out = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, size, len(pctl),
+                      cal, len(name)) + name + \
+          struct.pack("<%df" % len(pctl), *pctl)
+    return out + b"\0"*(size - len(out))
+
+def row_struct(npct, version=FORMAT_VERSION):
+    return struct.Struct(ROW_FORMATS[version] % npct)
+
+def row_dtype(npct, version=FORMAT_VERSION):
+    """NumPy dtype of one binary log row"""
+    return np.dtype([("timestamp", "<f8"), ("lat", "<f8"), ("lon", "<f8"),
+                     ("cal", "<f4"), ("rms", "<f4")] + \
+                    ([("rms_db", "<f4")] if version >= 2 else []) + \
+                    [("samples", "<u4"), ("values", "<f4", (npct,))])
+
+
+class Row(object):
+    """One log row, from either format"""
+    __slots__ = ("timestamp", "lat", "lon", "cal", "rms", "samples", "pctl",
+                 "values", "rms_db")
+    def __init__(self, timestamp, lat, lon, cal, rms, samples, pctl, values,
+                 rms_db=None):
+        self.timestamp = timestamp
+        self.lat = lat
+        self.lon = lon
+        self.cal = cal # None in text logs, which never recorded it
+        self.rms = rms
+        self.samples = samples
+        self.pctl = pctl
+        self.values = values
+        self.rms_db = rms_db # None unless logged with rms_db on
+
+    def at(self, pct):
+        return self.values[self.pctl.index(pct)]
+
+
+class BinaryLog(object):
+    """A binary log file: header fields, plus its rows"""
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, "rb") as f:
+            fixed = f.read(struct.calcsize(HEADER_FORMAT))
+            if len(fixed) < struct.calcsize(HEADER_FORMAT):
+                raise ValueError("%s is too short for a Signal Logger binary "
+                                 "log" % fn)
+            magic, self.version, self.header_size, npct, self.cal, \
+                   name_len = struct.unpack(HEADER_FORMAT, fixed)
+            if magic != MAGIC:
+                raise ValueError("%s is not a Signal Logger binary log" % fn)
+            if self.version > FORMAT_VERSION:
+                raise ValueError("%s is format version %d, too new for us" % \
+                                 (fn, self.version))
+            self.name = f.read(name_len).decode("utf-8", "replace")
+            pctl = f.read(4*npct)
+            if len(pctl) < 4*npct:
+                raise ValueError("%s has a truncated header" % fn)
+            self.pctl = struct.unpack("<%df" % npct, pctl)
+        self.pctl = tuple(int(p) if p == int(p) else p for p in self.pctl)
+        self.row = row_struct(npct, self.version)
+
+    def array(self):
+        """Every row as a read-only memory-mapped NumPy record array"""
+        dt = row_dtype(len(self.pctl), self.version)
+        with open(self.fn, "rb") as f:
+            f.seek(0, 2)
+            n = (f.tell() - self.header_size) // dt.itemsize
+        if not n: return np.zeros(0, dtype=dt)
+        # a row still being written at the end is left out
+        return np.memmap(self.fn, dtype=dt, mode="r",
+                         offset=self.header_size, shape=(n,))
+
+    def __iter__(self):
+        """Rows one at a time, with or without NumPy"""
+        return self.rows()
+
+    def rows(self, start=0, end=None):
+        """Rows start to end (exclusive), one at a time"""
+        with open(self.fn, "rb") as f:
+            f.seek(self.header_size + start*self.row.size)
+            left = None if end is None else end - start
+            while left is None or left > 0:
+                n = 1024 if left is None else min(1024, left)
+                buf = f.read(self.row.size*n)
+                buf = buf[:len(buf) - len(buf) % self.row.size]
+                if not buf: break
+                if left is not None: left -= len(buf) // self.row.size
+                if self.version < 2:
+                    for r in self.row.iter_unpack(buf):
+                        yield Row(r[0], r[1], r[2], r[3], r[4], r[5],
+                                  self.pctl, r[6:])
+                    continue
+                for r in self.row.iter_unpack(buf):
+                    yield Row(r[0], r[1], r[2], r[3], r[4], r[6], self.pctl,
+                              r[7:], None if r[5] != r[5] else r[5])
+
+
+def parse_text_time(ts):
+    """Epoch seconds from a text log timestamp. The UTC offset (%z) is used
+when the platform wrote a numeric one; otherwise the time is taken as local."""
+    t = (int(ts[0:4]), int(ts[5:7]), int(ts[8:10]), int(ts[11:13]),
+         int(ts[14:16]), int(ts[17:19]), 0, 0, -1)
+    z = ts[20:]
+    if len(z) == 5 and z[0] in "+-" and z[1:].isdigit():
+        off = (int(z[1:3])*60 + int(z[3:]))*60
+        return calendar.timegm(t) - (off if z[0] == "+" else -off)
+    return mktime(t)
+
+def parse_text_line(l):
+    """A Row from one line of a text log, or None if it isn't one"""
+    l = l.split(',')
+    if len(l) < 6: return None
+    try:
+        pctl = []
+        values = []
+        rms_db = None
+        for q in l[5:]:
+            p, v = q.split(':')
+            if p.strip() == "rms_db":
+                rms_db = float(v)
+                continue
+            p = float(p)
+            pctl.append(int(p) if p == int(p) else p)
+            values.append(float(v))
+        return Row(parse_text_time(l[0].strip()), float(l[1]), float(l[2]),
+                   None, float(l[3]), int(l[4]), tuple(pctl), tuple(values),
+                   rms_db)
+    except ValueError:
+        return None
+
+def read_text_log(fn):
+    """Rows of a text log, streamed line by line; bad lines are skipped"""
+    with open(fn, "r", errors="replace") as f:
+        for l in f:
+            r = parse_text_line(l)
+            if r is not None: yield r
+
+def read_log(fn):
+    """Rows of a log in either format, picked by its first bytes"""
+    with open(fn, "rb") as f: binary = f.read(len(MAGIC)) == MAGIC
+    return iter(BinaryLog(fn)) if binary else read_text_log(fn)
+
+
+def text_line(r):
+    """The text log line for row r, as Signal Logger itself would write it"""
+    return "%s, %9.6f,%10.6f, %7.2f, %d, %s%s\n" % \
+           (strftime(TEXT_TIME, localtime(int(r.timestamp))), r.lat, r.lon,
+            r.rms, r.samples, ', '.join(["%4.1f:%6.1f" % (p, v) for p, v \
+                                         in zip(r.pctl, r.values)]),
+            "" if r.rms_db is None else ", rms_db:%7.2f" % r.rms_db)
+
+def write_text(rows, out):
+    for r in rows: out.write(text_line(r))
+
+def level_style(dbm):
+    for i, (level, colour) in enumerate(KML_LEVELS):
+        if dbm >= level: return i
+
+def write_kml(rows, out, name="Signal Logger", pct=None):
+    """KML points coloured by RMS, or by the level at percentile pct.
+Rows without a position (0, 0) are left out."""
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+              '<name>%s</name>\n' % xml_escape(name))
+    for i, (level, colour) in enumerate(KML_LEVELS):
+        out.write('<Style id="l%d"><IconStyle><color>%s</color><scale>0.5'
+                  '</scale><Icon><href>http://maps.google.com/mapfiles/kml/'
+                  'shapes/shaded_dot.png</href></Icon></IconStyle></Style>\n' \
+                  % (i, colour))
+    for r in rows:
+        if not (r.lat or r.lon): continue
+        dbm = r.rms if pct is None else r.at(pct)
+        out.write('<Placemark><description>%s: %.1f dBm</description>'
+                  '<styleUrl>#l%d</styleUrl><Point><coordinates>%.6f,%.6f'
+                  '</coordinates></Point></Placemark>\n' % \
+                  (strftime("%Y-%m-%d %H:%M:%S", localtime(int(r.timestamp))),
+                   dbm, level_style(dbm), r.lon, r.lat))
+    out.write('</Document></kml>\n')
+
+def xml_escape(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Convert Signal Logger logs")
+    ap.add_argument("to", choices=("text", "kml", "info"))
+    ap.add_argument("logs", nargs="+")
+    ap.add_argument("-o", "--output", help="output file (default: stdout)")
+    ap.add_argument("--pct", type=float, default=None,
+                    help="colour KML by this percentile instead of RMS")
+    args = ap.parse_args()
+    if args.pct is not None and args.pct == int(args.pct):
+        args.pct = int(args.pct)
+    out = open(args.output, "w") if args.output else sys.stdout
+    rows = (r for fn in args.logs for r in read_log(fn))
+    if args.to == "text": write_text(rows, out)
+    elif args.to == "kml":
+        write_kml(rows, out, name=', '.join(args.logs), pct=args.pct)
+    else:
+        for fn in args.logs:
+            try:
+                log = BinaryLog(fn)
+                out.write("%s: binary v%d, receiver '%s', cal %.1f, %d rows, "
+                          "percentiles %s\n" % (fn, log.version, log.name,
+                                                log.cal, len(log.array()) \
+                                                if np is not None else \
+                                                sum(1 for r in log),
+                                                log.pctl))
+            except ValueError as e:
+                with open(fn, "rb") as f: binary = f.read(len(MAGIC)) == MAGIC
+                if binary: out.write("%s\n" % e) # but a broken one
+                else: out.write("%s: text, %d rows\n" % \
+                                (fn, sum(1 for r in read_text_log(fn))))
+    if args.output: out.close()
+
+if __name__ == "__main__": main()
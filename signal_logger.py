@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
 
+import asyncio
+import bisect
+import collections
 import configparser
+import functools
 import math
+import multiprocessing
+import os
+import queue
+import signal
 import struct
 import sys
 import threading
-import tkinter as tk
-import tkinter.font as tf
-from time import sleep, strftime
+from time import localtime, monotonic, perf_counter, sleep, strftime, time
 
-import serial
-import pyaudio
+import channelizer
+import gps
+import inputs
+import metrics
+import nmea
+import publish
+import siglog
+import sigrec
+
+tk = None # tkinter and tkinter.font; load_tk() imports them only when a
+tf = None # window is wanted, so headless mode runs without a display
+pyaudio = None # likewise load_pyaudio(), when an audio device is opened
+try:
+    import numpy as np
+except ImportError: # the pure-Python DSP path still works without it
+    np = None
+try:
+    from multiprocessing import shared_memory
+except ImportError: # Python < 3.8; DSP stays in-process
+    shared_memory = None
 
 
 DEFAULT_CONFIG = {
@@ -18,7 +42,7 @@ DEFAULT_CONFIG = {
         "sample_rate":"32000",
         "chunk_size":"32768",
         "log_without_gps":"false",
-        "gps_port":"COM1",
+        "gps_port":"",
         "gps_baud":"4800",
         "gps_bits":"8",
         "gps_parity":"N",
@@ -36,14 +60,44 @@ DEFAULT_CONFIG = {
 AUDIO_DEVICE = "hi-fi cable"
 NO_INPUT = 0.0000433 # internal noise of VB-Cable, measured.
 COLUMNS = 3 # number of columns per RF shim GUI
+MIN_SAMPLES = 50 # fewer valid samples than this give no percentiles
+DISPLAY_PERCENTILES = (15, 50, 70, 83, 87, 95)
+LOG_PERCENTILES = (0, 5, 10, 15, 25, 40, 50, 60, 65, 70, 75, 80, 83, 85, 87,
+                   90, 93, 95, 98, 99)
+PCT_MODE = "select" # or "histogram"
+PCT_RESOLUTION = 0.1 # dB per bin in histogram mode
+HIST_SPAN = 150. # dB above the noise floor covered by the histogram
+SUBSCRIBER_QUEUE = 8 # Measurements a slow consumer may fall behind by
+GUI_FPS = 10 # most label refreshes per second, however fast the DSP runs
+LOG_QUEUE = 256 # rows a slow disk may fall behind by before rows are dropped
+LOG_FLUSH = 5. # seconds between flush + fsync of log files
+DSP_SLOTS_PER_WORKER = 4 # shared-memory hops in flight per worker process
+RECORD_QUEUE = 1024 # hops and NMEA lines a recording may fall behind by
+GPS_HISTORY = 32 # positioned fixes kept for interpolation
+GPS_DEAD_RECKON = 3. # seconds past the last fix we extrapolate from it
+GPS_STALE = 5. # seconds from a fix after which positions aren't logged
+SESSION_LAG = 2 # ticks a session log row waits for late receivers
+EARTH_RADIUS = 6371000. # m
+NAN = float("nan")
+STATS_INTERVAL = 60. # seconds between stats lines; 0 for none
 VERSION = 0x0200
 
 
 # let GlobalParameters determine these in the future
 SAMPLE_FORMAT = "f" # define endianness?
 SAMPLE_SIZE = 4 # 32-bit floating point is 4 bytes per sample
-PA_FORMAT = pyaudio.paFloat32
+SAMPLE_DTYPE = "=f4" # NumPy equivalent of SAMPLE_FORMAT
+PA_FORMAT = "paFloat32" # PyAudio's name for SAMPLE_FORMAT
+
 
+def load_tk():
+    global tk, tf
+    import tkinter as tk
+    import tkinter.font as tf
+
+def load_pyaudio():
+    global pyaudio
+    import pyaudio
 
 def meter(pwr, cal=-65.94, floor=-122, scale=3):
     if cal: pwr = pwr_conv(pwr, cal=cal)
@@ -55,242 +109,1331 @@ def pwr_conv(raw_pwr, cal=-65.94):
     except ValueError:
         return -200.
 
-def get_audio_device(pa, name=None):
-    if not name: name = AUDIO_DEVICE
-    found_device = False
-    for dev in range(pa.get_device_count()):
-        dev_info = pa.get_device_info_by_index(dev)
-        if dev_info["name"].casefold().startswith(name.casefold()) and \
-           dev_info["maxInputChannels"]:
-            found_device = True
-            break
-    if not found_device: return
-    return dev
+def decode_python(data, chnls):
+    """Reference decoder: split raw interleaved samples into one list per
+channel. Slow, but needs nothing outside the standard library."""
+    res = [list() for i in range(chnls)]
+    for i in range(0, len(data), SAMPLE_SIZE):
+        res[(i//SAMPLE_SIZE) % chnls].append(\
+            struct.unpack(SAMPLE_FORMAT, data[i:i+SAMPLE_SIZE])[0])
+    n = len(res[-1]) # drop a trailing partial frame
+    return [r[:n] for r in res]
+
+def power_db(pwr, cal=-65.94):
+    """pwr_conv for a power (a squared magnitude) rather than a magnitude"""
+    if pwr <= 0.: return -200.
+    return 10*math.log10(pwr) + cal
+
+def power_python(res, ach, floor=NO_INPUT):
+    """Turn decoded channels into unsorted powers (squared magnitudes),
+keeping only those above floor, a magnitude: anything quieter than
+NO_INPUT is no input at all"""
+    floor *= floor
+    if ach == -1: sl = [i*i + q*q for i, q in zip(res[0], res[1])]
+    else: sl = [q*q for q in res[ach]]
+    return [q for q in sl if q > floor]
+
+def decode_numpy(data, chnls):
+    """Same as decode_python, but one (frames, chnls) array for the chunk"""
+    frames = np.frombuffer(data, dtype=SAMPLE_DTYPE)
+    frames = frames[:len(frames) // chnls * chnls].reshape(-1, chnls)
+    return frames.astype(np.float64) # match struct.unpack's precision
+
+def power_numpy(frames, ach, floor=NO_INPUT):
+    """Same as power_python, in one batched pass"""
+    if ach == -1: sl = frames[:, 0]**2 + frames[:, 1]**2
+    else: sl = frames[:, ach]**2
+    return sl[sl > floor*floor]
+
+def pct_index(pct, n):
+    """Index into n ascending samples of the level exceeded pct of the time.
+This is the same (slightly odd at 0%) indexing get_sig_at always used."""
+    if pct > 1: pct /= 100.
+    return int(-pct*n) % n
+
+def select_percentiles(sl, pctl):
+    """Find the samples at each of pctl by partitioned selection, no sort.
+Any monotonic scale gives the same samples, so powers can be selected
+first and only the selected few converted to dBm."""
+    idx = [pct_index(p, len(sl)) for p in pctl]
+    if np is not None and isinstance(sl, np.ndarray):
+        sl = np.partition(sl, sorted(set(idx)))
+        return tuple(float(sl[i]) for i in idx)
+    sl = sorted(sl) # the pure-Python path has no cheaper selection
+    return tuple(sl[i] for i in idx)
+
+@functools.lru_cache(maxsize=16)
+def hist_edges(floor, res=PCT_RESOLUTION):
+    """The power at the top of each res dB bin above the power floor, all
+but the last, which catches everything above HIST_SPAN dB"""
+    return [floor*10**((b + 1)*res/10) for b in range(int(HIST_SPAN/res) - 1)]
+
+@functools.lru_cache(maxsize=16)
+def hist_cells(floor, res=PCT_RESOLUTION):
+    """What db_histogram needs to bin NumPy powers without a search: (shift,
+first cell, bin each cell starts in, edges). A positive float64's bits sort
+as it does, so bits >> shift numbers a cell narrower than a bin; the bin
+the cell starts in, and one comparison with that bin's top edge, give the
+sample's bin."""
+    edges = np.array(hist_edges(floor, res) + [np.inf])
+    shift = 51 - math.ceil(math.log2(10*math.log10(2)/res))
+    lo = int(np.float64(floor).view(np.int64)) >> shift
+    hi = (int(edges[-2].view(np.int64)) >> shift) + 1
+    cells = (np.arange(lo, hi + 1, dtype=np.int64) << shift).view(np.float64)
+    return shift, lo, np.searchsorted(edges, cells, side="right"), edges
+
+def db_histogram(sl, floor, res=PCT_RESOLUTION):
+    """Count powers into res dB bins starting at the power floor. NumPy
+input gives a fixed-length array (the top bin catches everything above
+HIST_SPAN dB), so histograms from different chunks can simply be added and
+subtracted. Bins are found in linear power, against precomputed edges, so
+no log is taken per sample."""
+    if np is not None and isinstance(sl, np.ndarray):
+        shift, lo, table, edges = hist_cells(floor, res)
+        sl = np.ascontiguousarray(sl, dtype=np.float64)
+        b = np.take(table, (sl.view(np.int64) >> shift) - lo, mode="clip")
+        b += sl >= np.take(edges, b)
+        return np.bincount(b, minlength=len(edges))
+    edges = hist_edges(floor, res)
+    counts = {}
+    for q in sl:
+        b = bisect.bisect_right(edges, q)
+        counts[b] = counts.get(b, 0) + 1
+    return counts
+
+def histogram_lookup(hist, n, pctl, floor, res=PCT_RESOLUTION):
+    """Find each of pctl among the n samples counted in hist, whose bins
+start at floor dBm (bin centres)"""
+    idx = [pct_index(p, n) for p in pctl]
+    if np is not None and isinstance(hist, np.ndarray):
+        bins = np.searchsorted(np.cumsum(hist), np.array(idx) + 1)
+        return tuple(floor + (int(b) + 0.5)*res for b in bins)
+    res_bins = [None]*len(idx)
+    order = sorted(range(len(idx)), key=lambda q:idx[q])
+    cum = 0
+    j = 0
+    for b in sorted(hist):
+        cum += hist[b]
+        while j < len(order) and idx[order[j]] < cum:
+            res_bins[order[j]] = floor + (b + 0.5)*res
+            j += 1
+    return tuple(res_bins)
+
+PCT_MODES = ("select", "histogram")
+
+DSP_BACKENDS = {"python":(decode_python, power_python),
+                "numpy":(decode_numpy, power_numpy)}
+DSP_BACKEND = "numpy" if np is not None else "python"
+
+def hop_partial(sl, mode, floor, res=PCT_RESOLUTION, pctl=None,
+                compat=False):
+    """Reduce one hop of powers to what WindowStats keeps of it: (samples,
+sum of powers, samples or histogram, percentiles, dB sums). If pctl is
+given in select mode, the hop is its own window and is reduced all the way
+to percentile powers, so the samples themselves need not be kept. With
+compat, dB sums are the sum and sum of squares of each sample's level in
+dB (before cal), for the old RMS-of-dB figure; that costs the log10 per
+sample that everything else avoids."""
+    db = None
+    if np is not None and isinstance(sl, np.ndarray):
+        total = float(sl.sum())
+        if compat:
+            lv = 10*np.log10(sl)
+            db = (float(lv.sum()), float(np.dot(lv, lv)))
+    else:
+        total = math.fsum(sl)
+        if compat:
+            lv = [10*math.log10(q) for q in sl]
+            db = (math.fsum(lv), math.fsum([q*q for q in lv]))
+    if mode == "histogram":
+        return len(sl), total, db_histogram(sl, floor, res), None, db
+    if pctl is None: return len(sl), total, sl, None, db
+    if len(sl) < MIN_SAMPLES: return len(sl), total, None, None, db
+    return len(sl), total, None, select_percentiles(sl, pctl), db
+
+
+class WindowStats(object):
+    """Mean power and percentiles over the last `hops` hops of powers. Each
+hop is reduced once when it arrives (sample count, sum of powers and either
+its samples or its histogram); the window totals are then updated by adding
+the new hop and dropping the oldest, instead of redoing every sample.
+Nothing kept depends on cal, which result() applies to the few values it
+returns, so a new cal takes effect without restarting the window.
+Selection needs every sample of the window at once, so a window of more
+than one hop keeps a histogram even in select mode: otherwise each hop
+would cost as much as the whole window."""
+    def __init__(self, hops, pctl, mode=PCT_MODE, res=PCT_RESOLUTION,
+                 floor=NO_INPUT, compat=False):
+        self.hops = max(1, hops)
+        self.pctl = pctl
+        self.mode = "histogram" if self.hops > 1 else mode
+        self.res = res
+        self.floor = floor*floor # as a power
+        self.compat = compat # also find the old RMS of dB
+        self.reset()
+
+    def reset(self):
+        """Forget every hop"""
+        self.ring = collections.deque()
+        self.hist = None
+
+    def push(self, sl):
+        """Add one hop of floor-filtered powers, evicting the oldest"""
+        self.push_partial(*hop_partial(sl, self.mode, self.floor, self.res,
+                                       self.pctl if self.hops == 1 else None,
+                                       self.compat))
+
+    def push_partial(self, n, total, data, pv=None, db=None):
+        """Add one hop already reduced by hop_partial"""
+        if self.mode == "histogram": self._hist_add(data, 1)
+        self.ring.append((n, total, data, pv, db))
+        if len(self.ring) > self.hops:
+            old = self.ring.popleft()
+            if self.mode == "histogram": self._hist_add(old[2], -1)
+
+    def _hist_add(self, hist, sign):
+        if isinstance(hist, dict):
+            if self.hist is None: self.hist = {}
+            for b, c in hist.items():
+                self.hist[b] = self.hist.get(b, 0) + sign*c
+        elif self.hist is None: self.hist = hist.copy()
+        else: self.hist += sign*hist
+
+    def result(self, cal):
+        """(samples, mean power in dBm, percentile values in dBm or None,
+RMS of the dB values or None) over the whole window, at cal"""
+        n = sum(h[0] for h in self.ring)
+        if not n: return 0, None, None, None
+        s = power_db(sum(h[1] for h in self.ring)/n, cal)
+        rms_db = None
+        if self.compat:
+            s1 = sum(h[4][0] for h in self.ring)
+            s2 = sum(h[4][1] for h in self.ring)
+            rms_db = math.sqrt(max(s2 + 2*cal*s1 + n*cal*cal, 0.)/n)
+        if n < MIN_SAMPLES: return n, s, None, rms_db
+        if self.mode == "histogram":
+            return n, s, histogram_lookup(self.hist, n, self.pctl,
+                                          power_db(self.floor, cal),
+                                          self.res), rms_db
+        # select mode keeps one hop: its percentiles, or its samples if
+        # the hop was reduced without them
+        h = self.ring[-1]
+        pv = h[3] if h[2] is None else select_percentiles(h[2], self.pctl)
+        return n, s, tuple(power_db(v, cal) for v in pv), rms_db
+
+
+class Measurement(collections.namedtuple("Measurement",
+                                         ["seq", "timestamp", "cal", "rms",
+                                          "samples", "pctl", "values",
+                                          "start", "end", "rms_db"])):
+    """Everything computed from one chunk. Producers publish a new one by
+replacing a single reference, so a reader always sees one whole chunk.
+rms is the mean power in dBm (None without samples); rms_db is the RMS of
+the samples' dBm values that Signal Logger used to report, if asked for.
+start and end are when the audio it covers was captured, on the
+time.monotonic() clock (the same one GPS fixes are stamped with)."""
+    __slots__ = ()
+
+    def midpoint(self):
+        return (self.start + self.end)/2
+
+    def at(self, pct):
+        """Value at one or a list of percentiles, or None if too few samples"""
+        if self.values is None: return None
+        if isinstance(pct, (list, tuple)):
+            return [self.values[self.pctl.index(p)] for p in pct]
+        return self.values[self.pctl.index(pct)]
+
+
+class Subscription(object):
+    """A bounded queue of Measurements for one consumer. The producer never
+waits on it (except in replay, for up to a second); a consumer that falls
+behind misses chunks, and counts them."""
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE):
+        self.q = queue.Queue(maxsize)
+        self.last_seq = None
+        self.dropped = 0 # chunks this consumer never saw
+
+    def put(self, m, block=False):
+        """Producer side: hand over one Measurement (or None to close)"""
+        try: self.q.put(m, block, timeout=1.)
+        except queue.Full:
+            if m is not None: return # the gap shows up in seq on the far end
+            try: self.q.get_nowait() # make room for the close sentinel
+            except queue.Empty: pass
+            self.q.put_nowait(m)
+
+    def get(self, timeout=None):
+        """Consumer side: next Measurement, or None on timeout or close"""
+        try: m = self.q.get(timeout=timeout)
+        except queue.Empty: return None
+        if m is None: return None
+        if self.last_seq is not None and m.seq > self.last_seq + 1:
+            self.dropped += m.seq - self.last_seq - 1
+        self.last_seq = m.seq
+        return m
+
+
+class AudioContext(object):
+    """The process's one PyAudio instance, and its devices, enumerated once.
+PortAudio only enumerates devices when it starts anyway, so the catalogue
+holds for as long as the instance does. Get it with audio_context()."""
+    def __init__(self):
+        t0 = perf_counter()
+        load_pyaudio()
+        self.pa = pyaudio.PyAudio()
+        self.devices = [self.pa.get_device_info_by_index(i) \
+                        for i in range(self.pa.get_device_count())]
+        # (casefolded name, index) of every input device, sorted by name, so
+        # the devices starting with any prefix are a run found by bisection
+        self.inputs = sorted((d["name"].casefold(), i) \
+                             for i, d in enumerate(self.devices) \
+                             if d["maxInputChannels"])
+        self.found = {} # casefolded prefix: device index, or None
+        self.lock = threading.Lock()
+        print("Audio: %d input device(s) found in %.2f s" % \
+              (len(self.inputs), perf_counter() - t0))
+
+    def find(self, name=None):
+        """Index of the first input device whose name starts with name, or
+None. Case is ignored."""
+        key = (name or AUDIO_DEVICE).casefold()
+        if key not in self.found:
+            i = bisect.bisect_left(self.inputs, (key,))
+            matches = []
+            while i < len(self.inputs) and self.inputs[i][0].startswith(key):
+                matches.append(self.inputs[i][1])
+                i += 1
+            self.found[key] = min(matches) if matches else None
+        return self.found[key]
+
+    def name(self, dev):
+        if not 0 <= dev < len(self.devices):
+            raise IOError("No audio device %d!" % dev)
+        return self.devices[dev]["name"]
+
+    def open(self, dev, chnls, sr):
+        with self.lock: # PortAudio's stream setup is not thread-safe
+            return self.pa.open(format=getattr(pyaudio, PA_FORMAT),
+                                channels=chnls, rate=sr, input=True,
+                                input_device_index=dev)
+
+    def close(self):
+        self.pa.terminate()
+
+
+_audio = None
+_audio_lock = threading.Lock()
+
+def audio_context():
+    """The shared AudioContext, started on first use"""
+    global _audio
+    with _audio_lock:
+        if _audio is None: _audio = AudioContext()
+        return _audio
+
+def close_audio_context():
+    global _audio
+    with _audio_lock:
+        if _audio is not None: _audio.close()
+        _audio = None
+
+
+def dsp_worker(shm_name, slot_bytes, dsp, tasks, results):
+    """DSPWorkerPool process: reduce raw hops found in shared memory"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    decode, power = DSP_BACKENDS[dsp]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None: break
+            slot, nbytes, end, cid, chnls, ach, floor, mode, res, pctl, \
+                  compat = task
+            t0 = perf_counter()
+            data = shm.buf[slot*slot_bytes:slot*slot_bytes + nbytes]
+            sl = power(decode(data, chnls), ach, floor)
+            data.release()
+            partial = hop_partial(sl, mode, floor*floor, res, pctl, compat)
+            results.put((cid, slot, end, perf_counter() - t0) + partial)
+    finally:
+        shm.close()
+
+
+class DSPWorkerPool(object):
+    """Worker processes that run the power and percentile math for the
+capture threads, so receivers are not serialized by the GIL. Raw hops are
+copied once into a ring of shared-memory slots; only the reduced hop
+(see hop_partial) comes back, and is fed to its MultiParametersManager.
+That is the hop's percentiles when it is the whole window, and its
+histogram otherwise, so neither what is sent back nor the collector's share
+of the work grows with the window. Each receiver always goes to the same
+worker, which keeps its hops in order."""
+    def __init__(self, workers, slot_bytes, dsp=DSP_BACKEND):
+        self.workers = workers
+        self.slot_bytes = slot_bytes
+        self.dsp = dsp
+        self.nslots = workers*DSP_SLOTS_PER_WORKER
+        self.free = collections.deque(range(self.nslots))
+        self.refs = [0]*self.nslots
+        self.lock = threading.Lock()
+        self.consumers = {}
+        self.next_cid = 0
+        self.dropped = 0 # hops discarded because every slot was busy
+
+    def start(self):
+        # spawn, not fork: forking a process full of threads (and Tk) is
+        # asking for trouble, and spawn is all Windows has anyway
+        ctx = multiprocessing.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=self.slot_bytes*self.nslots)
+        self.results = ctx.Queue()
+        self.tasks = [ctx.Queue() for i in range(self.workers)]
+        self.procs = [ctx.Process(target=dsp_worker,
+                                  args=(self.shm.name, self.slot_bytes,
+                                        self.dsp, q, self.results),
+                                  daemon=True) for q in self.tasks]
+        for p in self.procs: p.start()
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def register(self, mpm):
+        with self.lock:
+            mpm.pa_cid = self.next_cid
+            self.next_cid += 1
+            self.consumers[mpm.pa_cid] = mpm
+
+    def unregister(self, mpm):
+        with self.lock:
+            self.consumers.pop(getattr(mpm, "pa_cid", None), None)
+
+    def submit(self, data, mpms, end=None):
+        """Queue one raw hop, captured up to monotonic time end, for every
+one of mpms. Never waits: if every slot is still busy, the hop is dropped
+and False returned."""
+        if not mpms: return True
+        if len(data) > self.slot_bytes:
+            raise ValueError("Hop of %d bytes does not fit a %d byte slot" % \
+                             (len(data), self.slot_bytes))
+        with self.lock:
+            if not self.free:
+                self.dropped += 1
+                return False
+            slot = self.free.popleft()
+            self.refs[slot] = len(mpms)
+        self.shm.buf[slot*self.slot_bytes:slot*self.slot_bytes + len(data)] = \
+            data
+        if end is None: end = monotonic()
+        for mpm in mpms:
+            self.tasks[mpm.pa_cid % self.workers].put(\
+                (slot, len(data), end, mpm.pa_cid, mpm.pa_chnls, mpm.ach,
+                 mpm.floor, mpm.pa_win.mode, mpm.pct_res,
+                 mpm.pa_pctl if mpm.pa_win.hops == 1 else None, mpm.compat))
+        return True
+
+    def collect(self):
+        while True:
+            res = self.results.get()
+            if res is None: break
+            cid, slot, end, dt = res[:4]
+            with self.lock:
+                self.refs[slot] -= 1
+                if not self.refs[slot]: self.free.append(slot)
+                mpm = self.consumers.get(cid)
+            if mpm is not None: mpm.feed_partial(*res[4:], end=end, dt=dt)
+
+    def stop(self):
+        for q in self.tasks: q.put(None)
+        for p in self.procs: p.join(timeout=5)
+        self.results.put(None)
+        self.collector.join(timeout=5)
+        self.shm.close()
+        self.shm.unlink()
+
+
+class AudioCapture(object):
+    """One open input stream. Each chunk is read and decoded once, then the
+decoded channels go to every MultiParametersManager attached to it. opener
+returns the stream: a PyAudio one, or anything from inputs.py; with lazy,
+it is called in the capture thread, since pipes and sockets may take a
+while to open."""
+    def __init__(self, opener, name, dev, chnls, sr, hop, decode, pool=None,
+                 recorder=None, lazy=False):
+        self.opener = opener
+        self.name = name
+        self.dev = dev
+        self.chnls = chnls
+        self.sr = sr
+        self.hop = hop
+        self.decode = decode
+        self.pool = pool # a DSPWorkerPool, or None to process in this thread
+        self.recorder = recorder # a Recorder to save every hop to, or None
+        if recorder:
+            self.sid = recorder.stream(sr, chnls, hop, dev, name)
+        self.lazy = lazy
+        self.stream = None
+        self.running = False
+        self.consumers = []
+        self.t_proc = metrics.Timing() # everything done with a hop once read
+        self.overflows = 0 # hops PyAudio lost because we read too late
+
+    def attach(self, mpm):
+        if self.pool: self.pool.register(mpm)
+        self.consumers = self.consumers + [mpm] # swapped, like MPM.subs
+
+    def detach(self, mpm):
+        self.consumers = [q for q in self.consumers if q is not mpm]
+        if self.pool: self.pool.unregister(mpm)
+
+    def start(self):
+        if not self.lazy: self.stream = self.opener()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        if self.stream is None:
+            try: self.stream = self.opener()
+            except (IOError, OSError, ValueError) as e:
+                print("Couldn't open input %s: %s" % (self.name, e))
+                return
+        while self.running:
+            try: data = self.stream.read(self.hop)
+            except EOFError:
+                print("Input %s has ended" % self.name)
+                break
+            except (IOError, OSError) as e:
+                if pyaudio and pyaudio.paInputOverflowed in e.args:
+                    # that hop is gone
+                    self.overflows += 1
+                    continue
+                print("Input %s failed: %s" % (self.name, e))
+                break
+            end = monotonic() # the hop's last frame has just arrived
+            t0 = perf_counter()
+            if self.recorder: self.recorder.audio(self.sid, end, data)
+            local = self.consumers
+            if self.pool: # channelizers need the frames here, not in a worker
+                self.pool.submit(data, [m for m in local if not m.channelizer],
+                                 end)
+                local = [m for m in local if m.channelizer]
+            if local:
+                frames = self.decode(data, self.chnls)
+                for mpm in local: mpm.feed_frames(frames, end)
+            self.t_proc.add(perf_counter() - t0)
+        self.stream.close()
+
+
+class CaptureManager(object):
+    """Opens each physical input device once, keyed by its device index, no
+matter how many receivers are configured against it"""
+    def __init__(self, workers=0, recorder=None):
+        self.captures = {}
+        self.lock = threading.Lock()
+        if workers and shared_memory is None:
+            print("DSP worker processes need Python 3.8 or later")
+            workers = 0
+        self.workers = workers
+        self.pool = None
+        self.recorder = recorder
+
+    def start_pool(self, mpm):
+        """Start the DSPWorkerPool, if we want one, sized for mpm's hops"""
+        if self.workers and self.pool is None:
+            self.pool = DSPWorkerPool(self.workers,
+                                      mpm.pa_hop*mpm.pa_chnls*SAMPLE_SIZE,
+                                      mpm.dsp)
+            self.pool.start()
+
+    def attach(self, mpm):
+        """Resolve mpm's device, opening it if nobody else has, and start
+feeding mpm from it"""
+        with self.lock:
+            if mpm.input == "pyaudio": key, name, opener = self.pyaudio(mpm)
+            else: key, name, opener = self.other_input(mpm)
+            mpm.pa_dev = key
+            cap = self.captures.get(key)
+            self.start_pool(mpm)
+            if cap is None:
+                cap = AudioCapture(opener, name,
+                                   key if isinstance(key, int) else -1,
+                                   mpm.pa_chnls, mpm.pa_sr, mpm.pa_hop,
+                                   mpm.decode, self.pool, self.recorder,
+                                   lazy=mpm.input != "pyaudio")
+                self.captures[key] = cap
+                cap.attach(mpm)
+                cap.start()
+            elif (cap.sr, cap.hop) != (mpm.pa_sr, mpm.pa_hop):
+                raise IOError("Input %s is already open with a different \
+sample rate or hop size!" % name)
+            else: cap.attach(mpm)
+            return cap
+
+    def pyaudio(self, mpm):
+        """(key, name, opener) for mpm's PyAudio device"""
+        audio = audio_context()
+        if isinstance(mpm.adev, str): dev = audio.find(mpm.adev)
+        else: dev = mpm.adev
+        if dev == None:
+            raise IOError("No suitable audio device found!")
+        return dev, audio.name(dev), \
+               lambda: audio.open(dev, mpm.pa_chnls, mpm.pa_sr)
+
+    def other_input(self, mpm):
+        """(key, name, opener) for a file, pipe or rtl_tcp input. WAV files
+bring their own sample rate and channel count, which mpm takes on."""
+        chnls, sr = inputs.probe(mpm.input, mpm.adev)
+        if sr and sr != mpm.pa_sr:
+            print("%s is at %d Hz; using that" % (mpm.adev, sr))
+            mpm.pa_sr = sr
+        if chnls < 2 and mpm.ach == -1:
+            raise IOError("%s has no I/Q; set a channel" % mpm.adev)
+        mpm.pa_chnls = chnls
+        return (mpm.input, mpm.adev), mpm.adev, \
+               lambda: inputs.open_input(mpm.input, mpm.adev, mpm.pa_sr,
+                                         **mpm.input_opts)
+
+    def detach(self, mpm):
+        """Stop feeding mpm; close its device if it was the last user"""
+        with self.lock:
+            cap = self.captures.get(getattr(mpm, "pa_dev", None))
+            if cap is None: return
+            cap.detach(mpm)
+            if not cap.consumers:
+                cap.stop()
+                del self.captures[mpm.pa_dev]
+
+    def close(self):
+        with self.lock:
+            for cap in self.captures.values(): cap.stop()
+            self.captures = {}
+            if self.pool: self.pool.stop()
+            self.pool = None
+
+
+class ReplayManager(CaptureManager):
+    """Stands in for CaptureManager, feeding receivers from a recording
+(see sigrec.py) instead of live devices. Receivers get the audio of the
+first recorded device whose name their source matches, as they would live;
+NMEA lines go to gpm. Nothing waits for real time, and nothing is dropped:
+the replay waits for slow consumers instead."""
+    def __init__(self, fn, gpm, workers=0, on_end=None):
+        CaptureManager.__init__(self, workers)
+        self.rec = sigrec.Recording(fn)
+        self.gpm = gpm
+        self.on_end = on_end # called once everything has been replayed
+        self.consumers = []
+        self.unfed = [] # consumers the finished replay had nothing for
+        self.running = False
+
+    def attach(self, mpm):
+        with self.lock:
+            mpm.lossless = True
+            mpm.pa_clock = self.rec.wall0 - self.rec.mono0
+            self.start_pool(mpm)
+            if self.pool: self.pool.register(mpm)
+            self.consumers = self.consumers + [mpm]
+
+    def detach(self, mpm):
+        with self.lock:
+            self.consumers = [q for q in self.consumers if q is not mpm]
+            if self.pool: self.pool.unregister(mpm)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        CaptureManager.close(self)
+
+    def source_of(self, mpm, stream):
+        """Whether mpm's configured source is this recorded stream"""
+        sr, chnls, hop, dev, name = stream
+        if isinstance(mpm.adev, str):
+            return name.casefold().startswith(mpm.adev.casefold())
+        return mpm.adev == dev
+
+    def matches(self, mpm, stream):
+        """Whether to feed mpm from stream: it must be mpm's source, and
+recorded at mpm's sample rate. Its hops need not be mpm's: see rechunk."""
+        return self.source_of(mpm, stream) and stream[0] == mpm.pa_sr
+
+    def rechunk(self, pending, sid, stream, hop, payload, t):
+        """Cut the recorded hops of stream sid, as they come, into hops of
+`hop` frames, as PyAudio would have read them; pending keeps what is left
+over until the next one. Yields (raw hop, monotonic time it ends)."""
+        sr, chnls, rec_hop = stream[:3]
+        left = pending.get((sid, hop), b"")
+        if hop == rec_hop and not left:
+            yield payload, t
+            return
+        frame = chnls*SAMPLE_SIZE
+        buf = left + payload
+        i = 0
+        while len(buf) - i >= hop*frame:
+            i += hop*frame
+            yield buf[i - hop*frame:i], t - (len(buf) - i)//frame/sr
+        pending[(sid, hop)] = buf[i:]
+
+    def feed(self, data, t, chnls, mpms):
+        """Hand one raw hop, ending at monotonic time t, to every one of
+mpms, waiting for the pool rather than dropping it"""
+        if self.pool:
+            while not self.pool.submit(data, [m for m in mpms \
+                                              if not m.channelizer], t):
+                sleep(0.001)
+            mpms = [m for m in mpms if m.channelizer]
+        if not mpms: return
+        frames = mpms[0].decode(data, chnls)
+        for mpm in mpms: mpm.feed_frames(frames, t)
+
+    def run(self):
+        streams = {}
+        pending = {} # (stream, hop): recorded audio short of a whole hop
+        t0 = monotonic()
+        audio = {} # seconds of audio replayed, by stream
+        fed = set() # consumers that got any of it
+        for kind, sid, t, payload in self.rec:
+            if not self.running: return
+            if kind == sigrec.NMEA: self.gpm.feed_nmea(payload, t)
+            elif kind == sigrec.STREAM:
+                streams[sid] = stream = sigrec.parse_stream(payload)
+                for mpm in self.consumers:
+                    if self.matches(mpm, stream): mpm.pa_chnls = stream[1]
+                    elif self.source_of(mpm, stream):
+                        print("Replay: '%s' was recorded at %d Hz; set "
+                              "sample_rate to match to replay it" % \
+                              (stream[4], stream[0]))
+            elif kind == sigrec.AUDIO and sid in streams:
+                stream = streams[sid]
+                mpms = [m for m in self.consumers if self.matches(m, stream)]
+                if not mpms: continue
+                audio[sid] = audio.get(sid, 0.) + stream[2]/stream[0]
+                fed.update(id(m) for m in mpms)
+                for hop in sorted(set(m.pa_hop for m in mpms)):
+                    group = [m for m in mpms if m.pa_hop == hop]
+                    for data, end in self.rechunk(pending, sid, stream, hop,
+                                                  payload, t):
+                        self.feed(data, end, stream[1], group)
+        while self.pool and len(self.pool.free) < self.pool.nslots:
+            sleep(0.01) # let the workers finish what's in flight
+        dt = monotonic() - t0
+        secs = max(audio.values()) if audio else 0.
+        print("Replay: %.1f s of audio in %.1f s (%.0fx real time)" % \
+              (secs, dt, secs/dt if dt else 0.))
+        self.unfed = [m for m in self.consumers if id(m) not in fed]
+        for mpm in self.unfed:
+            print("Replay: nothing in the recording for '%s'" % mpm.adev)
+        if self.on_end: self.on_end()
+
+
+class Location(collections.namedtuple("Location", ["lat", "lon", "age"])):
+    """Where we were at some time. age is how many seconds that time is
+from the GPS fix the position comes from, or None without any fix."""
+    __slots__ = ()
 
 
 class GlobalParametersManager(object): # GPM
     """Handle parameters that need to be shared, like GPS position"""
-    def __init__(self, serial_parameters, serial_url=False):
+    def __init__(self, serial_parameters, serial_url=False, stale=GPS_STALE):
         self.cpi = serial_parameters # ComPortInfo
-        self.comport_url = serial_url
-        self.gps_running = False
-        self.lat = 0.
-        self.lon = 0.
+        self.comport_url = serial_url # gps.make_sources URLs, if any
+        self.stale = stale # seconds from a fix after which it's not trusted
+        self.loop = None # the gps.EventLoop reading every source
+        self.own_loop = False # whether we started it, and stop it
+        self.tasks = [] # futures of the tasks reading them
+        self.sources = []
+        self.fix = (0., 0.) # (lat, lon), replaced whole on every update
+        self.gps_fix = nmea.NO_FIX # the same, with quality, speed and so on
+        self.history = () # (monotonic time, GPSFix) of recent positions
+        self.nmea = nmea.NMEAParser() # for replayed lines; sources have
+        self.gpsd = gps.GPSDParser() # parsers of their own
+        self.recorder = None # a Recorder to save every NMEA line to, or None
         self.log_loc_override = False # enable to allow non-GPS logging
 
-    def start_gps(self):
-        if self.gps_running: self.stop_gps()
-        self.gps_rdy = threading.Event()
-        self.gps_rdy.set()
-        self.gps_running = True
-        res = self.reset_gps()
-        self.gps_thread = threading.Thread(target=self.run_gps, daemon=True)
-        self.gps_thread.start()
-        return res
-
-    def reset_gps(self):
-        try:
-            if not self.comport_url:
-                self.gps_ser = serial.Serial(**self.cpi)
-            else:
-                # UNTESTED: pyserial lets us use tcp connections for serial
-                self.gps_ser = serial.serial_for_url(self.comport_url,
-                                                     **self.cpi)
-        except serial.SerialException as e:
-            print("GPS: Serial did not open! Error info:")
-            print(e.args[0], end='\n\n')
+    def start_gps(self, loop=None):
+        """Start reading every GPS source as tasks on loop, a running
+gps.EventLoop; without one, on one of our own"""
+        if self.loop: self.stop_gps()
+        try: self.sources = gps.make_sources(self.comport_url, self.cpi,
+                                             self.source_line)
+        except ValueError as e:
+            print("GPS: %s" % e)
+            self.sources = []
+        if not self.sources: # an empty gps_port turns the GPS off
+            print("GPS: \
+Running without GPS! Location data will not be collected.")
             return False
+        self.own_loop = loop is None
+        if loop is None:
+            loop = gps.EventLoop()
+            loop.start()
+        self.loop = loop
+        self.tasks = [loop.spawn(src.run()) for src in self.sources] + \
+                     [loop.spawn(self.watch())]
         return True
 
     def stop_gps(self):
-        self.gps_running = False
-        try:
-            self.gps_ser.close()
-            print("GPS: Serial port released.")
-        except: pass
-        if hasattr(self, "gps_rdy"): self.gps_rdy.set()
+        if self.loop is None: return
+        if self.own_loop: self.loop.stop()
+        else:
+            for task in self.tasks: task.cancel() # sources close themselves
+        self.loop = None
+        self.tasks = []
+        print("GPS: Released.")
 
     def get_gps(self):
-        self.gps_rdy.wait()
-        self.gps_rdy.clear()
-        out = tuple([self.lat, self.lon])
-        self.gps_rdy.set()
-        return out
+        return self.fix
 
-    def run_gps(self):
-        if not hasattr(self, "gps_ser"):
-            print("GPS: \
-Running without GPS! Location data will not be collected.")
-            self.gps_rdy.set()
-            return
-        while self.gps_running:
-            try: l = self.gps_ser.readline()
-            except:
-                print("GPS: Device reset due to failure!")
-                print(sys.exc_info())
-                while self.gps_running:
-                    sleep(1)
-                    if self.reset_gps(): break
-                    sleep(1)
-                if self.gps_running: print("GPS: Device recovered!")
-                continue
-            # compute and verify checksum
-            cs_idx = l.find(b"*")
-            if cs_idx == -1:
-                sleep(0.001)
-                continue
-            cs = 0
-            for c in l[1:cs_idx]:
-                cs = cs ^ c
-            # string process
-            l = l.decode("ascii", "ignore")
-            cs_idx = (l.find("*"), l.find("\r"))
-            if cs_idx[0] == -1 or cs_idx[1] == -1:
-                sleep(0.001)
-                print("GPS: Checksum Missing!")
-                continue
-            try:
-                if int(l[cs_idx[0]+1:cs_idx[1]], 16) != cs:
-                    print("GPS: Checksum Mismatch!")
-                    continue
-            except ValueError:
-                print("GPS: Checksum could not parse for:\n'%s'" % l)
-                continue
-            if not l.startswith("$GPGGA,"): continue
-            l = l.strip('\r\n').split(',')
-            if not l[2]: continue
-            lat = (int(l[2][:2])+float(l[2][2:])/60)*(-1 if l[3] == 'S' else 1)
-            lon = (int(l[4][:3])+float(l[4][3:])/60)*(-1 if l[5] == 'W' else 1)
-            self.gps_rdy.wait()
-            self.gps_rdy.clear()
-            self.lat = lat
-            self.lon = lon
-            self.gps_rdy.set()
+    def get_fix(self):
+        """The full nmea.GPSFix: quality, HDOP, speed, heading, UTC time"""
+        return self.gps_fix
+
+    def fix_age(self, t=None):
+        """Seconds from the last positioned fix to monotonic time t (now,
+by default), or None if there has been none"""
+        hist = self.history
+        if not hist: return None
+        return (monotonic() if t is None else t) - hist[-1][0]
+
+    def resets(self):
+        """Times any source has had to be reopened"""
+        return sum(src.reconnects for src in self.sources)
+
+    def parsers(self):
+        return [self.nmea, self.gpsd] + [src.parser for src in self.sources]
+
+    async def watch(self):
+        """Say when the fix goes stale, and when it is back"""
+        fresh = False
+        while True:
+            age = self.fix_age()
+            if fresh and (age is None or age > self.stale):
+                if age is None: print("GPS: Fix lost; positions are stale")
+                else: print("GPS: No fix for %.0f s; positions are stale" % \
+                            age)
+                fresh = False
+            elif not fresh and age is not None and age <= self.stale:
+                print("GPS: Fix acquired")
+                fresh = True
+            await asyncio.sleep(1.)
+
+    def position_at(self, t):
+        """Location at monotonic time t: interpolated between the fixes
+either side of t, or dead-reckoned from the speed and heading of the last
+fix before it (for at most GPS_DEAD_RECKON seconds). Its age is how far t
+is from the nearest fix used. Falls back to get_gps() without any
+positioned fixes, with an age of None."""
+        hist = self.history
+        if not hist: return Location(self.fix[0], self.fix[1], None)
+        i = len(hist) - 1
+        while i and hist[i][0] > t: i -= 1
+        t0, a = hist[i]
+        if t <= t0: # older than anything we kept
+            return Location(a.lat, a.lon, t0 - t)
+        if i + 1 < len(hist):
+            t1, b = hist[i+1]
+            k = (t - t0)/(t1 - t0)
+            return Location(a.lat + (b.lat - a.lat)*k,
+                            a.lon + (b.lon - a.lon)*k, min(t - t0, t1 - t))
+        if not a.speed or a.heading is None or t - t0 > GPS_DEAD_RECKON:
+            # stopped, or the GPS has gone quiet
+            return Location(a.lat, a.lon, t - t0)
+        d = a.speed*(t - t0)/EARTH_RADIUS # radians
+        hdg = math.radians(a.heading)
+        return Location(a.lat + math.degrees(d*math.cos(hdg)),
+                        a.lon + math.degrees(d*math.sin(hdg)/ \
+                                             max(math.cos(math.radians(a.lat)),
+                                                 1e-6)),
+                        t - t0)
+
+    def is_fresh(self, loc):
+        """Whether Location loc is near enough a fix to log"""
+        return loc.age is not None and loc.age <= self.stale
+
+    def source_line(self, src, l, t):
+        """gps.Source handler: record and parse one line from src"""
+        if self.recorder: self.recorder.nmea(t, l)
+        self.feed_nmea(l, t, src.parser)
+
+    def feed_nmea(self, l, t, parser=None):
+        """Take one line (bytes) of NMEA, or of gpsd's JSON, read at
+monotonic time t. Without a parser, it is told apart by its first byte."""
+        if parser is None: parser = self.gpsd if l[:1] == b"{" else self.nmea
+        bad = parser.bad_checksum
+        positions = parser.positions
+        fix = parser.feed(l)
+        if parser.bad_checksum != bad:
+            print("GPS: %s for:\n%r" % ("Not JSON" if l[:1] == b"{" else \
+                                        "Checksum missing or mismatched", l))
+        if fix is None: return
+        self.gps_fix = fix
+        if fix.quality: self.fix = (fix.lat, fix.lon)
+        if parser.positions != positions:
+            self.history = self.history[1-GPS_HISTORY:] + ((t, fix),)
 
 class MultiParametersManager(object): # MPM
-    def __init__(self, adev=None, ach=-1):
-        # perhaps this should get a PyAudio instance from GPM?
+    def __init__(self, adev=None, ach=-1, dsp=None, pctl=None,
+                 pct_mode=None, pct_res=PCT_RESOLUTION, sr=32000, cs=32768,
+                 hop=None, input="pyaudio", input_opts=None, floor=NO_INPUT,
+                 compat=False):
         self.pa_running = False
+        if dsp == None: dsp = DSP_BACKEND
+        if dsp not in DSP_BACKENDS or (dsp == "numpy" and np is None):
+            print("DSP backend '%s' unavailable, using 'python'" % dsp)
+            dsp = "python"
+        self.dsp = dsp
+        self.decode, self.power = DSP_BACKENDS[dsp]
+        if pctl == None:
+            pctl = sorted(set(DISPLAY_PERCENTILES + LOG_PERCENTILES))
+        self.pa_pctl = tuple(pctl) # percentiles computed for every chunk
+        if pct_mode == None: pct_mode = PCT_MODE
+        if pct_mode not in PCT_MODES:
+            print("Percentile mode '%s' unknown, using '%s'" % (pct_mode,
+                                                                PCT_MODE))
+            pct_mode = PCT_MODE
+        self.pct_mode = pct_mode
+        self.pct_res = pct_res
         self.cal = -46.
         if adev == None: adev = AUDIO_DEVICE
-        self.adev = adev
+        self.adev = adev # device name or index; or file, pipe, host:port
+        self.input = input # one of inputs.KINDS
+        self.input_opts = input_opts or {} # for inputs.open_input
         self.ach = ach
-        self.pa_s = 0
-        self.pa_sl = []
+        self.floor = floor # magnitudes below this are no input
+        self.compat = compat # also compute the old RMS of dB
+        self.pa_seq = 0 # chunks processed since start_audio
+        self.pa_meas = Measurement(0, 0., self.cal, None, 0, self.pa_pctl,
+                                   None, 0., 0., None)
         self.pa_chnls = 2
-        self.pa_sr = 32000
-        self.pa_cs = 32768
+        self.pa_sr = sr
+        self.pa_cs = cs # analysis window
+        self.pa_hop = hop if hop else cs # frames read per update
+        self.pa_win = WindowStats(-(-cs // self.pa_hop), self.pa_pctl,
+                                  self.pct_mode, self.pct_res, floor, compat)
+        self.pa_clock = None # wall minus monotonic time, when replaying
+        self.lossless = False # wait for slow subscribers rather than drop
+        self.subs = []
+        self.t_dsp = metrics.Timing() # power and window statistics per hop
+        self.channelizer = None # feeds narrowband channels of our I/Q onward
 
-    def start_audio(self):
+    def start_audio(self, cm=None):
+        """Start receiving audio through CaptureManager cm, which may already
+have our device open for another receiver; without one, use a private one"""
         if self.pa_running: self.stop_audio()
-        self.pa_rdy = threading.Event()
-        self.pa_rdy.set()
-        self.pa = pyaudio.PyAudio()
-        if isinstance(self.adev, str):
-            self.pa_dev = get_audio_device(self.pa, self.adev)
-        else: self.pa_dev = self.adev
-        if self.pa_dev == None:
-            raise IOError("No suitable audio device found!")
-        self.pa_thread = threading.Thread(target=self.run_audio, daemon=True)
+        if cm is None: cm = CaptureManager()
+        self.cm = cm
         self.pa_running = True
-        self.pa_thread.start()
+        self.cm.attach(self)
 
     def stop_audio(self):
         self.pa_running = False
-        self.pa_rdy.set() # prevents hanging; we do the same in GPM
-
-    def run_audio(self):
-        adev = self.pa.open(format=PA_FORMAT,
-                            channels=self.pa_chnls,
-                            rate=self.pa_sr,
-                            input=True,
-                            input_device_index=self.pa_dev)
-        while self.pa_running:
-            data = adev.read(self.pa_cs)
-            res = [list() for i in range(self.pa_chnls)]
-            for i in range(0, len(data), 4):
-                res[(i//SAMPLE_SIZE) % self.pa_chnls].append(\
-                    struct.unpack(SAMPLE_FORMAT, data[i:i+SAMPLE_SIZE])[0])
-            self.pa_rdy.wait()
-            self.pa_rdy.clear()
-            self.pa_s = 0
-            self.pa_sl = [0 for i in range(len(res[0]))]
-            if self.ach == -1:
-                for i in range(len(res[0])):
-                    sampled_pwr = (res[0][i]**2 + res[1][i]**2)**0.5
-                    self.pa_sl[i] = pwr_conv(sampled_pwr, cal=self.cal)
-            else:
-                for i in range(len(res[0])):
-                    sampled_pwr = abs(res[self.ach][i])
-                    self.pa_sl[i] = pwr_conv(sampled_pwr, cal=self.cal)
-            self.pa_sl = sorted(filter(lambda q:q > pwr_conv(NO_INPUT,
-                                                             cal=self.cal),
-                                       self.pa_sl))
-            if self.pa_sl:
-                self.pa_s = (sum(map(lambda q:q**2, self.pa_sl))\
-                             /len(self.pa_sl))**0.5
-            self.pa_rdy.set()
-        adev.close()
+        if hasattr(self, "cm"): self.cm.detach(self)
+        for sub in self.subs: sub.put(None) # wake consumers up
+
+    def subscribe(self, maxsize=SUBSCRIBER_QUEUE):
+        """Get a Subscription that receives every Measurement from now on"""
+        sub = Subscription(maxsize)
+        self.subs = self.subs + [sub] # swap, so run_audio can iterate freely
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subs = [q for q in self.subs if q is not sub]
+
+    def feed(self, data, end=None):
+        """Process one hop of raw interleaved samples"""
+        self.feed_frames(self.decode(data, self.pa_chnls), end)
+
+    def feed_frames(self, frames, end=None):
+        """Process one hop of decoded channels, captured up to monotonic time
+end (default: now), and publish the result for the window ending with it"""
+        t0 = perf_counter()
+        self.pa_win.push(self.power(frames, self.ach, self.floor))
+        self.publish(self.cal, end)
+        self.t_dsp.add(perf_counter() - t0)
+        if self.channelizer: self.channelizer.feed_frames(frames, end)
+
+    def feed_partial(self, n, total, data, pv=None, db=None, end=None,
+                     dt=0.):
+        """Take one hop reduced elsewhere (by a DSPWorkerPool process, in dt
+seconds), and publish the result for the window ending with it"""
+        t0 = perf_counter()
+        self.pa_win.push_partial(n, total, data, pv, db)
+        self.publish(self.cal, end)
+        self.t_dsp.add(perf_counter() - t0 + dt)
+
+    def publish(self, cal, end=None):
+        # until the window has filled, it covers less than chunk_size
+        if len(self.pa_win.ring) < self.pa_win.hops: return
+        n, s, pv, rms_db = self.pa_win.result(cal)
+        if end is None: end = monotonic()
+        start = end - len(self.pa_win.ring)*self.pa_hop/self.pa_sr
+        self.pa_seq += 1
+        self.pa_meas = Measurement(self.pa_seq, time() if self.pa_clock is None
+                                   else end + self.pa_clock, cal, s, n,
+                                   self.pa_pctl, pv, start, end, rms_db)
+        for sub in self.subs: sub.put(self.pa_meas, self.lossless)
+
+    def snapshot(self):
+        """The latest Measurement; cheap, never blocks the audio thread"""
+        return self.pa_meas
 
     def get_cal(self):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
-        res = self.cal
-        self.pa_rdy.set()
-        return res
+        return self.cal
 
     def get_sig(self):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
-        res = self.pa_s
-        self.pa_rdy.set()
-        return res
+        return self.pa_meas.rms
 
     def get_samples(self):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
-        res = len(self.pa_sl)
-        self.pa_rdy.set()
-        return res
+        return self.pa_meas.samples
 
     def get_sig_at(self, pct):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
-        if len(self.pa_sl) < 50:
-            self.pa_rdy.set()
-            return None
-        if isinstance(pct, list):
-            res = []
-            for p in pct:
-                if p > 1: p /= 100.
-                res.append(self.pa_sl[int(-p*len(self.pa_sl))])
-        else:
-            if pct > 1: pct /= 100.
-            res = self.pa_sl[int(-pct*len(self.pa_sl))]
-        self.pa_rdy.set()
-        return res
+        """Look up one or a list of percentiles; each must be in pa_pctl"""
+        return self.pa_meas.at(pct)
 
     def cal_up(self):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
-        self.cal += 1
-        res = self.cal
-        self.pa_rdy.set()
-        return res
+        self.cal += 1 # only the GUI thread writes cal
+        return self.cal
 
     def cal_dn(self):
-        self.pa_rdy.wait()
-        self.pa_rdy.clear()
         self.cal -= 1
-        res = self.cal
-        self.pa_rdy.set()
-        return res
+        return self.cal
+
+
+class LogWriter(object):
+    """Writes one shim's log from its own thread, so a slow disk never
+stalls measurement. Rows wait in a bounded queue; when it is full they are
+dropped and counted instead. Rows are formatted and written in batches,
+flushed and fsynced every flush_s seconds, and the file is rotated to a new
+name after rotate_bytes bytes or rotate_s seconds (0 for never). With
+fmt="binary", rows are fixed-size records instead (see siglog.py). With
+block, write() waits (up to a second) for room rather than dropping, which
+replay wants."""
+    def __init__(self, new_fn, name, maxsize=LOG_QUEUE, flush_s=LOG_FLUSH,
+                 rotate_bytes=0, rotate_s=0, pctl=LOG_PERCENTILES, fmt="text",
+                 block=False):
+        self.new_fn = new_fn # called with a part number for rotated files
+        self.name = name
+        self.binary = fmt == "binary"
+        self.ext = ".slog" if self.binary else ".log"
+        self.row = siglog.row_struct(len(pctl))
+        self.q = queue.Queue(maxsize)
+        self.flush_s = flush_s
+        self.rotate_bytes = rotate_bytes
+        self.rotate_s = rotate_s
+        self.pctl = pctl
+        self.pct_fmt = ', '.join(["%4.1f:%%6.1f" % p for p in pctl])
+        self.block = block
+        self.dropped = 0 # rows lost to a full queue
+        self.failed = False # set when the file can't be written any more
+        self.f = None
+        self.rows = 0 # rows written
+        self.t_write = metrics.Timing() # formatting and writing each batch
+        self.t_fsync = metrics.Timing()
+
+    def open(self):
+        """Open the first file (raising IOError if we can't) and start"""
+        self.part = 0
+        self.fn = self.new_fn(ext=self.ext)
+        self.f = open(self.fn, "ab" if self.binary else "a")
+        self.opened = time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, *row):
+        """Queue one row, (m, loc), without waiting; False if it had to be
+dropped"""
+        try: self.q.put(row, self.block, timeout=1.)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """Write out whatever is queued, then close the file"""
+        self.q.put(None)
+        self.thread.join(timeout=max(5., self.flush_s))
+
+    def header(self, row):
+        """What goes at the start of each file, given its first row"""
+        if self.binary:
+            return siglog.header_bytes(self.name, row[0].cal, self.pctl)
+        return ""
+
+    def format_row(self, m, loc):
+        if self.binary:
+            return self.row.pack(m.timestamp, loc[0], loc[1], m.cal, m.rms,
+                                 NAN if m.rms_db is None else m.rms_db,
+                                 m.samples, *m.at(self.pctl))
+        sec = int(m.timestamp)
+        if sec != self.ts_sec: # one strftime per second, not per row
+            self.ts_sec = sec
+            self.ts = strftime("%Y-%m-%d.%H:%M:%S.%z", localtime(sec))
+        return "%s, %9.6f,%10.6f, %7.2f, %d, %s%s\n" % \
+               (self.ts, loc[0], loc[1], m.rms, m.samples,
+                self.pct_fmt % tuple(m.at(self.pctl)),
+                "" if m.rms_db is None else ", rms_db:%7.2f" % m.rms_db)
+
+    def rotate(self):
+        self.f.close()
+        self.part += 1
+        self.fn = self.new_fn(self.part, self.ext)
+        self.f = open(self.fn, "ab" if self.binary else "a")
+        self.opened = time()
+        print("%s: Logging continues in %s" % (self.name, self.fn))
+
+    def run(self):
+        self.ts_sec = None
+        last_flush = time()
+        running = True
+        while running:
+            try: rows = [self.q.get(timeout=self.flush_s)]
+            except queue.Empty: rows = []
+            while True: # take everything else that is already waiting
+                try: rows.append(self.q.get_nowait())
+                except queue.Empty: break
+            if None in rows:
+                running = False
+                rows = rows[:rows.index(None)]
+            try:
+                t0 = perf_counter()
+                if rows:
+                    if not self.f.tell(): self.f.write(self.header(rows[0]))
+                    self.f.write((b'' if self.binary else '').join(\
+                        [self.format_row(*row) for row in rows]))
+                    self.rows += len(rows)
+                    self.t_write.add(perf_counter() - t0)
+                if not running or time() - last_flush >= self.flush_s:
+                    t0 = perf_counter()
+                    self.f.flush()
+                    os.fsync(self.f.fileno())
+                    self.t_fsync.add(perf_counter() - t0)
+                    last_flush = time()
+                if running and \
+                   ((self.rotate_bytes and \
+                     self.f.tell() >= self.rotate_bytes) or \
+                    (self.rotate_s and time()-self.opened >= self.rotate_s)):
+                    self.rotate()
+            except (IOError, OSError):
+                print("%s: Couldn't write to logfile!" % self.name)
+                print(sys.exc_info(), end="\n\n")
+                self.failed = True
+                break
+        try: self.f.close()
+        except: pass
+
+
+class SessionLog(LogWriter):
+    """One log for the whole session, beside the per-receiver ones: a CSV
+row per Measurement of the clock receiver (the first), holding its time,
+one position for everybody, and every receiver's RMS and percentiles. Each
+receiver contributes the Measurement whose end is nearest the tick's, if
+within half a tick: receivers on the clock's input share its hops exactly.
+Rows lag SESSION_LAG ticks behind, so that every receiver has had time to
+report. Written, flushed and rotated like any other log, as text always."""
+    def __init__(self, new_fn, names, gpm, compat=False, **kwargs):
+        kwargs["fmt"] = "text"
+        LogWriter.__init__(self, new_fn, "Session", **kwargs)
+        self.ext = ".csv"
+        self.names = names
+        self.gpm = gpm
+        self.compat = compat # with each receiver's rms_db too
+        self.recent = [collections.deque(maxlen=2*SESSION_LAG + 2) \
+                       for name in names] # latest Measurements of each
+        self.ticks = collections.deque() # clock Measurements not yet logged
+        self.half = 0. # half the clock's hop, in seconds, once it is known
+        self.lock = threading.Lock()
+        self.pct_fmt = ",".join(["%.1f"]*len(self.pctl))
+        self.no_pct = "," * (len(self.pctl) - 1)
+
+    def put(self, i, m):
+        """Any receiver's thread: take receiver i's Measurement m, writing
+the row for any tick that has waited long enough"""
+        with self.lock:
+            self.recent[i].append(m)
+            if i: return
+            self.ticks.append(m)
+            if len(self.ticks) <= SESSION_LAG: return
+            tick = self.ticks.popleft()
+            self.half = (m.end - tick.end)/(2*SESSION_LAG)
+            row = self.nearest(tick)
+        self.log(tick, row)
+
+    def nearest(self, tick):
+        """Each receiver's Measurement nearest tick, within half a tick"""
+        row = [min(r, key=lambda q: abs(q.end - tick.end)) if r else None \
+               for r in self.recent]
+        return [q if q is not None and abs(q.end - tick.end) <= self.half \
+                else None for q in row]
+
+    def log(self, tick, row):
+        loc = self.gpm.position_at(tick.midpoint())
+        if self.gpm.is_fresh(loc) or self.gpm.log_loc_override:
+            self.write(tick, loc, row)
+
+    def close(self):
+        """Write the rows still waiting for late receivers, then close"""
+        with self.lock:
+            rows = [(tick, self.nearest(tick)) for tick in self.ticks]
+            self.ticks.clear()
+        for tick, row in rows: self.log(tick, row)
+        LogWriter.close(self)
+
+    def header(self, row):
+        fields = ["rms", "samples"] + ["p%g" % p for p in self.pctl]
+        if self.compat: fields.append("rms_db")
+        cols = ["unix_time", "time", "lat", "lon", "fix_age"] + \
+               ["%s %s" % (name, f) for name in self.names for f in fields]
+        # quoted as CSV wherever a receiver's name needs it
+        return ",".join(['"%s"' % c.replace('"', '""') \
+                         if ',' in c or '"' in c else c for c in cols]) + "\n"
+
+    def format_row(self, tick, loc, row):
+        sec = int(tick.timestamp)
+        if sec != self.ts_sec: # one strftime per second, not per row
+            self.ts_sec = sec
+            self.ts = strftime("%Y-%m-%d %H:%M:%S", localtime(sec))
+        out = ["%.3f,%s,%.6f,%.6f,%s" % (tick.timestamp, self.ts, loc.lat,
+                                         loc.lon, "" if loc.age is None \
+                                         else "%.2f" % loc.age)]
+        for m in row:
+            if m is None:
+                out.append("," + self.no_pct + (",," if self.compat else ","))
+                continue
+            values = m.at(self.pctl)
+            out.append("%s,%d,%s" % ("" if m.rms is None else "%.2f" % m.rms,
+                                     m.samples, self.pct_fmt % tuple(values) \
+                                     if values else self.no_pct))
+            if self.compat:
+                out.append("" if m.rms_db is None else "%.2f" % m.rms_db)
+        return ",".join(out) + "\n"
+
+
+class Recorder(object):
+    """Writes a recording (see sigrec.py) of every audio hop and NMEA line
+from its own thread. Like LogWriter, it never makes the capture or GPS
+threads wait: records that don't fit in the queue are dropped and
+counted."""
+    def __init__(self, fn, maxsize=RECORD_QUEUE, flush_s=LOG_FLUSH):
+        self.fn = fn
+        self.q = queue.Queue(maxsize)
+        self.flush_s = flush_s
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.dropped = 0 # hops and lines lost to a full queue
+        self.failed = False
+
+    def open(self):
+        """Create the file (raising IOError if we can't) and start"""
+        self.f = open(self.fn, "wb")
+        self.f.write(sigrec.header_bytes(time(), monotonic()))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, rec, block=False):
+        try: self.q.put(rec, block)
+        except queue.Full: self.dropped += 1
+
+    def stream(self, sr, chnls, hop, dev, name):
+        """Number a newly opened input, and record what it is"""
+        with self.lock:
+            sid = self.streams
+            self.streams += 1
+        # never dropped: the audio records after it mean nothing without it
+        self.put(sigrec.record_bytes(sigrec.STREAM, sid, monotonic(),
+                                     sigrec.stream_payload(sr, chnls, hop,
+                                                           dev, name)),
+                 block=True)
+        return sid
+
+    def audio(self, sid, t, data):
+        self.put(sigrec.record_bytes(sigrec.AUDIO, sid, t, data))
+
+    def nmea(self, t, line):
+        self.put(sigrec.record_bytes(sigrec.NMEA, 0, t, line))
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join(timeout=max(5., self.flush_s))
+        if self.dropped:
+            print("Recording: disk was behind, dropped %d record(s)" % \
+                  self.dropped)
+
+    def run(self):
+        last_flush = time()
+        running = True
+        while running:
+            try: recs = [self.q.get(timeout=self.flush_s)]
+            except queue.Empty: recs = []
+            while True:
+                try: recs.append(self.q.get_nowait())
+                except queue.Empty: break
+            if None in recs:
+                running = False
+                recs = recs[:recs.index(None)]
+            try:
+                if recs: self.f.write(b''.join(recs))
+                if not running or time() - last_flush >= self.flush_s:
+                    self.f.flush()
+                    os.fsync(self.f.fileno())
+                    last_flush = time()
+            except (IOError, OSError):
+                print("Couldn't write to recording %s!" % self.fn)
+                print(sys.exc_info(), end="\n\n")
+                self.failed = True
+                break
+        try: self.f.close()
+        except: pass
+
+
+class TkDisplay(object):
+    """Marshals shim updates onto the Tk main thread. Worker threads only
+post their latest Measurement; one after() tick applies whatever is newest
+per shim, skipping labels whose text has not changed."""
+    def __init__(self, w, fps=GUI_FPS):
+        self.w = w
+        self.period = max(1, int(1000/fps))
+        self.pending = {} # shim: (Measurement, loc), newest only
+        self.calls = collections.deque() # other widget work, for Tk's thread
+        self.shown = {} # variable name: text last set
+
+    def start(self):
+        self.w.after(self.period, self.tick)
+
+    def post(self, shim, m, loc):
+        """Any thread: make (m, loc) the next thing shown for shim"""
+        self.pending[shim] = (m, loc)
+
+    def call(self, fn):
+        """Any thread: run fn on the main thread at the next tick"""
+        self.calls.append(fn)
+
+    def set(self, var, text):
+        """Main thread: set a StringVar, unless it already says text"""
+        if self.shown.get(str(var)) != text:
+            var.set(text)
+            self.shown[str(var)] = text
+
+    def tick(self):
+        for shim in list(self.pending):
+            m, loc = self.pending.pop(shim)
+            for var, text in shim.view(m, loc): self.set(var, text)
+        while self.calls: self.calls.popleft()()
+        self.w.after(self.period, self.tick)
 
 
 class RFDataShim(object):
-    def __init__(self, dm_cb, instance, adev, name=None, init_cal=None):
+    def __init__(self, dm_cb, instance, adev, name=None, init_cal=None,
+                 input="pyaudio", input_opts=None, parent=None, band=None,
+                 fft_size=None):
         self.running = True
         self.logging = False
+        self.log_req = False # logging wanted, by the checkbox or a signal
+        self.gui = False
         self.thread = None
         self.dm_cb = dm_cb
         self.instance = instance
@@ -305,6 +1448,12 @@ class RFDataShim(object):
         if not name: self.name = "Instance %d" % (self.instance + 1)
         else: self.name = name
         self.init_cal = init_cal # allow calibration presets in config
+        self.input = input
+        self.input_opts = input_opts
+        self.writer = None # the LogWriter, while logging
+        self.parent = parent # for a channel, the shim whose I/Q it is cut from
+        self.band = band # and its (offset, bandwidth) in Hz
+        self.fft_size = fft_size # for a parent, its channelizer's FFT size
 
     def add_into_window(self):
         i = self.instance*COLUMNS
@@ -317,7 +1466,7 @@ class RFDataShim(object):
         self.sv_pwr87 = tk.StringVar(value="NaN----")
         self.sv_pwr95 = tk.StringVar(value="NaN----")
         self.sv_gps = tk.StringVar(value="NaN,NaN")
-        self.iv_log = tk.IntVar(value=(1 if self.logging else 0))
+        self.iv_log = tk.IntVar(value=(1 if self.log_req else 0))
         self.l_cal = tk.Label(self.dm_cb.w, textvariable=self.sv_cal, width=5)
         self.l_pwr = tk.Label(self.dm_cb.w, textvariable=self.sv_pwr, width=6,
                               font=tf.Font(size=32))
@@ -350,7 +1499,8 @@ class RFDataShim(object):
                                   text="Cal-")
         self.c_log = tk.Checkbutton(self.dm_cb.w,
                                     variable=self.iv_log,
-                                    text="Enable Logging", 
+                                    command=self.toggle_log,
+                                    text="Enable Logging",
                                     onvalue=1, offvalue=0)
         tk.Label(self.dm_cb.w, text=self.name, font=tf.Font(size=16))\
                                .grid(row=0, column=0+i, columnspan=COLUMNS)
@@ -372,134 +1522,235 @@ class RFDataShim(object):
         self.l_pwr95.grid(row=8, column=1+i, columnspan=2)
         self.l_gps.grid(row= 9, column=0+i, columnspan=3)
         self.c_log.grid(row=10, column=0+i, columnspan=3)
+        if self.dm_cb._gui_stats:
+            self.sv_stats = tk.StringVar(value="")
+            tk.Label(self.dm_cb.w, textvariable=self.sv_stats,
+                     font=tf.Font(size=8)).grid(row=11, column=0+i,
+                                                columnspan=3)
+        self.gui = True
+
+    def view(self, m, loc):
+        """(StringVar, text) pairs showing one Measurement and position"""
+        out = [(self.sv_cal, "%5.1f" % m.cal)]
+        if m.rms is not None: out.append((self.sv_pwr, "%7.1f" % m.rms))
+        tmp = m.at(DISPLAY_PERCENTILES)
+        if tmp:
+            out.extend(zip((self.sv_pwr15, self.sv_pwr50, self.sv_pwr70,
+                            self.sv_pwr83, self.sv_pwr87, self.sv_pwr95),
+                           ["%7.1f dBm" % q for q in tmp]))
+        if loc.lat or loc.lon:
+            text = "%9.4f, %9.4f" % (loc.lat, loc.lon)
+            if loc.age is not None and not self.dm_cb.gpm.is_fresh(loc):
+                text += " (%.0f s old)" % loc.age
+            out.append((self.sv_gps, text))
+        return out
+
+    def toggle_log(self):
+        """Checkbutton callback; update_params picks the request up"""
+        self.log_req = bool(self.iv_log.get())
+
+    def refuse_log(self, flash=False):
+        """Logging could not start: drop the request and show it"""
+        self.log_req = False
+        if self.gui:
+            self.dm_cb.display.call(self.c_log.deselect)
+            if flash: self.dm_cb.display.call(self.c_log.flash)
 
     def update_params(self):
-        f = None
+        self.writer = None
+        dropped = 0
+        log_dropped = 0
+        waiting = False # headless, for a fix to start logging with
         while self.running:
-            sleep(self.mpm.pa_cs/self.mpm.pa_sr*1.05)
-            cal = self.mpm.get_cal()
-            sig = self.mpm.get_sig()
-            loc = self.dm_cb.gpm.get_gps()
-            sam = self.mpm.get_samples()
-            tmp = self.mpm.get_sig_at([15, 50, 70, 83, 87, 95])
-            try:
-                self.sv_cal.set("%5.1f" % cal)
-                if sig: self.sv_pwr.set("%7.1f" % sig)
-                if tmp:
-                    self.sv_pwr15.set("%7.1f dBm" % tmp[0])
-                    self.sv_pwr50.set("%7.1f dBm" % tmp[1])
-                    self.sv_pwr70.set("%7.1f dBm" % tmp[2])
-                    self.sv_pwr83.set("%7.1f dBm" % tmp[3])
-                    self.sv_pwr87.set("%7.1f dBm" % tmp[4])
-                    self.sv_pwr95.set("%7.1f dBm" % tmp[5])
-                if loc[0] or loc[1]: self.sv_gps.set("%9.4f, %9.4f" % loc)
-                # check the Logging setting and react appropriately
-                if self.iv_log.get() and not self.logging:
-                    print("%s: Requested logging" % self.name)
-                    if loc[0] or self.dm_cb.gpm.log_loc_override:
-                        try:
-                            fn = self.new_fn()
-                            f = open(fn, "a")
-                            self.logging = True
-                        except IOError:
-                            print("%s: Couldn't open logfile!" % self.name)
-                            print("%s: used %s" % (self.name, fn))
-                            print("Error info:")
-                            print(sys.exc_info(), end="\n\n")
-                            self.c_log.deselect()
-                            self.c_log.flash()
-                        except:
-                            print("%s: Couldn't create logfile name" \
-                                  % self.name)
-                            print("Error info:")
-                            print(sys.exc_info(), end="\n\n")
-                    else:
-                        print("Logging cannot be enabled due to GPS failure.")
-                        self.c_log.deselect()
-                elif self.logging and not self.iv_log.get():
-                    print("%s: Requested to close logging" % self.name)
-                    try: f.close()
-                    except: pass
-                    f = None
-                    self.logging = False
-                if self.logging:
-                    pctl = [0, 5, 10, 15, 25, 40, 50, 60, 65, 70, 75, 80, 83,
-                            85, 87, 90, 93, 95, 98, 99]
-                    tmp = self.mpm.get_sig_at(pctl)
-                    if tmp and (loc[0] or self.dm_cb.gpm.log_loc_override):
-                        tmp = ', '.join(tuple(["%4.1f:%6.1f" % (x, y) \
-                                              for x, y in zip(pctl, tmp)]))
-                        ts = strftime("%Y-%m-%d.%H:%M:%S.%z")
-                        try:
-                            f.write("%s, %9.6f,%10.6f, %7.2f, %d, %s\n" % \
-                                    (strftime("%Y-%m-%d.%H:%M:%S.%z"),
-                                     loc[0], loc[1], sig, sam, tmp))
-                        except IOError:
-                            print("Couldn't write to logfile!")
-                            try: f.close()
-                            except: pass
-                            f = None
-                            self.logging = False # next loop will try to reopen
-                            self.c_log.flash
-            except RuntimeError:
-                sleep(0.05)
-                continue # our main loop has probably been terminated
-        if f:
+            # block until the audio thread hands us exactly the next chunk
+            sub = self.sub
+            m = sub.get(timeout=max(1., 2*self.mpm.pa_hop/self.mpm.pa_sr))
+            if m is None: continue
+            if sub.dropped != dropped:
+                print("%s: Missed %d chunk(s), %d in total" % \
+                      (self.name, sub.dropped - dropped, sub.dropped))
+                dropped = sub.dropped
+            # where we were halfway through the chunk, not where we are now
+            if self.dm_cb.session: self.dm_cb.session.put(self.instance, m)
+            loc = self.dm_cb.gpm.position_at(m.midpoint())
+            located = self.dm_cb.gpm.is_fresh(loc) or \
+                      self.dm_cb.gpm.log_loc_override
+            for pub in self.dm_cb.publishers:
+                pub.publish(self.instance, m, loc)
+            if self.gui: self.dm_cb.display.post(self, m, loc)
+            if self.writer and self.writer.failed: # gave up on the file
+                self.writer = None
+                self.logging = False # next check will try to reopen
+                if self.gui: self.dm_cb.display.call(self.c_log.flash)
+            # check the Logging setting and react appropriately
+            if self.log_req and not self.logging:
+                if not waiting: print("%s: Requested logging" % self.name)
+                if located:
+                    waiting = False
+                    self.writer = LogWriter(self.new_fn, self.name,
+                                            **self.dm_cb._log_opts)
+                    try:
+                        self.writer.open()
+                        self.logging = True
+                        log_dropped = 0
+                    except IOError:
+                        print("%s: Couldn't open logfile!" % self.name)
+                        print("%s: used %s" % (self.name, self.writer.fn))
+                        print("Error info:")
+                        print(sys.exc_info(), end="\n\n")
+                        self.writer = None
+                        self.refuse_log(flash=True)
+                    except:
+                        print("%s: Couldn't create logfile name" % self.name)
+                        print("Error info:")
+                        print(sys.exc_info(), end="\n\n")
+                        self.writer = None
+                elif self.gui:
+                    print("Logging cannot be enabled due to GPS failure.")
+                    self.refuse_log()
+                elif not waiting:
+                    # nobody can ask again, so keep asking on later chunks
+                    print("%s: Logging will start once GPS has a fix." % \
+                          self.name)
+                    waiting = True
+            elif self.logging and not self.log_req:
+                print("%s: Requested to close logging" % self.name)
+                self.writer.close()
+                self.writer = None
+                self.logging = False
+            if self.logging and m.values is not None and located:
+                self.writer.write(m, loc)
+                if self.writer.dropped != log_dropped:
+                    print("%s: Disk is behind, dropped %d log row(s)" % \
+                          (self.name, self.writer.dropped - log_dropped))
+                    log_dropped = self.writer.dropped
+        if self.writer:
             print("%s: Closing file due to program exit." % self.name)
-            f.close()
-        try: self.mpm.pa.terminate()
-        except: pass
+            self.writer.close()
 
     def cal_up(self):
         self.cal = self.mpm.cal_up()
-        self.sv_cal.set("%5.1f" % self.mpm.get_cal())
+        self.dm_cb.display.set(self.sv_cal, "%5.1f" % self.mpm.get_cal())
 
     def cal_dn(self):
         self.cal = self.mpm.cal_dn()
-        self.sv_cal.set("%5.1f" % self.mpm.get_cal())
+        self.dm_cb.display.set(self.sv_cal, "%5.1f" % self.mpm.get_cal())
 
-    def new_fn(self):
-        """Compute a new filename for logging"""
+    def new_fn(self, part=0, ext=".log"):
+        """Compute a new filename for logging; part numbers rotated files"""
         if not hasattr(self, "last_fn"): self.last_fn = ""
         return "siglog_" + chr(65+max(0, min(26, self.instance))) + "_" + \
-               strftime("%Y-%m-%d_%H.%M.%S") + ".log"
+               strftime("%Y-%m-%d_%H.%M.%S") + \
+               ("_%d" % part if part else "") + ext
 
     def start_audio(self):
         """Load a new MultiParametersManager and try to stop the old one"""
         if hasattr(self, "mpm"):
             try:
                 if isinstance(self.mpm, MultiParametersManager):
+                    if self.parent:
+                        self.parent.mpm.channelizer.remove(self.mpm)
                     self.mpm.stop_audio()
+                    self.mpm.unsubscribe(self.sub)
             except:
                 print("Failing to stop existing audio on shim instance %d" % \
                       self.instance)
             del self.mpm
-        self.mpm = MultiParametersManager(adev=self.adev, ach=self.channel)
+        if self.parent:
+            self.start_channel()
+            return
+        self.mpm = MultiParametersManager(adev=self.adev, ach=self.channel,
+                                          dsp=self.dm_cb._dsp,
+                                          pct_mode=self.dm_cb._pct_mode,
+                                          pct_res=self.dm_cb._pct_res,
+                                          sr=self.dm_cb._sr,
+                                          cs=self.dm_cb._cs,
+                                          hop=self.dm_cb._hop,
+                                          input=self.input,
+                                          input_opts=self.input_opts,
+                                          compat=self.dm_cb._rms_db)
+        self.sub = self.mpm.subscribe()
         if self.init_cal != None: self.mpm.cal = self.init_cal
         elif self.channel != -1: self.mpm.cal -= 26 # minimum gain of Aux VFO
-        self.mpm.start_audio()
+        if self.fft_size:
+            self.mpm.channelizer = channelizer.Channelizer(self.mpm,
+                                                           self.fft_size)
+        self.mpm.start_audio(self.dm_cb.cm)
+
+    def start_channel(self):
+        """Take our measurements from a band of the parent's I/Q, through its
+channelizer, instead of from an input of our own. The parent must have
+started first."""
+        src = self.parent.mpm
+        # NO_INPUT spread over the whole band; only part of it is ours
+        bins = channelizer.channel_bins(self.band[0], self.band[1],
+                                        src.pa_sr, src.channelizer.n).sum()
+        self.mpm = MultiParametersManager(ach=0, dsp="numpy",
+                                          pct_mode=self.dm_cb._pct_mode,
+                                          pct_res=self.dm_cb._pct_res,
+                                          sr=src.pa_sr, cs=self.dm_cb._cs,
+                                          hop=src.pa_hop,
+                                          floor=NO_INPUT*math.sqrt(\
+                                              bins/src.channelizer.n),
+                                          compat=self.dm_cb._rms_db)
+        self.mpm.pa_chnls = 1 # one channel amplitude per FFT frame
+        self.mpm.pa_clock = src.pa_clock
+        self.mpm.lossless = src.lossless
+        self.sub = self.mpm.subscribe()
+        if self.init_cal != None: self.mpm.cal = self.init_cal
+        src.channelizer.add(self.band[0], self.band[1], self.mpm)
 
     def stop(self):
         """Cleanly exit the main loop."""
         self.running = False
+        if self.parent: self.parent.mpm.channelizer.remove(self.mpm)
         self.mpm.stop_audio()
 
 
 class MultiDisplayManager(object):
-    def __init__(self, cfg="smeter-multi.ini"):
-        print("Starting Signal Logger v%d.%02x" % (VERSION >> 8, VERSION % 256))
+    def __init__(self, cfg="smeter-multi.ini", headless=None, record=None,
+                 replay=None):
+        print("Starting Signal Logger v%d.%02x" % \
+              (VERSION >> 8, VERSION % 256))
+        t0 = perf_counter()
         self.running = True
         self.logging = False
         self.read_config(cfg)
-        self.make_window()
+        if headless == None: headless = self._headless
+        self.headless = headless
+        if not headless: self.make_window()
         self.gpm = GlobalParametersManager(self._comport[0],
-                                           serial_url=self._comport[1])
+                                           serial_url=self._comport[1],
+                                           stale=self._gps_stale)
         self.gpm.log_loc_override = self._llo
-        self.gpm.start_gps()
+        self.loop = gps.EventLoop() # GPS sources and publishers share it
+        self.loop.start()
+        self.recorder = None
+        if replay:
+            # everything comes from the recording, as fast as we can go
+            self._log_opts["block"] = True
+            self.cm = ReplayManager(replay, self.gpm, workers=self._workers,
+                                    on_end=self.replay_done)
+        else:
+            if record:
+                self.recorder = Recorder(record)
+                self.recorder.open()
+                self.gpm.recorder = self.recorder
+                print("Recording to %s" % record)
+            self.gpm.start_gps(self.loop)
+            self.cm = CaptureManager(workers=self._workers, # shared by shims
+                                     recorder=self.recorder)
         self.instances = len(self.shims)
+        self.session = None
+        if self._session_log: self.start_session()
+        self.start_publishers()
         # please do not assume I made the rest of this method before 2AM
         # initialize each RFDataShim
-        [shim.add_into_window() for shim in self.shims]
+        if not headless: [shim.add_into_window() for shim in self.shims]
+        if not headless and self._gui_stats:
+            self.sv_stats = tk.StringVar(value="")
+            tk.Label(self.w, textvariable=self.sv_stats, font=tf.Font(size=8))\
+                .grid(row=12, column=0, columnspan=COLUMNS*self.instances)
         # start main-loop threads inside shims
         for i in range(self.instances):
             self.shims[i].start_audio()
@@ -507,7 +1758,14 @@ class MultiDisplayManager(object):
                 target=self.shims[i].update_params,
                 daemon=True)
             self.shims[i].thread.start()
-        self.w.mainloop()
+        self.startup = perf_counter() - t0
+        print("Started in %.2f s" % self.startup)
+        self.start_stats()
+        if replay: self.cm.start()
+        if headless: self.run_headless()
+        else:
+            self.display.start()
+            self.w.mainloop()
         self.stop()
         print("Exiting Signal Logger v%d.%02x" % (VERSION >> 8, VERSION % 256))
 
@@ -518,8 +1776,42 @@ class MultiDisplayManager(object):
         if not cp.read(cfg_fn):
             print("Failed to load config!")
         self._llo = cp.getboolean("Global", "log_without_gps", fallback=False)
+        self._headless = cp.getboolean("Global", "headless", fallback=False)
+        self._fps = cp.getfloat("Global", "gui_fps", fallback=GUI_FPS)
+        self._log_opts = {"flush_s":cp.getfloat("Global", "log_flush",
+                                                fallback=LOG_FLUSH),
+                          "rotate_bytes":int(cp.getfloat("Global",
+                                                         "log_rotate_mb",
+                                                         fallback=0)*2**20),
+                          "rotate_s":cp.getfloat("Global", "log_rotate_min",
+                                                 fallback=0)*60,
+                          "fmt":cp.get("Global", "log_format",
+                                       fallback="text")}
+        log_enable = cp.getboolean("Global", "log_enable", fallback=False)
+        self._sr = cp.getint("Global", "sample_rate", fallback=32000)
+        self._cs = cp.getint("Global", "chunk_size", fallback=32768)
+        self._hop = cp.getint("Global", "hop_size", fallback=self._cs)
+        self._dsp = cp.get("Global", "dsp_backend", fallback=DSP_BACKEND)
+        self._workers = cp.getint("Global", "dsp_workers", fallback=0)
+        self._pct_mode = cp.get("Global", "pct_mode", fallback=PCT_MODE)
+        self._pct_res = cp.getfloat("Global", "pct_resolution",
+                                    fallback=PCT_RESOLUTION)
+        if cp.has_option("Global", "pct_mode") and \
+           self._pct_mode == "select" and self._hop < self._cs:
+            print("pct_mode=select needs hop_size equal to chunk_size; "
+                  "using %g dB histogram bins instead" % self._pct_res)
+        self._rms_db = cp.getboolean("Global", "rms_db", fallback=False)
+        self._session_log = cp.getboolean("Global", "session_log",
+                                          fallback=False)
+        self._publish = [u.strip() for u in cp.get("Global", "publish",
+                                                   fallback="").split(",")
+                         if u.strip()]
+        self._stats_interval = cp.getfloat("Global", "stats_interval",
+                                           fallback=STATS_INTERVAL)
+        self._gui_stats = cp.getboolean("Global", "gui_stats", fallback=False)
+        self._stats_http = cp.get("Global", "stats_http", fallback="")
         # Set up comport parameters
-        comport = cp.get("Global", "gps_port", fallback="COM1")
+        comport = cp.get("Global", "gps_port", fallback="")
         combaud = cp.getint("Global", "gps_baud", fallback=9600)
         combits = cp.getint("Global", "gps_bits", fallback=8)
         compari = cp.get("Global", "gps_parity", fallback="N")
@@ -527,25 +1819,13 @@ class MultiDisplayManager(object):
         comflow = cp.get("Global", "gps_flowcontrol", fallback="None")
         comnete = cp.getboolean("Global", "gps_tcp", fallback=False)
         comurl  = cp.get("Global", "gps_url", fallback="")
-        # comport word size
-        if combits == 8: combits = serial.EIGHTBITS
-        elif combits == 7: combits = serial.SEVENBITS
-        elif combits == 5: combits = serial.FIVEBITS # can we parse this?
-        elif combits == 6: combits = serial.SIXBITS #  can we parse this?
-        else: combits = serial.EIGHTBITS
-        # comport parity
-        if compari == "N": compari = serial.PARITY_NONE
-        elif compari == "E": compari = serial.PARITY_EVEN
-        elif compari == "O": compari = serial.PARITY_ODD
-        elif compari == "M": compari = serial.PARITY_MARK
-        elif compari == "S": compari = serial.PARITY_SPACE
-        else: compari = serial.PARITY_NONE
-        # what is serial.PARITY_NAMES ?
-        # comport stopbits
-        if comstop == "1": comstop = serial.STOPBITS_ONE
-        elif comstop == "1.5": comstop = serial.STOPBITS_ONE_POINT_FIVE
-        elif comstop == "2": comstop = serial.STOPBITS_TWO
-        else: comstop = serial.STOPBITS_ONE
+        self._gps_stale = cp.getfloat("Global", "gps_stale",
+                                      fallback=GPS_STALE)
+        # pyserial's constants are just these values, so it need not be
+        # imported until the port is opened
+        if combits not in (5, 6, 7, 8): combits = 8 # word size
+        if compari not in ("N", "E", "O", "M", "S"): compari = "N" # parity
+        comstop = {"1.5":1.5, "2":2}.get(comstop, 1) # stop bits
         comflow = map(lambda q:q.strip().casefold(), comflow.split(','))
         self._comport = ({"port":comport,
                           "baudrate":combaud,
@@ -566,8 +1846,37 @@ class MultiDisplayManager(object):
         if not (len(sections) == 1 and sections[0].startswith("__")):
             sections.pop(0)
         self.shims = []
+        channels = [] # (parent, band, name), made after every receiver
         for section in sections:
             try:
+                kind = cp.get(section, "input", fallback="pyaudio").casefold()
+                if kind not in inputs.KINDS:
+                    raise ValueError("input must be one of %s" % \
+                                     ', '.join(inputs.KINDS))
+                opts = {}
+                if kind != "pyaudio":
+                    opts["fmt"] = cp.get(section, "iq_format",
+                                         fallback="uint8")
+                if kind == "rtl_tcp":
+                    opts["frequency"] = cp.getfloat(section, "frequency",
+                                                    fallback=None)
+                    opts["gain"] = cp.getfloat(section, "rtl_gain",
+                                               fallback=None)
+                # narrowband channels cut from this receiver's I/Q
+                bands = [c.split(":") for c in cp.get(section, "channels",
+                                                      fallback="").split(",")
+                         if c.strip()]
+                bands = [(float(o), float(bw)) for o, bw in bands]
+                names = [q.strip() for q in cp.get(section, "channel_names",
+                                                   fallback="").split(",")]
+                names = [names[i] if i < len(names) and names[i] else \
+                         "%s %+g kHz" % (section, o/1000.) \
+                         for i, (o, bw) in enumerate(bands)]
+                if bands and cp.getint(section, "channel", fallback=0):
+                    raise ValueError("channels need I/Q (channel=0)")
+                if bands and np is None:
+                    print("%s: channels need NumPy; ignoring them" % section)
+                    bands = []
                 self.shims.append(RFDataShim\
                                   (self,
                                    len(self.shims),
@@ -577,19 +1886,231 @@ class MultiDisplayManager(object):
                                               fallback=0)-1),
                                    name=section,
                                    init_cal=cp.getfloat(section, "cal",
-                                                        fallback=None)))
+                                                        fallback=None),
+                                   input=kind,
+                                   input_opts=opts,
+                                   fft_size=cp.getint(section, "fft_size",
+                                                      fallback=channelizer.\
+                                                      CHANNELIZER_FFT) \
+                                            if bands else None))
             except:
                 print("Failed to load config for %s" % section)
                 print(sys.exc_info())
-        
+                continue
+            parent = self.shims[-1]
+            parent.log_req = cp.getboolean(section, "log_enable",
+                                           fallback=log_enable)
+            channels += [(parent, band, name) \
+                         for band, name in zip(bands, names)]
+        # channels come last, so that adding one leaves every receiver's
+        # index, and so its log letter, where it was
+        for parent, band, name in channels:
+            self.shims.append(RFDataShim(self, len(self.shims), parent.adev,
+                                         name=name, init_cal=parent.init_cal,
+                                         parent=parent, band=band))
+            self.shims[-1].log_req = parent.log_req
+
+    def run_headless(self):
+        """Stand in for mainloop without a window: logging follows config,
+SIGUSR1 turns it on for every receiver, SIGUSR2 turns it off, and SIGTERM
+or Ctrl+C exits"""
+        def set_logging(on):
+            print("Logging %s by signal" % ("enabled" if on else "disabled"))
+            for shim in self.shims: shim.log_req = on
+        def quit(*args): self.running = False
+        if hasattr(signal, "SIGUSR1"): # not on Windows
+            signal.signal(signal.SIGUSR1, lambda *args:set_logging(True))
+            signal.signal(signal.SIGUSR2, lambda *args:set_logging(False))
+        signal.signal(signal.SIGTERM, quit)
+        print("Running headless.")
+        try:
+            while self.running: sleep(0.5)
+        except KeyboardInterrupt: pass
+
+    def session_fn(self, part=0, ext=".csv"):
+        return "siglog_session_" + strftime("%Y-%m-%d_%H.%M.%S") + \
+               ("_%d" % part if part else "") + ext
+
+    def start_session(self):
+        """Open the session log, with a column group for every receiver"""
+        self.session = SessionLog(self.session_fn,
+                                  [shim.name for shim in self.shims],
+                                  self.gpm, compat=self._rms_db,
+                                  **self._log_opts)
+        try:
+            self.session.open()
+            print("Session log: %s" % self.session.fn)
+        except IOError as e:
+            print("Couldn't open the session log: %s" % e)
+            self.session = None
+
+    def start_publishers(self):
+        """Start publishing live Measurements at every URL configured"""
+        self.publishers = []
+        for url in self._publish:
+            try:
+                pub = publish.Publisher(url,
+                                        [shim.name for shim in self.shims],
+                                        LOG_PERCENTILES, self.loop)
+                pub.start()
+            except (OSError, ValueError) as e:
+                print("Publish: couldn't publish at %s: %s" % (url, e))
+                continue
+            self.publishers.append(pub)
+            print("Publishing live measurements at %s" % url)
+
+    def start_stats(self):
+        """Start collecting runtime statistics, if anything is to show them:
+the stats line, the GUI status rows or the HTTP endpoint"""
+        self.reporter = metrics.Reporter(self.collect_stats)
+        self.stats_server = None
+        if self._stats_http:
+            try:
+                self.stats_server = metrics.serve(self._stats_http,
+                                                  self.reporter)
+                print("Stats: serving /metrics and /stats.json on %s:%d" % \
+                      self.stats_server.server_address[:2])
+            except (OSError, ValueError) as e:
+                print("Stats: couldn't serve on %s: %s" % \
+                      (self._stats_http, e))
+        if self._stats_interval:
+            self.stats_due = monotonic() + self._stats_interval
+            self.reporter.listeners.append(self.print_stats)
+        if self._gui_stats and not self.headless:
+            self.reporter.listeners.append(self.show_stats)
+        if self.reporter.listeners or self.stats_server:
+            self.reporter.start()
+
+    def collect_stats(self):
+        """Counters and timings from every thread, for metrics.Reporter"""
+        snap = {"inputs":{}, "receivers":{}, "startup_seconds":self.startup}
+        for cap in list(self.cm.captures.values()):
+            i = cap.t_proc.fields("hop")
+            i["hop_seconds"] = cap.hop/cap.sr
+            i["overflows_total"] = cap.overflows
+            snap["inputs"][cap.name] = i
+        for shim in self.shims:
+            if not hasattr(shim, "mpm"): continue
+            r = shim.mpm.t_dsp.fields("dsp")
+            r["missed_total"] = shim.sub.dropped
+            if shim.mpm.channelizer:
+                r.update(shim.mpm.channelizer.t_fft.fields("fft"))
+            r["queue"] = shim.sub.q.qsize()
+            writer = shim.writer
+            r["logging"] = int(writer is not None)
+            if writer:
+                r.update(writer.t_write.fields("log_write"))
+                r.update(writer.t_fsync.fields("log_fsync"))
+                r["log_rows_total"] = writer.rows
+                r["log_dropped_total"] = writer.dropped
+                r["log_queue"] = writer.q.qsize()
+            snap["receivers"][shim.name] = r
+        parsers = self.gpm.parsers()
+        age = self.gpm.fix_age()
+        snap["gps"] = {"sentences_total":sum(p.sentences for p in parsers),
+                       "ignored_total":sum(p.ignored for p in parsers),
+                       "bad_checksum_total":sum(p.bad_checksum \
+                                                for p in parsers),
+                       "positions_total":sum(p.positions for p in parsers),
+                       "resets_total":self.gpm.resets(),
+                       "quality":self.gpm.gps_fix.quality,
+                       "fix_age_seconds":age,
+                       "stale":int(age is None or age > self.gpm.stale)}
+        snap["gps_sources"] = {src.name:{"connected":int(src.connected),
+                                         "lines_total":src.lines,
+                                         "reconnects_total":src.reconnects} \
+                               for src in self.gpm.sources}
+        pool = self.cm.pool
+        if pool:
+            snap["dsp_pool"] = {"dropped_total":pool.dropped,
+                                "busy_slots":pool.nslots - len(pool.free),
+                                "slots":pool.nslots}
+        if self.session:
+            w = self.session
+            snap["session_log"] = dict(w.t_write.fields("write"),
+                                       rows_total=w.rows,
+                                       dropped_total=w.dropped,
+                                       queue=w.q.qsize())
+        if self.publishers:
+            snap["publishers"] = {p.url:{"frames_total":p.frames,
+                                         "dropped_total":p.dropped,
+                                         "subscribers":len(p.subscribers),
+                                         "kicked_total":p.kicked} \
+                                  for p in self.publishers}
+        if self.recorder:
+            snap["recorder"] = {"dropped_total":self.recorder.dropped,
+                                "queue":self.recorder.q.qsize()}
+        return snap
+
+    def input_stats(self, i):
+        return "load %.0f%%, worst hop %.0f of %.0f ms, %d overflow(s)" % \
+               (100*i["hop_seconds_rate"], 1000*i["hop_seconds_max"],
+                1000*i["hop_seconds"], i["overflows_total"])
+
+    def receiver_stats(self, r):
+        text = "DSP %.1f ms, missed %d" % \
+               (1000*r["dsp_seconds_rate"]/r["dsp_rate"] if r["dsp_rate"] \
+                else 0., r["missed_total"])
+        if r["logging"]:
+            text += ", log worst write %.1f ms, fsync %.0f ms, dropped %d" % \
+                    (1000*r["log_write_seconds_max"],
+                     1000*r["log_fsync_seconds_max"], r["log_dropped_total"])
+        return text
+
+    def gps_stats(self, g):
+        return "%.1f sentences/s, %d bad, fix %s" % \
+               (g["sentences_rate"], g["bad_checksum_total"],
+                "%.1f s old" % g["fix_age_seconds"] \
+                if g["fix_age_seconds"] is not None else "none")
+
+    def print_stats(self, snap):
+        """Reporter listener: the stats line, every stats_interval seconds"""
+        if monotonic() < self.stats_due: return
+        self.stats_due += self._stats_interval
+        parts = ["%s: %s" % (k, self.input_stats(i)) \
+                 for k, i in sorted(snap["inputs"].items())]
+        parts += ["%s: %s" % (k, self.receiver_stats(r)) \
+                  for k, r in sorted(snap["receivers"].items())]
+        parts.append("GPS: " + self.gps_stats(snap["gps"]))
+        if "dsp_pool" in snap:
+            parts.append("DSP pool: dropped %d" % \
+                         snap["dsp_pool"]["dropped_total"])
+        print("Stats: " + "; ".join(parts))
+
+    def show_stats(self, snap):
+        """Reporter listener: the GUI status rows"""
+        for shim in self.shims:
+            r = snap["receivers"].get(shim.name)
+            if r is not None and shim.gui:
+                text = self.receiver_stats(r)
+                self.display.call(lambda v=shim.sv_stats, t=text:\
+                                  self.display.set(v, t))
+        text = "; ".join(["%s: %s" % (k, self.input_stats(i)) \
+                          for k, i in sorted(snap["inputs"].items())] + \
+                         ["GPS: " + self.gps_stats(snap["gps"])])
+        self.display.call(lambda: self.display.set(self.sv_stats, text))
+
+    def replay_done(self):
+        """The recording has been fed through; exit once the shims have
+taken every Measurement (headless), or leave the window up to look at"""
+        for i in range(100):
+            if not any(shim.sub.q.qsize() for shim in self.shims): break
+            sleep(0.1)
+        if self.headless: self.running = False
 
     def make_window(self):
+        load_tk()
         self.w = tk.Tk()
+        self.display = TkDisplay(self.w, fps=self._fps)
         self.w.title("Signal Logger v%d.%02x" % \
                      (VERSION >> 8, VERSION % 256))
 
     def stop(self):
         self.gpm.stop_gps()
+        self.reporter.stop()
+        if self.stats_server:
+            self.stats_server.shutdown()
+            self.stats_server.server_close()
         for i in range(self.instances):
             self.shims[i].stop()
         self.running = False
@@ -601,12 +2122,33 @@ class MultiDisplayManager(object):
                       threading.active_count())
             sleep(0.5)
             timeout_counter += 1
+        if self.session:
+            print("Session: Closing file due to program exit.")
+            self.session.close()
+        for pub in self.publishers: pub.stop()
+        self.loop.stop()
+        self.cm.close()
+        close_audio_context()
+        if self.recorder: self.recorder.close()
         try: self.w.destroy()
         except: pass
 
 
 def main():
     global d
-    d = MultiDisplayManager()
+    cfg = "smeter-multi.ini"
+    headless = None # let the config decide
+    record = None
+    replay = None
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg == "--headless": headless = True
+        elif arg == "--gui": headless = False
+        elif arg == "--record": record = next(args, None)
+        elif arg == "--replay": replay = next(args, None)
+        else: cfg = arg
+    d = MultiDisplayManager(cfg, headless=headless, record=record,
+                            replay=replay)
+    if replay and d.cm.unfed: sys.exit(1) # a replay that logged nothing
 
 if __name__ == "__main__": main()
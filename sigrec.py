@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Read and write Signal Logger recordings.
+
+A recording (signal_logger.py --record FILE) holds the raw input of a
+session: every audio hop exactly as it was read, and every NMEA line from
+the GPS, each stamped with the time.monotonic() time it arrived. Replaying
+one (--replay FILE) runs the whole measurement and logging path again from
+it, as fast as the CPU allows, with different settings if you like."""
+
+import struct
+
+
+# Layout, all little-endian:
+#   header:  magic, version, wall clock (epoch s) and time.monotonic() at
+#            the same instant, so monotonic stamps map back to real times
+#   records: kind, stream, monotonic time, payload length, then payload
+#     STREAM: sample rate, channels, frames per hop, device index, then
+#             the UTF-8 device name; stream numbers the AUDIO records that
+#             follow
+#     AUDIO:  one hop of interleaved float32 samples, as read
+#     NMEA:   one line from the GPS, as read (stream is unused)
+MAGIC = b"SREC"
+FORMAT_VERSION = 1
+HEADER_FORMAT = "<4sHdd"
+RECORD_FORMAT = "<BHdI"
+STREAM_FORMAT = "<IHIi"
+STREAM, AUDIO, NMEA = range(3)
+
+header_struct = struct.Struct(HEADER_FORMAT)
+record_struct = struct.Struct(RECORD_FORMAT)
+stream_struct = struct.Struct(STREAM_FORMAT)
+
+
+def header_bytes(wall, mono):
+    return header_struct.pack(MAGIC, FORMAT_VERSION, wall, mono)
+
+def record_bytes(kind, stream, t, payload):
+    return record_struct.pack(kind, stream, t, len(payload)) + payload
+
+def stream_payload(sr, chnls, hop, dev, name):
+    return stream_struct.pack(sr, chnls, hop, dev) + name.encode("utf-8")
+
+def parse_stream(payload):
+    """(sample rate, channels, hop, device index, device name) of a STREAM"""
+    return stream_struct.unpack_from(payload) + \
+           (payload[stream_struct.size:].decode("utf-8", "replace"),)
+
+
+class Recording(object):
+    """A recording file: its header fields, plus its records"""
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, "rb") as f: head = f.read(header_struct.size)
+        if len(head) < header_struct.size:
+            raise ValueError("%s is too short for a Signal Logger "
+                             "recording" % fn)
+        magic, self.version, self.wall0, self.mono0 = \
+               header_struct.unpack(head)
+        if magic != MAGIC:
+            raise ValueError("%s is not a Signal Logger recording" % fn)
+        if self.version > FORMAT_VERSION:
+            raise ValueError("%s is format version %d, too new for us" % \
+                             (fn, self.version))
+
+    def wall_time(self, t):
+        """Epoch seconds of monotonic time t"""
+        return self.wall0 + (t - self.mono0)
+
+    def __iter__(self):
+        """(kind, stream, monotonic time, payload) in recorded order. A
+record cut short at the end (the recorder was killed) is left out."""
+        with open(self.fn, "rb", buffering=2**20) as f:
+            f.seek(header_struct.size)
+            while True:
+                head = f.read(record_struct.size)
+                if len(head) < record_struct.size: break
+                kind, stream, t, n = record_struct.unpack(head)
+                payload = f.read(n)
+                if len(payload) < n: break
+                yield kind, stream, t, payload
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Describe Signal Logger \
+recordings")
+    ap.add_argument("recordings", nargs="+")
+    args = ap.parse_args()
+    for fn in args.recordings:
+        rec = Recording(fn)
+        streams = {}
+        hops = {}
+        nmea = 0
+        first = last = None
+        for kind, stream, t, payload in rec:
+            if first is None: first = t
+            last = t
+            if kind == STREAM: streams[stream] = parse_stream(payload)
+            elif kind == AUDIO: hops[stream] = hops.get(stream, 0) + 1
+            elif kind == NMEA: nmea += 1
+        print("%s: %.1f s, %d NMEA lines" % \
+              (fn, (last - first) if first is not None else 0., nmea))
+        for s, (sr, chnls, hop, dev, name) in sorted(streams.items()):
+            print("  stream %d: '%s' (device %d), %d Hz, %d channels, %d "
+                  "hops of %d frames" % (s, name, dev, sr, chnls,
+                                         hops.get(s, 0), hop))
+
+if __name__ == "__main__": main()
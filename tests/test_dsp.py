@@ -0,0 +1,98 @@
+"""The NumPy DSP backend against the pure-Python reference"""
+
+import random
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import signal_logger as sl
+
+
+def iq_bytes(frames, seed, chnls=2):
+    """Raw interleaved float32 samples, their levels spread over 100 dB and
+some of them under NO_INPUT"""
+    rnd = random.Random(seed)
+    out = [rnd.choice((-1, 1))*10**rnd.uniform(-7, -2) \
+           for i in range(frames*chnls)]
+    out[::17] = [0.]*len(out[::17])
+    return struct.pack("<%df" % len(out), *out)
+
+def both(data, ach=-1, chnls=2):
+    """Powers of data from each backend: (NumPy, Python)"""
+    return (sl.power_numpy(sl.decode_numpy(data, chnls), ach),
+            sl.power_python(sl.decode_python(data, chnls), ach))
+
+
+def test_decode():
+    data = iq_bytes(1000, 1) + b"\0"*4 # and half a frame at the end
+    a, b = sl.decode_numpy(data, 2), sl.decode_python(data, 2)
+    assert a.shape == (1000, 2)
+    assert a[:, 0].tolist() == b[0] and a[:, 1].tolist() == b[1]
+
+@pytest.mark.parametrize("ach", [-1, 0, 1])
+def test_power(ach):
+    a, b = both(iq_bytes(4000, 2), ach)
+    assert a.tolist() == b
+    assert 0 < len(b) < 4000
+
+@pytest.mark.parametrize("n", [1, 2, 49, 50, 4000])
+def test_select_percentiles(n):
+    a, b = both(iq_bytes(4000, 3))
+    a, b = a[:n], b[:n]
+    pctl = sl.LOG_PERCENTILES
+    assert sl.select_percentiles(a, pctl) == sl.select_percentiles(b, pctl)
+
+@pytest.mark.parametrize("res", [0.1, 0.25, 1.])
+def test_db_histogram(res):
+    floor = sl.NO_INPUT**2
+    a, b = both(iq_bytes(8000, 4))
+    edges = sl.hist_edges(floor, res)
+    # samples exactly on a bin edge, and either side of one, too
+    extra = [edges[0], edges[7], np.nextafter(edges[7], 0),
+             np.nextafter(edges[7], np.inf), edges[-1], 1e9]
+    a = np.concatenate([a, extra])
+    b = b + [float(q) for q in extra]
+    ha, hb = sl.db_histogram(a, floor, res), sl.db_histogram(b, floor, res)
+    assert len(ha) == len(edges) + 1 and ha.sum() == len(b)
+    assert {i:int(c) for i, c in enumerate(ha) if c} == hb
+    assert sl.histogram_lookup(ha, len(b), sl.LOG_PERCENTILES, -120., res) \
+           == sl.histogram_lookup(hb, len(b), sl.LOG_PERCENTILES, -120., res)
+
+@pytest.mark.parametrize("mode", sl.PCT_MODES)
+@pytest.mark.parametrize("pctl", [None, sl.LOG_PERCENTILES])
+def test_hop_partial(mode, pctl):
+    floor = sl.NO_INPUT**2
+    a, b = both(iq_bytes(4000, 5))
+    na, ta, da, pa, dba = sl.hop_partial(a, mode, floor, pctl=pctl,
+                                         compat=True)
+    nb, tb, db, pb, dbb = sl.hop_partial(b, mode, floor, pctl=pctl,
+                                         compat=True)
+    assert (na, pa) == (nb, pb)
+    assert ta == pytest.approx(tb, rel=1e-12)
+    assert dba == pytest.approx(dbb, rel=1e-12)
+    if mode == "histogram":
+        assert {i:int(c) for i, c in enumerate(da) if c} == db
+    elif pctl is None: assert da.tolist() == db
+
+@pytest.mark.parametrize("cs,hop,mode", [(4096, 4096, "select"),
+                                         (4096, 4096, "histogram"),
+                                         (4096, 1024, "select")])
+def test_measurements(cs, hop, mode):
+    """Whole receivers, one per backend, fed the same audio"""
+    mpms = [sl.MultiParametersManager(dsp=dsp, pct_mode=mode, cs=cs,
+                                      hop=hop, compat=True) \
+            for dsp in ("numpy", "python")]
+    subs = [m.subscribe(maxsize=100) for m in mpms]
+    for i in range(12):
+        data = iq_bytes(hop, 100 + i)
+        for m in mpms: m.feed(data, end=float(i))
+    a, b = [[q.get(0) for i in range(12 - cs//hop + 1)] for q in subs]
+    assert subs[0].get(0) is None and subs[1].get(0) is None
+    assert all(x.values for x in a)
+    for x, y in zip(a, b):
+        assert (x.seq, x.samples, x.values, x.start, x.end) == \
+               (y.seq, y.samples, y.values, y.start, y.end)
+        assert x.rms == pytest.approx(y.rms, abs=1e-9)
+        assert x.rms_db == pytest.approx(y.rms_db, abs=1e-9)
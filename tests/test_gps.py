@@ -0,0 +1,155 @@
+"""GPS sources against local servers, and the NMEA they read"""
+
+import asyncio
+import re
+import socket
+
+import pytest
+
+import gps
+import nmea
+
+
+def sentence(body):
+    """A whole NMEA line for body, the part between '$' and '*'"""
+    return b"$%s*%02X\r\n" % (body, nmea.checksum(body))
+
+GGA = sentence(b"GNGGA,123519.00,4807.0380,N,01131.0000,W,1,08,0.9,545.4,"
+               b"M,46.9,M,,")
+RMC = sentence(b"GPRMC,123520.00,A,4807.0400,N,01131.0000,W,10.0,84.4,"
+               b"230324,003.1,W")
+VTG = sentence(b"GPVTG,54.7,T,34.4,M,5.5,N,10.2,K,A")
+
+
+def free_port():
+    """A local TCP port with nothing listening on it"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(gps, "GPS_BACKOFF_MIN", 0.01)
+    monkeypatch.setattr(gps, "GPS_BACKOFF_MAX", 0.04)
+    monkeypatch.setattr(gps, "GPS_READ_TIMEOUT", 0.5)
+
+
+def test_nmea_sentences():
+    p = nmea.NMEAParser()
+    fix = p.feed(GGA)
+    assert fix.lat == pytest.approx(48 + 7.038/60)
+    assert fix.lon == pytest.approx(-(11 + 31/60))
+    assert (fix.quality, fix.sats, fix.hdop, fix.alt) == (1, 8, 0.9, 545.4)
+    assert fix.utc == pytest.approx(12*3600 + 35*60 + 19)
+    # with GGA seen, RMC brings speed, heading and date, but no position
+    fix = p.feed(RMC)
+    assert fix.lat == pytest.approx(48 + 7.038/60)
+    assert fix.speed == pytest.approx(10*nmea.KNOTS)
+    assert (fix.heading, fix.date) == (84.4, (2024, 3, 23))
+    fix = p.feed(VTG)
+    assert (fix.heading, fix.speed) == (54.7, pytest.approx(5.5*nmea.KNOTS))
+    assert (p.sentences, p.positions, p.bad_checksum) == (3, 1, 0)
+
+def test_nmea_rejects():
+    p = nmea.NMEAParser()
+    assert p.feed(GGA.replace(b"*", b"*0")) is None # wrong checksum
+    assert p.feed(GGA[:GGA.rfind(b"*")]) is None # none at all
+    assert p.feed(sentence(b"GPGSV,3,1,11,03,03,111,00")) is None
+    assert p.feed(b"") is None
+    assert (p.sentences, p.bad_checksum, p.ignored) == (2, 2, 2)
+    assert p.fix is nmea.NO_FIX
+    # RMC positions count when the receiver sends no GGA
+    p.feed(RMC)
+    assert (p.fix.quality, p.positions) == (1, 1)
+
+def test_make_sources():
+    def handler(src, line, t): pass
+    assert gps.make_sources("", {}, handler) == []
+    assert gps.make_sources(None, {"port":""}, handler) == []
+    tcp, gpsd, ser = gps.make_sources("tcp://host:10110, gpsd://[::1], "
+                                      "socket://host:7", {}, handler)
+    assert (type(tcp), tcp.host, tcp.port) == (gps.TCPSource, "host", 10110)
+    assert (type(gpsd), gpsd.host, gpsd.port) == (gps.GPSDSource, "::1",
+                                                  gps.GPSD_PORT)
+    assert (type(ser), ser.url) == (gps.SerialSource, "socket://host:7")
+    with pytest.raises(ValueError): gps.make_sources("tcp://host", {},
+                                                     handler)
+
+
+def run_source(src, serve, until, timeout=5.):
+    """Run src against serve, an asyncio server connection callback, until
+until() is true; returns the connections served"""
+    connections = []
+    async def main():
+        async def handle(reader, writer):
+            connections.append(writer)
+            try: await serve(writer)
+            finally: writer.close()
+        server = await asyncio.start_server(handle, "127.0.0.1", src.port)
+        task = asyncio.create_task(src.run())
+        async def wait():
+            while not until(): await asyncio.sleep(0.01)
+        try: await asyncio.wait_for(wait(), timeout)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            server.close()
+            await server.wait_closed()
+    asyncio.run(main())
+    return connections
+
+def test_tcp_source_reconnects(fast_retries):
+    fixes = []
+    def handler(src, line, t):
+        fix = src.parser.feed(line)
+        if fix is not None: fixes.append(fix)
+    src = gps.TCPSource("127.0.0.1", free_port(), handler)
+    async def serve(writer): # two sentences, then hang up
+        writer.write(GGA + RMC)
+        await writer.drain()
+    conns = run_source(src, serve, lambda: len(fixes) >= 6)
+    assert len(conns) >= 3 and src.reconnects >= 2
+    assert src.lines >= 6 and src.parser.bad_checksum == 0
+    assert all(f.quality == 1 and f.sats == 8 for f in fixes)
+
+def test_quiet_source_is_reopened(fast_retries, monkeypatch):
+    monkeypatch.setattr(gps, "GPS_READ_TIMEOUT", 0.1)
+    def handler(src, line, t): src.parser.feed(line)
+    src = gps.TCPSource("127.0.0.1", free_port(), handler)
+    async def serve(writer): # nothing the parser knows, and no hang up
+        for i in range(20):
+            writer.write(b"$GPGSV,nothing,useful*00\r\n")
+            await asyncio.sleep(0.02)
+    conns = run_source(src, serve, lambda: src.reconnects >= 2)
+    assert len(conns) >= 2 and src.parser.sentences == 0
+
+def test_backoff_doubles_to_max(fast_retries, capsys):
+    def handler(src, line, t): pass
+    src = gps.TCPSource("127.0.0.1", free_port(), handler)
+    async def main(): # nobody listening at all
+        task = asyncio.create_task(src.run())
+        while src.reconnects < 5: await asyncio.sleep(0.005)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(main())
+    delays = [float(d) for d in re.findall(r"retrying in ([\d.]+) s",
+                                           capsys.readouterr().out)]
+    assert delays[:5] == [0.01, 0.02, 0.04, 0.04, 0.04]
+
+def test_serial_url_source(fast_retries):
+    pytest.importorskip("serial")
+    fixes = []
+    def handler(src, line, t):
+        fix = src.parser.feed(line)
+        if fix is not None: fixes.append(fix)
+    port = free_port()
+    src, = gps.make_sources("socket://127.0.0.1:%d" % port, {}, handler)
+    src.port = port # for run_source
+    async def serve(writer):
+        for i in range(5):
+            writer.write(GGA)
+            await writer.drain()
+            await asyncio.sleep(0.02)
+    run_source(src, serve, lambda: len(fixes) >= 3)
+    assert fixes[0].lat == pytest.approx(48 + 7.038/60)
@@ -0,0 +1,104 @@
+"""Publisher to subscribe() round trips, over each kind of socket"""
+
+import math
+import os
+
+import pytest
+
+import gps
+import publish
+from signal_logger import Location, Measurement
+
+from test_gps import free_port
+
+
+PCTL = (10, 50, 90)
+NAMES = ["A", "B"]
+
+
+def measurement(seq, values=(-101.5, -95.25, -90.)):
+    return Measurement(seq, 1700000000. + seq, -46., -93.5, 4096, PCTL,
+                       values, 10., 11., None)
+
+def check_frame(frame, i, m, loc):
+    assert (frame.receiver, frame.seq, frame.samples) == (i, m.seq, m.samples)
+    assert (frame.timestamp, frame.lat, frame.lon) == \
+           (m.timestamp, loc.lat, loc.lon)
+    assert (frame.cal, frame.rms) == (m.cal, m.rms)
+    assert math.isnan(frame.rms_db)
+    assert frame.values == pytest.approx(m.values, abs=1e-4) # float32
+
+
+@pytest.fixture
+def loop():
+    loop = gps.EventLoop()
+    loop.start()
+    yield loop
+    loop.stop()
+
+def round_trip(pub, url):
+    """Subscribe to pub at url, then publish and read back a few frames"""
+    frames = publish.subscribe(url, timeout=5.)
+    kind, cat = next(frames)
+    assert (kind, cat) == (publish.CATALOGUE, {"receivers":NAMES,
+                                               "pctl":list(PCTL)})
+    loc = Location(47.5, -122.25, 0.5)
+    sent = [(i % 2, measurement(i)) for i in range(1, 6)]
+    for i, m in sent: pub.publish(i, m, loc)
+    got = []
+    for kind, f in frames:
+        if kind == publish.MEASUREMENT_FRAME: got.append(f)
+        if len(got) == len(sent): break
+    for (i, m), f in zip(sent, got): check_frame(f, i, m, loc)
+    assert got[0].age == 0.5
+    frames.close()
+    return got
+
+def test_tcp(loop):
+    pub = publish.Publisher("tcp://127.0.0.1:0", NAMES, PCTL, loop)
+    pub.start()
+    try:
+        port = pub.server.sockets[0].getsockname()[1]
+        round_trip(pub, "tcp://127.0.0.1:%d" % port)
+        assert pub.frames == 5 and pub.kicked == 0
+    finally: pub.stop()
+
+@pytest.mark.skipif(os.name != "posix", reason="Unix sockets")
+def test_unix(loop, tmp_path):
+    url = "unix://%s" % (tmp_path / "sl.sock")
+    pub = publish.Publisher(url, NAMES, PCTL, loop)
+    pub.start()
+    try: round_trip(pub, url)
+    finally: pub.stop()
+    assert not os.path.exists(tmp_path / "sl.sock")
+
+def test_udp(loop, monkeypatch):
+    monkeypatch.setattr(publish, "PUBLISH_CATALOGUE", 0.05)
+    url = "udp://127.0.0.1:%d" % free_port()
+    pub = publish.Publisher(url, NAMES, PCTL, loop)
+    pub.start()
+    # the catalogue is repeated until the subscriber below is listening
+    try: round_trip(pub, url)
+    finally: pub.stop()
+
+def test_unknown_values_are_nan():
+    m = Measurement(7, 1.5, -46., None, 10, PCTL, None, 0., 1., None)
+    kind, f = publish.decode(publish.measurement_frame(
+        3, m, Location(0., 0., None), PCTL))
+    assert (kind, f.receiver, f.seq, f.samples) == \
+           (publish.MEASUREMENT_FRAME, 3, 7, 10)
+    assert all(math.isnan(v) for v in (f.age, f.rms, f.rms_db) + f.values)
+    assert len(f.values) == len(PCTL)
+
+def test_decode_rejects():
+    frame = publish.measurement_frame(0, measurement(1),
+                                      Location(0., 0., 1.), PCTL)
+    for bad in (b"SL", b"XX" + frame[2:], frame[:2] + b"\x09" + frame[3:],
+                frame[:publish.HEADER.size + 4]):
+        with pytest.raises(ValueError): publish.decode(bad)
+
+def test_parse_url():
+    assert publish.parse_url("tcp://:5076") == ("tcp", ("0.0.0.0", 5076))
+    assert publish.parse_url("UDP://[::1]:5076") == ("udp", ("::1", 5076))
+    for bad in ("tcp://host", "http://host:80", "udp://host:port"):
+        with pytest.raises(ValueError): publish.parse_url(bad)
@@ -0,0 +1,142 @@
+"""Recording a session, and replaying it"""
+
+import struct
+
+import pytest
+
+import signal_logger as sl
+import sigrec
+
+from test_dsp import iq_bytes
+from test_gps import sentence
+
+
+SR = 32000
+HOP = 1024
+HOPS = 40
+T0 = 1000. # monotonic time the recording starts at
+
+
+def gga(i):
+    return sentence(b"GPGGA,1200%02d.00,4807.%04d,N,01131.0000,E,1,08,0.9,"
+                    b"545.4,M,46.9,M,," % (i // 10, i))
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory):
+    """A recording of HOPS hops of I/Q, and a GGA line every 0.1 s of
+recorded time, written as --record writes them"""
+    fn = str(tmp_path_factory.mktemp("rec") / "session.sigrec")
+    rec = sl.Recorder(fn)
+    rec.open()
+    sid = rec.stream(SR, 2, HOP, 3, "Line In (hi-fi cable)")
+    j = 0 # sentences so far
+    for i in range(HOPS):
+        t = T0 + (i + 1)*HOP/SR
+        while T0 + j*0.1 <= t: # the sentences before this hop
+            rec.nmea(T0 + j*0.1, gga(j))
+            j += 1
+        rec.audio(sid, t, iq_bytes(HOP, i))
+    rec.close()
+    assert not rec.dropped and not rec.failed
+    return fn
+
+def replay(fn, sr=SR, workers=0, **kwargs):
+    """(every (Measurement, Location), ReplayManager) from replaying fn into
+one receiver at sample rate sr, made with kwargs"""
+    gpm = sl.GlobalParametersManager({})
+    rm = sl.ReplayManager(fn, gpm, workers)
+    mpm = sl.MultiParametersManager(adev="Line In", sr=sr, **kwargs)
+    sub = mpm.subscribe(maxsize=1000)
+    rm.attach(mpm)
+    rm.running = True
+    try: rm.run()
+    finally: rm.close()
+    out = []
+    while True:
+        m = sub.get(0)
+        if m is None: break
+        out.append((m, gpm.position_at(m.midpoint())))
+    return out, rm
+
+def test_record_format(recording):
+    rec = sigrec.Recording(recording)
+    kinds = [(kind, sid) for kind, sid, t, payload in rec]
+    assert kinds[0] == (sigrec.STREAM, 0)
+    assert kinds.count((sigrec.AUDIO, 0)) == HOPS
+    assert kinds.count((sigrec.NMEA, 0)) == int(HOPS*HOP/SR/0.1) + 1
+    stream = sigrec.parse_stream(next(iter(rec))[3])
+    assert stream == (SR, 2, HOP, 3, "Line In (hi-fi cable)")
+
+def test_replay_is_deterministic(recording):
+    a, rm = replay(recording, cs=HOP, compat=True)
+    b, rm = replay(recording, cs=HOP, compat=True)
+    assert len(a) == HOPS and a == b
+    rec = sigrec.Recording(recording)
+    for i, (m, loc) in enumerate(a):
+        assert m.end == T0 + (i + 1)*HOP/SR
+        assert m.timestamp == pytest.approx(rec.wall_time(m.end), abs=1e-6)
+        assert m.values is not None and m.rms_db is not None
+        assert loc.age is not None and loc.age < 0.1 # a fix every 0.1 s
+        assert 48 + 7/60 < loc.lat < 48 + 7.01/60
+    assert [loc.lat for m, loc in a] == sorted(loc.lat for m, loc in a)
+
+def test_replay_matches_live(recording):
+    """Replayed Measurements are the ones the live receiver made"""
+    mpm = sl.MultiParametersManager(sr=SR, cs=HOP, compat=True)
+    sub = mpm.subscribe(maxsize=1000)
+    for kind, sid, t, payload in sigrec.Recording(recording):
+        if kind == sigrec.AUDIO: mpm.feed(payload, t)
+    live = [sub.get(0) for i in range(HOPS)]
+    replayed = [m for m, loc in replay(recording, cs=HOP, compat=True)[0]]
+    assert [m._replace(timestamp=0.) for m in live] == \
+           [m._replace(timestamp=0.) for m in replayed]
+
+@pytest.mark.skipif(sl.shared_memory is None, reason="Python 3.8 or later")
+@pytest.mark.parametrize("mode", sl.PCT_MODES)
+def test_replay_in_workers(recording, mode):
+    """DSPWorkerPool processes measure what the replay thread does"""
+    a = replay(recording, cs=HOP, pct_mode=mode, compat=True)[0]
+    b = replay(recording, workers=2, cs=HOP, pct_mode=mode, compat=True)[0]
+    assert len(b) == HOPS
+    for (x, p), (y, q) in zip(a, b):
+        assert (x.seq, x.samples, x.values, x.end, p) == \
+               (y.seq, y.samples, y.values, y.end, q)
+        assert x.rms == pytest.approx(y.rms, abs=1e-9)
+
+@pytest.mark.parametrize("hop,cs", [(HOP//2, HOP), (HOP//4, HOP),
+                                    (2*HOP, 2*HOP)])
+def test_replay_rechunks(recording, hop, cs):
+    """A receiver with another hop_size gets the same audio, cut into its
+own hops: windows ending where the recorded hops' do measure the same"""
+    ref = [m for m, loc in replay(recording, cs=cs, hop=HOP,
+                                  pct_mode="histogram")[0]]
+    got = [m for m, loc in replay(recording, cs=cs, hop=hop,
+                                  pct_mode="histogram")[0]]
+    assert len(got) == HOPS*HOP//hop - cs//hop + 1
+    assert [m.end for m in got] == pytest.approx(
+        [T0 + (cs + i*hop)/SR for i in range(len(got))], abs=1e-9)
+    ends = {m.end:m for m in ref}
+    both = [(m, ends[m.end]) for m in got if m.end in ends]
+    assert len(both) == min(len(ref), len(got))
+    for m, r in both:
+        assert (m.samples, m.values) == (r.samples, r.values)
+        assert m.rms == pytest.approx(r.rms, abs=1e-9)
+
+def test_replay_wrong_rate(recording, capsys):
+    got, rm = replay(recording, cs=HOP)
+    assert not rm.unfed
+    got, rm = replay(recording, cs=HOP, sr=48000)
+    assert got == [] and len(rm.unfed) == 1
+    assert "recorded at 32000 Hz" in capsys.readouterr().out
+
+def test_truncated_recording(recording, tmp_path):
+    with open(recording, "rb") as f: data = f.read()
+    fn = tmp_path / "cut.sigrec"
+    fn.write_bytes(data[:-100]) # the recorder was killed mid-hop
+    assert len(list(sigrec.Recording(str(fn)))) == \
+           len(list(sigrec.Recording(recording))) - 1
+    fn.write_bytes(data[:sigrec.header_struct.size - 1])
+    with pytest.raises(ValueError): sigrec.Recording(str(fn))
+    fn.write_bytes(b"RIFF" + data[4:])
+    with pytest.raises(ValueError): sigrec.Recording(str(fn))
+    assert struct.calcsize(sigrec.HEADER_FORMAT) == sigrec.header_struct.size
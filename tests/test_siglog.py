@@ -0,0 +1,119 @@
+"""Reading binary logs of both format versions, and text logs"""
+
+import math
+import struct
+
+import pytest
+
+import siglog
+import signal_logger as sl
+
+
+PCTL = (10, 50, 87.5)
+
+
+def measurements(n, rms_db=True):
+    return [sl.Measurement(i + 1, 1700000000. + i/4, -46., -90. - i/8,
+                           4000 + i, PCTL, (-100. - i, -95. + i/4, -91.5),
+                           0., 1., 87. + i/2 if rms_db else None) \
+            for i in range(n)]
+
+def locations(n):
+    return [sl.Location(47.5 + i*1e-5, -122.25 - i*1e-5, 0.5)
+            for i in range(n)]
+
+def write_log(tmp_path, fmt, rows):
+    """Log rows, (Measurement, Location) pairs, as a receiver would; returns
+the file name"""
+    def new_fn(part=0, ext=".log"):
+        return str(tmp_path / ("siglog_A_%d%s" % (part, ext)))
+    w = sl.LogWriter(new_fn, "A", pctl=PCTL, fmt=fmt, block=True)
+    w.open()
+    for row in rows: w.write(*row)
+    w.close()
+    assert w.rows == len(rows) and not w.failed
+    return w.fn
+
+def write_v1(fn, rows):
+    """A version 1 log of rows, as Signal Logger 2.0 wrote them"""
+    head = bytearray(siglog.header_bytes("A", -46., PCTL))
+    struct.pack_into("<H", head, 4, 1)
+    row = siglog.row_struct(len(PCTL), 1)
+    with open(fn, "wb") as f:
+        f.write(head)
+        for m, loc in rows:
+            f.write(row.pack(m.timestamp, loc.lat, loc.lon, m.cal, m.rms,
+                             m.samples, *m.values))
+
+
+@pytest.mark.parametrize("rms_db", [True, False])
+def test_version_2(tmp_path, rms_db):
+    ms = measurements(10, rms_db)
+    locs = locations(10)
+    fn = write_log(tmp_path, "binary", list(zip(ms, locs)))
+    log = siglog.BinaryLog(fn)
+    assert (log.version, log.name, log.cal, log.pctl) == (2, "A", -46., PCTL)
+    rows = list(siglog.read_log(fn))
+    assert len(rows) == 10
+    for r, m, loc in zip(rows, ms, locs):
+        assert (r.timestamp, r.lat, r.lon, r.cal, r.samples) == \
+               (m.timestamp, loc.lat, loc.lon, m.cal, m.samples)
+        assert (r.rms, r.values) == (m.rms, m.values) # exact in float32
+        assert r.rms_db == m.rms_db and r.at(50) == m.at(50)
+    assert [r.rms for r in log.rows(3, 5)] == [m.rms for m in ms[3:5]]
+
+def test_version_1(tmp_path):
+    ms = measurements(10)
+    fn = str(tmp_path / "old.slog")
+    write_v1(fn, zip(ms, locations(10)))
+    log = siglog.BinaryLog(fn)
+    assert (log.version, log.name, log.pctl) == (1, "A", PCTL)
+    rows = list(log)
+    assert len(rows) == 10
+    for r, m in zip(rows, ms):
+        assert (r.timestamp, r.cal, r.rms, r.samples, r.values) == \
+               (m.timestamp, m.cal, m.rms, m.samples, m.values)
+        assert r.rms_db is None # version 1 rows have no separate one
+    assert [r.samples for r in log.rows(8)] == [m.samples for m in ms[8:]]
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_numpy(tmp_path, version):
+    np = pytest.importorskip("numpy")
+    ms = measurements(6)
+    rows = list(zip(ms, locations(6)))
+    if version == 1:
+        fn = str(tmp_path / "old.slog")
+        write_v1(fn, rows)
+    else: fn = write_log(tmp_path, "binary", rows)
+    with open(fn, "ab") as f: f.write(b"\0"*5) # a row still being written
+    log = siglog.BinaryLog(fn)
+    a = log.array()
+    assert len(a) == 6 and len(list(log)) == 6
+    assert a["rms"].tolist() == [m.rms for m in ms]
+    assert a["values"].tolist() == [list(m.values) for m in ms]
+    assert ("rms_db" in a.dtype.names) == (version == 2)
+    if version == 2:
+        assert np.allclose(a["rms_db"], [m.rms_db for m in ms])
+
+def test_text_matches_binary(tmp_path):
+    rows = list(zip(measurements(8), locations(8)))
+    binary = list(siglog.read_log(write_log(tmp_path, "binary", rows)))
+    text = list(siglog.read_log(write_log(tmp_path, "text", rows)))
+    assert len(text) == 8
+    for t, b in zip(text, binary):
+        assert (t.timestamp, t.samples, t.pctl) == \
+               (math.floor(b.timestamp), b.samples, b.pctl)
+        assert (t.lat, t.lon) == (pytest.approx(b.lat, abs=1e-6),
+                                  pytest.approx(b.lon, abs=1e-6))
+        assert t.rms == pytest.approx(b.rms, abs=0.005)
+        assert t.rms_db == pytest.approx(b.rms_db, abs=0.005)
+        assert t.values == pytest.approx(b.values, abs=0.05)
+        assert siglog.text_line(t) == siglog.text_line(b)
+
+def test_bad_headers(tmp_path):
+    fn = tmp_path / "bad.slog"
+    head = siglog.header_bytes("A", -46., PCTL)
+    for data in (head[:10], b"SLOX" + head[4:], head[:-8],
+                 head[:4] + struct.pack("<H", 3) + head[6:]):
+        fn.write_bytes(data)
+        with pytest.raises(ValueError): siglog.BinaryLog(str(fn))